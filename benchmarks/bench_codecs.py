@@ -0,0 +1,163 @@
+'''
+Microbenchmarks for the CPU-bound packet building and parsing code, with
+regression checks against stored baselines.
+
+Covers create_packet for every packet type, _text_to_bytes (which replaced
+_text_to_hex, next to the per-character encoding the tokenizer replaced), parse_program_content, parse_program_titles,
+encode_real, string_is_valid_number and the bulk TI real codec, from a
+one-line message up to programs near the 64 KB limit, using every character
+CharToHex knows. No hardware is needed.
+
+Run from the repository root:
+    python -m benchmarks.bench_codecs               compare with benchmarks/baselines.json
+    python -m benchmarks.bench_codecs --update      store the current numbers as the baseline
+    python -m benchmarks.bench_codecs --tolerance 0.3
+
+Baselines are machine specific: refresh them with --update after moving to
+another machine. The run exits with status 1 when a benchmark is slower than
+its baseline by more than the tolerance (default 25%).
+'''
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+
+from benchmarks.bench_tokenizer import SAMPLES as TOKENIZER_SAMPLES, character_encode
+from protocol import frames, ti_numbers
+from protocol.packet_manager import Packet_Manager
+from protocol.simulated_device import SimulatedTI84PlusCE
+from utils.helpers import string_is_valid_number
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_TOLERANCE = 0.25
+
+# Largest token count a program can hold: the 2-byte length field covers itself too
+PROGRAM_LIMIT = 0xFFFF - 2
+
+
+def charset_text(pm, token_bytes):
+    """Text cycling through every CharToHex character, encoding to about `token_bytes` bytes"""
+    chars = [char for char in pm.char_to_hex.char_to_hex if char != '\n']
+    cycle = ''.join(chars)
+    per_cycle = len(pm._text_to_bytes(cycle))
+    text = cycle * max(1, token_bytes // per_cycle)
+    while len(pm._text_to_bytes(text)) > token_bytes:
+        text = text[:-len(cycle) // 4 or -1]
+    return text
+
+
+def measure(func, min_seconds=0.05):
+    """Seconds per call: best of 5 runs of enough calls to last `min_seconds`"""
+    number = 1
+    while timeit.timeit(func, number=number) < min_seconds / 5:
+        number *= 4
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def benchmarks(pm):
+    """(name, function, bytes handled per call)"""
+    message = "author: someoneENTERmeet at the library after class, bring the notes"
+    sizes = {"1 line": charset_text(pm, 64), "1 KB": charset_text(pm, 1024),
+             "16 KB": charset_text(pm, 16 * 1024), "64 KB": charset_text(pm, PROGRAM_LIMIT)}
+
+    cases = [
+        ("create_packet send_var", lambda: pm.create_packet('send_var', var_name='X', var_value='3.14159'), 0),
+        ("create_packet read_prog", lambda: pm.create_packet('read_prog', title='QUESTION'), 0),
+        ("create_packet send_prog message", lambda: pm.create_packet('send_prog', title='MSG', text=message, replace=False),
+         len(message)),
+        ("create_packet send_progs x5", lambda: pm.create_packet(
+            'send_progs', programs=[(f"MSG{i}", message) for i in range(5)], existing={'MSG0'}), 5 * len(message)),
+    ]
+    for label, text in sizes.items():
+        cases.append((f"create_packet send_prog {label}",
+                      lambda text=text: pm.create_packet('send_prog', title='BIG', text=text, replace=True), len(text)))
+    for label, text in sizes.items():
+        cases.append((f"_text_to_bytes {label}", lambda text=text: pm._text_to_bytes(text), len(text)))
+    # Next to the per-character encoding it replaced, which is faster on plain text
+    for label, text in TOKENIZER_SAMPLES.items():
+        text = text * 20
+        cases.append((f"_text_to_bytes {label}", lambda text=text: pm._text_to_bytes(text), len(text)))
+        cases.append((f"character encode {label} (old)", lambda text=text: character_encode(text, pm._char_to_bytes),
+                      len(text)))
+    for label, text in sizes.items():
+        content = frames.program_content(pm._text_to_bytes(text))
+        cases.append((f"parse_program_content {label}", lambda content=content: pm.parse_program_content(content),
+                      len(content)))
+
+    sim = SimulatedTI84PlusCE()
+    for i in range(100):
+        sim.store_program(f"PROG{i:03d}", b'\xde' * (i + 1))
+    entries = [bytes(sim._var_header(f"PROG{i:03d}".encode('ascii'), listing=True)) for i in range(100)]
+    cases.append(("parse_program_titles x100", lambda: pm.parse_program_titles(entries), sum(map(len, entries))))
+
+    # Values as users type them: a different number on every call, some with ',' or an exponent
+    rng = np.random.default_rng(1)
+    scalars = (rng.standard_normal(100) * 10.0 ** rng.integers(-8, 9, 100)).tolist()
+    typed = [format(value, rng.choice(['.2f', '.6g', '.10g', '.3e'])).replace('.', rng.choice(['.', ',']))
+             for value in scalars]
+    cases.append(("encode_real x100", lambda: [ti_numbers.encode_real(value) for value in scalars], 8 * len(scalars)))
+    cases.append(("create_packet send_var x100", lambda: [pm.create_packet('send_var', var_name='X', var_value=text)
+                                                          for text in typed], sum(map(len, typed))))
+    numbers = ["0", "7", "42", "3.14159", "0.5", "1234567890", "99.99", "0,25", "100000", "2.718281828"]
+    candidates = numbers + ["-1", "abc", "1.2.3", "12345678901", "", "1e5"]
+    cases.append(("string_is_valid_number x16", lambda: [string_is_valid_number(s) for s in candidates],
+                  sum(map(len, candidates))))
+
+    values = np.random.default_rng(0).standard_normal(10_000) * 10.0 ** np.arange(-50, 50).repeat(100)
+    reals = ti_numbers.encode_reals(values).tobytes()
+    cases.append(("encode_reals 10k", lambda: ti_numbers.encode_reals(values), 8 * values.size))
+    cases.append(("decode_reals 10k", lambda: ti_numbers.decode_reals(reals), len(reals)))
+    cases.append(("create_packet send_list 999", lambda: pm.create_packet('send_list', name='L1', values=values[:999]),
+                  8 * 999))
+    cases.append(("create_packet send_matrix 30x30", lambda: pm.create_packet(
+        'send_matrix', name='[A]', values=values[:900].reshape(30, 30)), 8 * 900))
+    return cases
+
+
+def main(argv=None):
+    args = list(sys.argv[1:] if argv is None else argv)
+    update = '--update' in args
+    tolerance = DEFAULT_TOLERANCE
+    if '--tolerance' in args:
+        tolerance = float(args[args.index('--tolerance') + 1])
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+
+    pm = Packet_Manager()
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<38} {'ops/s':>12} {'MB/s':>8} {'baseline':>12} {'change':>8}")
+    for name, func, size in benchmarks(pm):
+        ops = 1 / measure(func)
+        results[name] = round(ops, 1)
+        rate = f"{ops * size / 1e6:8.2f}" if size else f"{'-':>8}"
+        baseline = baselines.get(name)
+        if baseline:
+            change = ops / baseline - 1
+            flag = "  REGRESSION" if change < -tolerance else ""
+            if flag:
+                regressions.append(name)
+            print(f"{name:<38} {ops:12.1f} {rate} {baseline:12.1f} {change:+7.0%}{flag}")
+        else:
+            print(f"{name:<38} {ops:12.1f} {rate} {'-':>12} {'-':>8}")
+
+    if update:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {BASELINE_PATH}")
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
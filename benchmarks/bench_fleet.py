@@ -0,0 +1,49 @@
+'''
+Measure how upload throughput scales with the number of calculators in a Fleet.
+
+Each simulated calculator adds USB latency and a bandwidth limit, so time is
+spent waiting on transfers the way it is with real hardware.
+
+Run from the repository root:
+    python -m benchmarks.bench_fleet
+'''
+import asyncio
+import time
+
+from protocol.fleet import Fleet
+from protocol.packet_manager import Packet_Manager
+from protocol.simulated_device import SimulatedTI84PlusCE
+
+UPLOADS = 48
+
+
+async def upload_all(count):
+    pm = Packet_Manager()
+    simulators = [SimulatedTI84PlusCE(latency=0.001, bandwidth=200_000, address=i + 1) for i in range(count)]
+    fleet = Fleet.discover(simulators=simulators)
+    await fleet.connect_all(pm.preset_packets.init)
+
+    packets = [pm.create_packet('send_prog', title=f"MSG{i:02d}", text="HELLO FROM THE FLEET " * 20, replace=False)
+               for i in range(UPLOADS)]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(fleet.run(lambda acalc, p=packet: acalc.perform_sequence(p)) for packet in packets))
+    seconds = time.perf_counter() - start
+    fleet.close()
+
+    assert all(results)
+    per_device = [member.completed for member in fleet]
+    return seconds, per_device
+
+
+def main():
+    print(f"{'calculators':>11} {'seconds':>8} {'uploads/s':>10} {'scaling':>8}  per calculator")
+    base = None
+    for count in (1, 2, 4, 8):
+        seconds, per_device = asyncio.run(upload_all(count))
+        rate = UPLOADS / seconds
+        base = base or rate
+        print(f"{count:11d} {seconds:8.3f} {rate:10.1f} {rate / base:7.2f}x  {per_device}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+'''
+Compare the table-driven token decoder with the dictionary lookup it replaced.
+
+Run from the repository root:
+    python -m benchmarks.bench_token_decoder
+'''
+import random
+import timeit
+
+from protocol.packet_manager import Packet_Manager
+
+
+def dictionary_decode(data, byte_to_char):
+    """The previous parse_program_content loop: two dictionary probes per position."""
+    result = []
+    i = 0
+    while i < len(data):
+        if i + 1 < len(data):
+            char = byte_to_char.get(data[i:i+2])
+            if char is not None:
+                result.append(char)
+                i += 2
+                continue
+
+        result.append(byte_to_char.get(data[i:i+1], '?'))
+        i += 1
+
+    return ''.join(result)
+
+
+def sample_program(pm, size, lowercase_share):
+    """Token bytes of a random program with roughly `size` bytes."""
+    rng = random.Random(size)
+    upper = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 \n:+-*/=()"
+    lower = "abcdefghijklmnopqrstuvwxyz"
+    tokens = bytearray()
+    while len(tokens) < size:
+        char = rng.choice(lower) if rng.random() < lowercase_share else rng.choice(upper)
+        tokens += pm._char_to_bytes[char]
+    return bytes(tokens)
+
+
+def main():
+    pm = Packet_Manager()
+    byte_to_char = {code: char for char, code in pm._char_to_bytes.items()}
+    decoder = pm._token_decoder
+
+    print(f"{'program':<22} {'dict lookup':>12} {'tables':>12} {'streaming':>12} {'speedup':>8}")
+    for size in (200, 2_000, 20_000):
+        for share in (0.0, 0.5):
+            data = sample_program(pm, size, share)
+            assert decoder.decode(data) == dictionary_decode(data, byte_to_char)
+
+            def streamed():
+                stream = decoder.stream()
+                text = [stream.feed(data[i:i + 64]) for i in range(0, len(data), 64)]
+                text.append(stream.finish())
+                return ''.join(text)
+
+            runs = max(1, 200_000 // size)
+            old = min(timeit.repeat(lambda: dictionary_decode(data, byte_to_char), number=runs, repeat=5)) / runs
+            new = min(timeit.repeat(lambda: decoder.decode(data), number=runs, repeat=5)) / runs
+            stream = min(timeit.repeat(streamed, number=runs, repeat=5)) / runs
+            label = f"{len(data)} B, {share:.0%} lowercase"
+            print(f"{label:<22} {old * 1e6:10.1f}us {new * 1e6:10.1f}us {stream * 1e6:10.1f}us {old / new:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''
+Compare payload size and encode throughput of the longest-match tokenizer
+with the character-by-character encoding it replaced.
+
+Run from the repository root:
+    python -m benchmarks.bench_tokenizer
+'''
+import timeit
+
+from protocol.packet_manager import Packet_Manager
+
+
+def hex_encode(text, char_to_hex):
+    """The original _text_to_hex: hex strings per character, converted to bytes at the end."""
+    hex_codes = []
+    for char in text.replace("ENTER", "\n"):
+        if char in char_to_hex:
+            hex_codes.extend(char_to_hex[char])
+    return bytes.fromhex(''.join(hex_codes))
+
+
+def character_encode(text, char_to_bytes):
+    """The previous _text_to_bytes loop: one lookup per character, unknown characters dropped."""
+    encoded = bytearray()
+    for char in text.replace("ENTER", "\n"):
+        code = char_to_bytes.get(char)
+        if code is not None:
+            encoded += code
+    return bytes(encoded)
+
+
+SAMPLES = {
+    "chat message": "hey, are you there? the test starts at 10:30 and ends at noon. good luck!",
+    "shouted message": "MEET AT THE LIBRARY AFTER CLASS, BRING THE NOTES FOR CHAPTER 7",
+    "TI-BASIC program": (
+        "ClrHome\n"
+        "Disp \"GUESS THE NUMBER\"\n"
+        "randInt(1,100)→N\n"
+        "0→T\n"
+        "Repeat G=N\n"
+        "Input \"GUESS? \",G\n"
+        "T+1→T\n"
+        "If G<N:Disp \"HIGHER\"\n"
+        "If G>N:Disp \"LOWER\"\n"
+        "End\n"
+        "Disp \"GOT IT IN\",T\n"
+    ),
+}
+
+
+def main():
+    pm = Packet_Manager()
+    char_to_bytes = pm._char_to_bytes
+    char_to_hex = pm.char_to_hex.char_to_hex
+
+    def throughput(encode, text):
+        runs = 200
+        seconds = min(timeit.repeat(lambda: encode(text), number=runs, repeat=5)) / runs
+        return f"{len(text) / seconds / 1e6:6.2f}M/s"
+
+    print(f"{'sample':<18} {'old bytes':>9} {'new bytes':>9} {'saved':>6} "
+          f"{'hex enc':>9} {'char enc':>9} {'token enc':>9}")
+    for name, text in SAMPLES.items():
+        text = text * 20
+        old = character_encode(text, char_to_bytes)
+        new = pm._text_to_bytes(text)
+        assert pm._token_decoder.decode(new) == text
+
+        saved = 1 - len(new) / len(old)
+        print(f"{name:<18} {len(old):9d} {len(new):9d} {saved:6.0%} "
+              f"{throughput(lambda t: hex_encode(t, char_to_hex), text):>9} "
+              f"{throughput(lambda t: character_encode(t, char_to_bytes), text):>9} "
+              f"{throughput(pm._text_to_bytes, text):>9}")
+    print("Characters per second; old bytes leave out characters the old mapping did not know.")
+
+
+if __name__ == "__main__":
+    main()
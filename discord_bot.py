@@ -1,11 +1,10 @@
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord.commands import Option
-import threading
 import asyncio
 
 # Import your main_controller module (replace with actual import)
-import main_controller  # Ensure this has .discord_loop(), .discord_message_in, and .discord_message_out
+import main_controller  # Ensure this has async .discord_loop(), .discord_inbox, and .discord_outbox
 
 # Bot setup
 intents = discord.Intents.default()
@@ -15,16 +14,19 @@ bot = commands.Bot(command_prefix="!", intents=intents)
 CHANNEL_ID = 1412860288679546975  # 🔁 REPLACE THIS
 GUILD_ID = 1412860287828361248    # 🔁 REPLACE THIS
 
+# Set once the TI-84 answers the comms check
+comms_confirmed = asyncio.Event()
+
 
 @bot.event
 async def on_ready():
     print(f"✅ Logged in as {bot.user}")
 
-    # Start TI-84 comms loop in background
-    threading.Thread(target=main_controller.discord_loop, daemon=True).start()
+    # Start TI-84 comms loop on the bot's event loop
+    bot.loop.create_task(main_controller.discord_loop())
 
-    # Start checking for messages from TI-84
-    check_for_outgoing_message.start()
+    # Relay messages from TI-84 as soon as they arrive
+    bot.loop.create_task(relay_outgoing_messages())
 
     # Run comms check
     await comms_check_sequence()
@@ -45,15 +47,15 @@ async def comms_check_sequence():
     )
 
     # Send test message to TI-84
-    main_controller.discord_message_in.append({
+    main_controller.discord_inbox.put_nowait({
         "title": "CHECK",
         "text": "SYSTEM: Initiate comms confirmation sequence."
     })
-    main_controller.discord_message_in.append({
+    main_controller.discord_inbox.put_nowait({
         "title": "QUESTION",
         "text": "Comms confirmed"
     })
-    main_controller.discord_message_in.append({
+    main_controller.discord_inbox.put_nowait({
         "title": "SEND",
         "text": "SEND"
     })
@@ -61,29 +63,26 @@ async def comms_check_sequence():
     print("📡 Sent test message to TI-84. Waiting for confirmation...")
 
     # Wait for "Comms confirmed" message for up to 30 seconds
-    for _ in range(30):  # Check every 1 seconds
-        await asyncio.sleep(1)
-
-        if main_controller.discord_message_out:
-            if "Comms confirmed" in main_controller.discord_message_out:
-                await channel.send(
-                    "**TI-84 Link Established**\n"
-                    "Comms link with TI-84 has been successfully confirmed.\n"
-                    "Message relay is now operational.\n"
-                    "--------------------------------------\n"
-                    "**You may now submit messages using** `/send-message`."
-                )
-                print("✅ Comms confirmed.")
-                main_controller.discord_message_out = None
-                return
+    try:
+        await asyncio.wait_for(comms_confirmed.wait(), 30)
+    except asyncio.TimeoutError:
+        # Timeout fallback
+        await channel.send(
+            "**Comms Check Failed**\n"
+            "Did not receive confirmation from TI-84 within expected time.\n"
+            "Please check hardware connection and restart the bot."
+        )
+        print("Comms check failed.")
+        return
 
-    # Timeout fallback
     await channel.send(
-        "**Comms Check Failed**\n"
-        "Did not receive confirmation from TI-84 within expected time.\n"
-        "Please check hardware connection and restart the bot."
+        "**TI-84 Link Established**\n"
+        "Comms link with TI-84 has been successfully confirmed.\n"
+        "Message relay is now operational.\n"
+        "--------------------------------------\n"
+        "**You may now submit messages using** `/send-message`."
     )
-    print("Comms check failed.")
+    print("✅ Comms confirmed.")
 
 
 @bot.slash_command(
@@ -104,7 +103,7 @@ async def send_message(
     print("--------------------------------")
 
     # Send to TI-84
-    main_controller.discord_message_in.append({
+    main_controller.discord_inbox.put_nowait({
         "title": title,
         "text": f"author: {ctx.author}ENTER{message}"
     })
@@ -112,16 +111,29 @@ async def send_message(
     await ctx.respond(f"{message.replace("ENTER", "\n")}\n✅ Your message has been sent to the TI-84!")
 
 
-@tasks.loop(seconds=5)
-async def check_for_outgoing_message():
-    if main_controller.discord_message_out is not None:
+@bot.slash_command(
+    name="stats",
+    description="Show TI-84 link latency and error stats",
+    guild_ids=[GUILD_ID]
+)
+async def stats(ctx: discord.ApplicationContext):
+    summary = main_controller.link_stats()
+    await ctx.respond(f"```\n{summary[:1900]}\n```")
+
+
+async def relay_outgoing_messages():
+    while True:
+        message_text = await main_controller.discord_outbox.get()
+
+        if not comms_confirmed.is_set() and "Comms confirmed" in message_text:
+            comms_confirmed.set()
+            continue
+
         channel = bot.get_channel(CHANNEL_ID)
 
         if channel is None:
             print("⚠️ Could not find the target channel.")
-            return
-
-        message_text = main_controller.discord_message_out
+            continue
 
         if message_text.strip() == "Lost connection with TI84":
             try:
@@ -134,6 +146,7 @@ async def check_for_outgoing_message():
                 await bot.close()
             except Exception as e:
                 print(f"Failed to send shutdown message: {e}")
+            return
 
         elif message_text.strip().upper() == "DELETE ALL CHATS":
             try:
@@ -152,8 +165,6 @@ async def check_for_outgoing_message():
             except Exception as e:
                 print(f"Failed to send message: {e}")
 
-        main_controller.discord_message_out = None
-
 
 
 # Run the bot
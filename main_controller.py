@@ -1,12 +1,36 @@
+import os
 import sys
-import time
+import asyncio
+import contextlib
+import usb.core
 from protocol.ti_comands import TI84PlusCE
+from protocol.async_ti_comands import AsyncTI84PlusCE
 from protocol.packet_manager import Packet_Manager
-from utils.logger import create_new_log
+from protocol.program_directory import ProgramDirectory
+from protocol.program_contents import ProgramContents
+from protocol import frames
+from protocol.reconnect import ReconnectManager
+from utils.logger import log, create_new_log, log_dir
 
 # Initialize calculator and packet manager
 calc = TI84PlusCE()
 pm = Packet_Manager()
+# Async front end on the same device, used by the Discord relay
+acalc = AsyncTI84PlusCE(calc)
+# Program titles on the calculator, shared by both front ends
+directory = ProgramDirectory(calc, ttl=300)
+# Digests of the program contents on the calculator, so unchanged uploads can be skipped
+contents = ProgramContents(calc, ttl=300)
+
+# Link metrics snapshots, rewritten after every question check
+METRICS_JSON = os.path.join(log_dir, 'link-metrics.json')
+METRICS_PROM = os.path.join(log_dir, 'link-metrics.prom')
+
+# Messages exchanged with discord_bot: Discord -> calculator and calculator -> Discord
+discord_inbox = asyncio.Queue()
+discord_outbox = asyncio.Queue()
+# Longest piece of a calculator reply queued for Discord at once (messages are capped at 2000 characters)
+DISCORD_CHUNK = 1900
 
 
 def send_variable():
@@ -15,34 +39,228 @@ def send_variable():
     packet = pm.create_packet('send_var', var_name=var_name, var_value=var_value)
     calc.perform_sequence(packet)
 
-def send_program(title = None, text = None):
+def send_variables(variables):
+    """
+    Upload several real variables, e.g. {'A': 1.5, 'B': 42}, in one transfer session
+    
+    Returns:
+        {name: True if the calculator stored it}
+    """
+    results = {name.strip().upper(): False for name in variables}
+    packet = pm.create_packet('send_vars', variables=variables)
+    if packet:
+        results.update(calc.run_sequence(packet).part_results())
+    stored = [name for name, ok in results.items() if ok]
+    failed = [name for name, ok in results.items() if not ok]
+    print(f"Stored {len(stored)} of {len(results)} variables" + (f", failed: {', '.join(failed)}" if failed else ""))
+    return results
+
+def send_list(name, values):
+    """Upload an array of numbers as list L1-L6 or a named list; True if the calculator took it"""
+    packet = pm.create_packet('send_list', name=name, values=values)
+    return bool(packet) and calc.run_sequence(packet).ok
+
+def send_matrix(name, values):
+    """Upload a 2-D array of numbers as matrix [A]-[J]; True if the calculator took it"""
+    packet = pm.create_packet('send_matrix', name=name, values=values)
+    return bool(packet) and calc.run_sequence(packet).ok
+
+def read_variables(names):
+    """
+    Read several reals, lists and matrices, e.g. ['A', 'L1', '[B]'], in one transfer session
+    
+    Returns:
+        {name: float, complex or NumPy array}, with None for variables that could not be read
+    """
+    values = {name.strip().upper(): None for name in names}
+    packet = pm.create_packet('read_vars', names=names)
+    if packet:
+        values.update(pm.parse_variables(calc.run_sequence(packet)))
+    return values
+
+def send_program(title = None, text = None, force = False):
     if title == None:
         title = input("Enter program title: ").strip().upper()
     if text == None:
         text = input("Enter program text: ")
 
-    # Check if program exists already
-    program_names_packet = calc.get_all_program_names()
+    send_programs([(title, text)], force)
+
+def changed_programs(programs, force=False):
+    """
+    Encode (title, text) programs and leave out those the calculator already holds
+    
+    Only the last program of a title is kept, as it is the one that would end
+    up on the calculator. With `force` nothing is left out.
+    
+    Returns:
+        List of (title, tokens) pairs still to upload
+    """
+    latest = {}
+    for title, text in programs:
+        latest.pop(title, None)
+        latest[title] = pm.encode_program(text)
+    
+    changed = []
+    for title, tokens in latest.items():
+        if not force and contents.unchanged(title, tokens):
+            log(f"{title} is unchanged on the calculator, not uploading it")
+            continue
+        changed.append((title, tokens))
+    return changed
+
+def send_programs(programs, force=False):
+    """
+    Upload several (title, text) programs in one transfer session, skipping unchanged ones.
+
+    If the calculator refuses a program as already existing (one created on
+    the calculator since the directory was cached), the directory is listed
+    again and the session retried once.
+    """
+    programs = changed_programs(programs, force)
+    if not programs:
+        print("Programs are unchanged, nothing to send.")
+        return
+    titles = [title for title, _ in programs]
+
+    mismatches = calc.mismatch_count
+    result = calc.run_sequence(pm.create_packet('send_progs', programs=programs, existing=existing_programs(titles)))
+    if refused_as_existing(result):
+        log("Calculator already had a program the directory cache missed, listing again and retrying")
+        directory.invalidate()
+        mismatches = calc.mismatch_count
+        result = calc.run_sequence(pm.create_packet('send_progs', programs=programs,
+                                                    existing=existing_programs(titles, refused=True)))
+    record_transfer(programs, result.ok, mismatches)
+    if result.seconds:
+        print(f"Sent {result.bytes_sent} bytes in {result.seconds * 1000:.0f} ms "
+              f"({result.bytes_sent / result.seconds / 1024:.1f} KB/s)")
+
+async def send_programs_async(programs, force=False):
+    """send_programs for the Discord relay, without blocking the event loop."""
+    programs = changed_programs(programs, force)
+    if not programs:
+        return
+    titles = [title for title, _ in programs]
+
+    mismatches = calc.mismatch_count
+    result = await acalc.run_sequence(pm.create_packet('send_progs', programs=programs,
+                                                       existing=await existing_programs_async(titles)))
+    if refused_as_existing(result):
+        log("Calculator already had a program the directory cache missed, listing again and retrying")
+        directory.invalidate()
+        mismatches = calc.mismatch_count
+        existing = await existing_programs_async(titles, refused=True)
+        result = await acalc.run_sequence(pm.create_packet('send_progs', programs=programs, existing=existing))
+    record_transfer(programs, result.ok, mismatches)
+
+def existing_programs(titles, refused=False):
+    """
+    Titles to send as replacements: from the directory cache, or else a listing.
+
+    If the listing fails, all of `titles` are sent as new programs, or as
+    replacements when the calculator has just `refused` one as existing.
+    """
+    if directory.is_valid():
+        return directory.titles()
+    try:
+        return find_programs(titles)
+    except usb.core.USBError:
+        return set(titles) if refused else set()
+
+async def existing_programs_async(titles, refused=False):
+    """existing_programs for the Discord relay, without blocking the event loop."""
+    if directory.is_valid():
+        return directory.titles()
+    try:
+        return await find_programs_async(titles)
+    except usb.core.USBError:
+        return set(titles) if refused else set()
+
+def refused_as_existing(result):
+    """True if the calculator answered an upload session with ERROR_EXISTS"""
+    return any(frame == frames.ERROR_EXISTS for _, _, frame in result.mismatches)
+
+def find_programs(titles):
+    """
+    Return which of `titles` are stored on the calculator.
+
+    The whole listing is read, as stopping early would not save link time
+    (the rest still has to be drained), so it always refreshes the directory
+    cache and checks the content cache against the program sizes.
+    """
+    sizes = {}
+    with contextlib.closing(calc.iter_directory()) as entries:
+        for entry in entries:
+            sizes[frames.program_entry_title(entry)] = frames.program_entry_size(entry)
+    return found_programs(titles, sizes)
+
+async def find_programs_async(titles):
+    """find_programs for the Discord relay, without blocking the event loop."""
+    sizes = {}
+    async with contextlib.aclosing(acalc.iter_directory()) as entries:
+        async for entry in entries:
+            sizes[frames.program_entry_title(entry)] = frames.program_entry_size(entry)
+    return found_programs(titles, sizes)
+
+def found_programs(titles, sizes):
+    """Fill the caches from a complete listing of {title: size} and return which of `titles` it holds."""
+    directory.fill(sizes)
+    # Programs edited on the calculator show up with a different size
+    contents.check_sizes(sizes)
+    return set(titles).intersection(sizes)
+
+def refresh_directory(program_names_packet):
+    """Fill the directory cache from a listing and return the titles."""
+    if program_names_packet is False:
+        # Listing failed, nothing to cache
+        return []
     program_names = pm.parse_program_titles(program_names_packet)
-    if title in program_names:
-        packet = pm.create_packet('send_prog', title=title, text=text, replace=True)
-    else:
-        packet = pm.create_packet('send_prog', title=title, text=text, replace=False)
+    directory.fill(program_names)
+    # Programs edited on the calculator show up with a different size
+    contents.check_sizes({title: frames.program_entry_size(entry)
+                          for title, entry in zip(program_names, program_names_packet)})
+    return program_names
 
-    calc.perform_sequence(packet)
+def record_transfer(programs, succeeded, mismatches_before):
+    """Keep the directory and content caches in step with an upload or read of (title, tokens) programs."""
+    if succeeded and calc.mismatch_count == mismatches_before:
+        for title, tokens in programs:
+            directory.add(title)
+            contents.record(title, tokens)
+    else:
+        # The calculator did not answer as expected; list again next time
+        directory.invalidate()
+        for title, _ in programs:
+            contents.discard(title)
 
 def disable_exam_mode():
     packet = pm.preset_packets.quit_exam_mode
     calc.perform_sequence(packet)
 
 def list_programs():
-    program_names_packet = calc.get_all_program_names()
-    program_names = pm.parse_program_titles(program_names_packet)
+    program_names = refresh_directory(calc.get_all_program_names())
+    listing = calc.last_listing
+    if listing is not None:
+        print(f"Listed {listing['entries']} variables in {listing['seconds'] * 1000:.0f} ms")
     print("Stored Programs:")
     for i, name in enumerate(program_names, 1):
         print(f"{i}. {name}")
     return program_names
 
+def link_stats():
+    """Latency and counter summary of the calculator link (used by the Discord /stats command)"""
+    return acalc.calc.metrics.summary() + '\n' + contents.summary()
+
+def write_metrics():
+    """Write the link metrics as JSON and Prometheus text snapshot files"""
+    metrics = acalc.calc.metrics
+    try:
+        metrics.write_snapshot(METRICS_JSON)
+        metrics.write_snapshot(METRICS_PROM)
+    except OSError as e:
+        print(f"Could not write link metrics: {e}")
+
 def read_program():
     programs = list_programs()
     if not programs:
@@ -53,95 +271,137 @@ def read_program():
         print("Invalid program title.")
         return
     packet = pm.create_packet("read_prog", title=choice)
-    program_content_packet = calc.get_program_content(packet)
-    content = pm.parse_program_content(program_content_packet)
-    print(f"Content of {choice}:\n{content}")
-
-def discord_loop(interval_seconds=60):
-    global discord_message_out
-    global discord_message_in
-    discord_message_out = None
-    discord_message_in = []
-
-    time.sleep(3)
+    mismatches = calc.mismatch_count
+    print(f"Content of {choice}:")
+    tokens = bytearray()
+    def received():
+        for chunk in calc.iter_program_content(packet):
+            tokens.extend(chunk)
+            yield chunk
+    try:
+        # Text is printed as it is decoded, while the rest is still arriving
+        for text in pm.iter_program_text(received()):
+            print(text, end='', flush=True)
+        succeeded = True
+    except usb.core.USBError as e:
+        print(f"\nRead failed: {e}")
+        succeeded = False
+    print()
+    record_transfer([(choice, bytes(tokens))], succeeded, mismatches)
+
+async def forward_program_async(title):
+    """
+    Stream a program from the calculator to discord_outbox
+    
+    Long programs are forwarded in DISCORD_CHUNK pieces as soon as each has
+    been decoded, instead of after the whole transfer. Raises usb.core.USBError
+    if the read fails.
+    """
+    packet = pm.create_packet("read_prog", title=title)
+    decoder = pm.program_text_decoder()
+    pending = ""
+    forwarded = False
+    tokens = bytearray()
+    mismatches = calc.mismatch_count
+    async with contextlib.aclosing(acalc.iter_program_content(packet)) as chunks:
+        async for chunk in chunks:
+            tokens.extend(chunk)
+            pending += decoder.feed(chunk)
+            while len(pending) >= DISCORD_CHUNK:
+                discord_outbox.put_nowait(pending[:DISCORD_CHUNK])
+                pending = pending[DISCORD_CHUNK:]
+                forwarded = True
+    record_transfer([(title, bytes(tokens))], True, mismatches)
+    pending += decoder.finish()
+    if pending or not forwarded:
+        discord_outbox.put_nowait(pending)
+
+async def discord_loop(interval_seconds=60, reconnect_timeout=60):
+    await asyncio.sleep(3)
     create_new_log()
 
     print("TI-84 Plus CE USB Communication Script")
     print("=====================================")
     
     # Find the device
-    if not calc.find_device():
+    if not await acalc.find_device():
         print("\nTroubleshooting steps:")
         print("1. Install Zadig and replace the calculator's driver with libusb-win32 or WinUSB")
         print("2. Check Device Manager for the actual VID/PID of your calculator")
         print("3. Update the VID/PID values in the script if needed")
-        sys.exit(1)
+        return
     
     # Setup the device
-    if not calc.setup_device():
-        sys.exit(1)
+    if not await acalc.setup_device():
+        return
 
     
     print("\nDevice setup successful!")
     print("Initializing connection to the calculator...")
 
-    if not calc.perform_sequence(pm.preset_packets.init):
+    # Keeps the handshake answers, so a dropped link comes back with a short probe
+    reconnector = ReconnectManager(acalc.calc, pm.preset_packets)
+    if not await acalc.call(reconnector.run_handshake):
         print("Failed to create initial usb connection...")
-        sys.exit(1)
+        return
     
     print("\nInitial handshake successful!")
 
-    i = 1
+    loop = asyncio.get_running_loop()
+    next_check = loop.time() + interval_seconds - 5
+    print("Checking for question in", str(interval_seconds - 5), "seconds")
 
     while True:
-        # Check for new messages from Discord
-        if discord_message_in:
-            for message in discord_message_in:
-                print("\nSending Message to calculator...")
-                send_program(message["title"].strip().upper(), message["text"])
-                if "Comms confirmed" in message["text"]:
-                    i = 12
-
-        discord_message_in = []
-
-        if i != 12:
-            print("Checking for question in", str(interval_seconds - (i * 5)), "seconds")
+        # Wake up for a new Discord message or when the next question check is due
+        try:
+            if discord_inbox.empty():
+                message = await asyncio.wait_for(discord_inbox.get(), max(0, next_check - loop.time()))
+            else:
+                message = discord_inbox.get_nowait()
+        except asyncio.TimeoutError:
+            message = None
+
+        try:
+            if message is not None:
+                # Upload everything that queued up while the link was busy in one session
+                messages = [message]
+                while not discord_inbox.empty():
+                    messages.append(discord_inbox.get_nowait())
+
+                print(f"\nSending {len(messages)} message(s) to calculator...")
+                await send_programs_async([(m["title"].strip().upper(), m["text"]) for m in messages])
+                if any("Comms confirmed" in m["text"] for m in messages):
+                    next_check = loop.time()
+                continue
 
-        elif i == 12:
             print("Checking for question...")
 
-            try:
-                # Try to talk to the calculator
-                program_names_packet = calc.get_all_program_names()
-                
-                
-                if not program_names_packet:
-                    print(f"❌ Lost connection to TI-84")
-                    discord_message_out = "Lost connection with TI84"
-                    break  # Stop the loop if connection is lost
-
-                program_names = pm.parse_program_titles(program_names_packet)
-                if "SEND" in program_names and "QUESTION" in program_names:
-                    packet = pm.create_packet("read_prog", title="SEND")
-                    program_content_packet = calc.get_program_content(packet)
-                    content = pm.parse_program_content(program_content_packet)
-
-                    if content.strip().upper() == "SEND":
-                        packet = pm.create_packet("read_prog", title="QUESTION")
-                        program_content_packet = calc.get_program_content(packet)
-                        content = pm.parse_program_content(program_content_packet)
-
-                        discord_message_out = content
-                        send_program("SEND", "")
-            except Exception as e:
-                print(f"❌ Lost connection to TI-84: {e}")
-                discord_message_out = "Lost connection with TI84"
-                break  # Stop the loop if connection is lost
-
-            i = 0
-
-        time.sleep(5)
-        i += 1
+            # Try to talk to the calculator, a failed listing raises
+            found = await find_programs_async(("SEND", "QUESTION"))
+            if len(found) == 2:
+                packet = pm.create_packet("read_prog", title="SEND")
+                mismatches = calc.mismatch_count
+                program_content_packet = await acalc.get_program_content(packet)
+                record_transfer([("SEND", pm.program_content_tokens(program_content_packet))],
+                                program_content_packet is not None, mismatches)
+                content = pm.parse_program_content(program_content_packet)
+
+                if content.strip().upper() == "SEND":
+                    await forward_program_async("QUESTION")
+                    await send_programs_async([("SEND", "")])
+        except Exception as e:
+            print(f"❌ Lost connection to TI-84: {e}")
+            print("Trying to reconnect...")
+            if not await acalc.call(reconnector.reconnect, reconnect_timeout):
+                discord_outbox.put_nowait("Lost connection with TI84")
+                break  # Stop the loop if the calculator does not come back
+            print("✅ Reconnected to TI-84")
+            next_check = loop.time()
+            continue
+
+        write_metrics()
+        next_check = loop.time() + interval_seconds
+        print("Checking for question in", str(interval_seconds), "seconds")
 
     
 
@@ -181,7 +441,8 @@ def main():
         print("3. Disable Exam Mode")
         print("4. List Stored Programs")
         print("5. Read a Program")
-        print("6. Exit")
+        print("6. Show Link Stats")
+        print("7. Exit")
 
         choice = input("Choose an option: ")
 
@@ -196,6 +457,8 @@ def main():
         elif choice == '5':
             read_program()
         elif choice == '6':
+            print(link_stats())
+        elif choice == '7':
             print("Goodbye!")
             break
         else:
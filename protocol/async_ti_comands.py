@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import usb.core
+
+from utils.logger import log, debug, error
+from protocol.ti_comands import TI84PlusCE
+from protocol import frames
+
+
+class AsyncTI84PlusCE:
+    """
+    asyncio front end for TI84PlusCE.
+
+    All pyusb calls run on one dedicated I/O thread so they never block the event
+    loop. Operations are serialized with a lock because the link carries one
+    transaction at a time.
+
+    Only receive_data reads in slices, so its timeout or a task cancellation
+    takes effect within `poll_interval`. run_sequence and the listing and
+    download generators run the synchronous engine on the I/O thread, and its
+    blocking reads cannot be interrupted. Cancelling run_sequence returns at
+    once, but the step in progress holds the I/O thread until its read returns
+    (up to 1 s), and later calls queue behind it. Cancelling or closing a
+    generator takes effect once its current read returns (up to `idle_timeout`)
+    and the rest of the listing or download has been drained.
+
+    Args:
+        calc: TI84PlusCE to drive (a new one is created if omitted)
+        simulator: Optional SimulatedTI84PlusCE, passed on to the new TI84PlusCE
+        poll_interval: Seconds per blocking read slice in receive_data
+    """
+
+    def __init__(self, calc=None, simulator=None, poll_interval=0.05):
+        self.calc = calc if calc is not None else TI84PlusCE(simulator=simulator)
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ti84-usb")
+        self._lock = asyncio.Lock()
+
+    async def _run(self, func, *args):
+        """Run a blocking call on the USB I/O thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _read_slice(self, timeout_ms):
+        # A frame cut off by the slice timeout stays in the receive buffer for the next slice
+        frame = self.calc.read_frame(timeout_ms)
+        return bytes(frame) if frame is not None else None
+
+    async def call(self, func, *args):
+        """Run a blocking function (e.g. ReconnectManager.reconnect) on the I/O thread with the link locked"""
+        async with self._lock:
+            return await self._run(func, *args)
+
+    async def find_device(self):
+        return await self._run(self.calc.find_device)
+
+    async def setup_device(self):
+        return await self._run(self.calc.setup_device)
+
+    async def send_data(self, data, description=None, chunked=None):
+        return await self._run(self.calc.send_data, data, description, chunked)
+
+    async def receive_data(self, timeout=1.0):
+        """Receive one frame, or None once `timeout` seconds pass without data"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            slice_ms = max(1, int(min(self.poll_interval, remaining) * 1000))
+            try:
+                response = await self._run(self._read_slice, slice_ms)
+            except usb.core.USBError as e:
+                error(f"Receive error: {e}")
+                self.calc.metrics.count('receive_errors')
+                return None
+            if response is not None:
+                debug("Received %d bytes, raw type %d", len(response), response[4])
+                return response
+            if time.monotonic() >= deadline:
+                log("Receive timeout - no data received")
+                self.calc.metrics.count('timeouts')
+                return None
+
+    async def run_sequence(self, sequence):
+        """Async counterpart of TI84PlusCE.run_sequence"""
+        async with self._lock:
+            return await self._run(self.calc.run_sequence, sequence)
+
+    async def perform_sequence(self, sequence):
+        """Execute a transaction sequence (same format as TI84PlusCE.perform_sequence)"""
+        return (await self.run_sequence(sequence)).ok
+
+    async def get_all_program_names(self):
+        """
+        Get all program names from the calculator
+
+        Returns:
+            List of directory entry frames for TI-BASIC programs, or False on failure
+        """
+        log("Starting get_all_program_names...")
+        start = time.perf_counter()
+        try:
+            program_responses = [entry async for entry in self.iter_directory()]
+        except usb.core.USBError as e:
+            error(f"get_all_program_names failed: {e}")
+            return False
+        finally:
+            self.calc.metrics.observe_operation("get_all_program_names", time.perf_counter() - start)
+
+        log(f"get_all_program_names completed. Found {len(program_responses)} responses with target pattern.")
+        return program_responses
+
+    async def iter_program_names(self):
+        """
+        Async counterpart of TI84PlusCE.iter_program_names
+
+        The link stays locked while the generator is open, so close it (e.g. with
+        contextlib.aclosing) rather than relying on garbage collection after an
+        early break, and do not start other transfers from inside the loop.
+        """
+        async with contextlib.aclosing(self.iter_directory()) as entries:
+            async for entry in entries:
+                yield frames.program_entry_title(entry)
+
+    async def iter_directory(self, idle_timeout=3000):
+        """
+        Async counterpart of TI84PlusCE.iter_directory
+
+        The listing engine itself runs on the USB I/O thread; each entry is
+        handed back to the event loop as soon as it has been acknowledged.
+        """
+        async with self._lock:
+            entries = self.calc.iter_directory(idle_timeout)
+            try:
+                while True:
+                    entry = await self._run(next, entries, None)
+                    if entry is None:
+                        break
+                    yield entry
+            finally:
+                # Reads the rest of a listing that was left early, then runs the final sequence
+                await self._run(entries.close)
+
+    async def get_program_content(self, packet):
+        """
+        Execute a read sequence and return the program content as one frame
+
+        Returns:
+            The content frame bytes, reassembled from its fragments, or None if the transfer failed
+        """
+        log("Starting get_program_content...")
+        start = time.perf_counter()
+        try:
+            tokens = b''.join([chunk async for chunk in self.iter_program_content(packet)])
+        except usb.core.USBError as e:
+            error(f"get_program_content failed: {e}")
+            return None
+        finally:
+            self.calc.metrics.observe_operation("get_program_content", time.perf_counter() - start)
+
+        log(f"get_program_content completed! {len(tokens)} token bytes")
+        return frames.program_content(tokens)
+
+    async def iter_program_content(self, packet, idle_timeout=3000):
+        """
+        Async counterpart of TI84PlusCE.iter_program_content
+
+        Each chunk of token bytes is handed back to the event loop as soon as its
+        fragment has been acknowledged. As with iter_directory, the link stays
+        locked until the generator is closed.
+        """
+        async with self._lock:
+            chunks = self.calc.iter_program_content(packet, idle_timeout)
+            try:
+                while True:
+                    chunk = await self._run(next, chunks, None)
+                    if chunk is None:
+                        break
+                    yield chunk
+            finally:
+                # Reads the rest of a download that was left early, then sends the final ack
+                await self._run(chunks.close)
+
+    def close(self):
+        """Stop the USB I/O thread"""
+        self._executor.shutdown(wait=False)
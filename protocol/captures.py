@@ -0,0 +1,269 @@
+'''
+Read USBPcap .pcapng captures and turn them into sequence definitions.
+
+Replaces the old workflow of exporting hex dumps from Wireshark by hand and
+running "data captures/Init/cleaner.py" over them: the capture files are
+memory-mapped and walked block by block, the bulk transfers are reassembled
+into whole frames, and the frames come out as the list-of-dicts sequences
+PresetPackets and BasePackets use.
+
+Run from the repository root:
+    python -m protocol.captures "data captures/TI-basic" [--out DIR]
+'''
+import mmap
+import os
+import struct
+import sys
+
+from protocol import frames
+
+# pcapng block types
+BLOCK_SECTION_HEADER = 0x0A0D0D0A
+BLOCK_INTERFACE = 0x00000001
+BLOCK_SIMPLE_PACKET = 0x00000003
+BLOCK_ENHANCED_PACKET = 0x00000006
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+LINKTYPE_USBPCAP = 249
+OPTION_TSRESOL = 9
+
+# USBPcap packet header (always little endian): header length, IRP id, status,
+# URB function, info, bus, device, endpoint, transfer type, data length
+USBPCAP_HEADER = struct.Struct('<HQIHBHHBBI')
+USBPCAP_TRANSFER_BULK = 3
+
+# Names used for frames that have no better description
+FIXED_FRAMES = {
+    frames.ACK: ('ACK', 'Ack'),
+    frames.EOT: ('EOT', 'End transmission'),
+    frames.BUF_SIZE_REQ: ('BUF_SIZE_REQ', 'Initialization'),
+    frames.BUF_SIZE_ALLOC: ('BUF_SIZE_ALLOC', 'Init response'),
+    frames.DELAY_ACK: ('DELAY_ACK', 'Ready to receive'),
+    frames.DATA_ACK: ('DATA_ACK', 'Continue'),
+    frames.ERROR_EXISTS: ('ERROR_EXISTS', 'Variable exists'),
+    frames.DIR_REQUEST: ('DIR_REQUEST', 'Read request'),
+    frames.DIR_FINAL_REQUEST: ('DIR_FINAL_REQUEST', 'Listing final request'),
+}
+OPCODE_NAMES = {
+    frames.OP_MODE_SET: 'Mode set',
+    frames.OP_PARAM_REQUEST: 'Parameter request',
+    frames.OP_PARAM_DATA: 'Parameter data',
+    frames.OP_DIR_REQUEST: 'Directory request',
+    frames.OP_VAR_HEADER: 'Variable header',
+    frames.OP_RTS: 'Request to send',
+    frames.OP_VAR_REQUEST: 'Variable request',
+    frames.OP_VAR_CONTENT: 'Variable content',
+    frames.OP_MODE_ACK: 'Mode ack',
+    frames.OP_DATA_ACK: 'Data ack',
+    frames.OP_DELAY_ACK: 'Delay ack',
+    frames.OP_EOT: 'End transmission',
+    frames.OP_ERROR: 'Error',
+}
+
+
+def iter_blocks(data):
+    """
+    Yield (block type, body start, body end, byte order) for every block of a pcapng buffer
+
+    Raises:
+        ValueError: the data is not a pcapng capture or a block is cut short
+    """
+    offset = 0
+    order = '<'
+    while offset + 12 <= len(data):
+        block_type = struct.unpack_from('<I', data, offset)[0]
+        if block_type == BLOCK_SECTION_HEADER:
+            # Every section states its own byte order
+            magic = struct.unpack_from('<I', data, offset + 8)[0]
+            order = '<' if magic == BYTE_ORDER_MAGIC else '>'
+        elif offset == 0:
+            raise ValueError("Not a pcapng capture")
+        block_type, length = struct.unpack_from(order + 'II', data, offset)
+        if length < 12 or offset + length > len(data):
+            raise ValueError(f"Block at offset {offset} is cut short")
+        yield block_type, offset + 8, offset + length - 4, order
+        offset += length
+
+
+def iter_transfers(path):
+    """
+    Yield (seconds, 'OUT'/'IN', payload bytes) for each bulk transfer carrying data
+
+    The capture is memory-mapped, so only the blocks being looked at are read
+    from disk. OUT data is captured when the host submits the transfer and IN
+    data when it completes; empty submissions and completions are skipped.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            interfaces = []
+            for block_type, start, end, order in iter_blocks(data):
+                if block_type == BLOCK_SECTION_HEADER:
+                    interfaces = []
+                elif block_type == BLOCK_INTERFACE:
+                    interfaces.append(_interface(data, start, end, order))
+                elif block_type == BLOCK_ENHANCED_PACKET:
+                    interface, high, low, captured = struct.unpack_from(order + 'IIII', data, start)
+                    linktype, resolution = interfaces[interface]
+                    if linktype == LINKTYPE_USBPCAP:
+                        transfer = _bulk_payload(data, start + 20, min(start + 20 + captured, end))
+                        if transfer is not None:
+                            yield ((high << 32 | low) / resolution,) + transfer
+                elif block_type == BLOCK_SIMPLE_PACKET and interfaces and interfaces[0][0] == LINKTYPE_USBPCAP:
+                    transfer = _bulk_payload(data, start + 4, end)
+                    if transfer is not None:
+                        yield (0.0,) + transfer
+
+
+def _interface(data, start, end, order):
+    """(link type, timestamp units per second) of an interface description block"""
+    linktype = struct.unpack_from(order + 'H', data, start)[0]
+    resolution = 1_000_000
+    offset = start + 8
+    while offset + 4 <= end:
+        code, length = struct.unpack_from(order + 'HH', data, offset)
+        if code == 0:
+            break
+        if code == OPTION_TSRESOL:
+            value = data[offset + 4]
+            resolution = 2 ** (value & 0x7f) if value & 0x80 else 10 ** value
+        offset += 4 + (length + 3) // 4 * 4
+    return linktype, resolution
+
+
+def _bulk_payload(data, start, end):
+    """('OUT'/'IN', payload) of the USBPcap packet in data[start:end] if it is a bulk transfer with data, else None"""
+    if end - start < USBPCAP_HEADER.size:
+        return None
+    header_length, _, _, _, _, _, _, endpoint, transfer, data_length = USBPCAP_HEADER.unpack_from(data, start)
+    if transfer != USBPCAP_TRANSFER_BULK or data_length == 0:
+        return None
+    payload = data[start + header_length:min(start + header_length + data_length, end)]
+    if not payload:
+        return None
+    return ('IN' if endpoint & 0x80 else 'OUT'), payload
+
+
+def iter_frames(path):
+    """
+    Yield (seconds, 'OUT'/'IN', frame bytes) for every whole raw frame in a capture
+
+    Transfers are split into frames by their raw length header, and a frame
+    spread over several transfers is put back together, separately per
+    direction. The tuples have the same shape as protocol.trace.read_trace, so
+    a capture can be replayed with ReplayedTI84PlusCE.
+    """
+    pending = {'OUT': bytearray(), 'IN': bytearray()}
+    for timestamp, direction, payload in iter_transfers(path):
+        buffer = pending[direction]
+        buffer += payload
+        while len(buffer) >= frames.RAW_HEADER_SIZE:
+            size = frames.RAW_HEADER_SIZE + frames.RAW_HEADER.unpack_from(buffer)[0]
+            if len(buffer) < size:
+                break
+            yield timestamp, direction, bytes(buffer[:size])
+            del buffer[:size]
+
+
+def describe_frame(frame, continuation=False):
+    """
+    Short human readable description of a frame, for the 'desc' of a step
+
+    `continuation` marks a frame that carries the rest of a virtual packet
+    started by an earlier raw type 3 frame, so it has no virtual header.
+    """
+    if frame in FIXED_FRAMES:
+        return FIXED_FRAMES[frame][1]
+    if continuation and len(frame) > 4:
+        return "Fragment" if frame[4] == frames.RAW_VIRT_DATA else "Last fragment"
+    if len(frame) >= frames.VIRTUAL_HEADER_SIZE and frame[4] in (frames.RAW_VIRT_DATA, frames.RAW_VIRT_DATA_LAST):
+        _, raw_type, _, opcode = frames.VIRTUAL_HEADER.unpack_from(frame)
+        name = OPCODE_NAMES.get(opcode, f"Opcode {opcode:04x}")
+        return name if raw_type == frames.RAW_VIRT_DATA_LAST else f"{name} (fragment)"
+    return f"Raw type {frame[4]}" if len(frame) > 4 else "Short frame"
+
+
+def sequence_from_frames(captured):
+    """
+    Build a sequence definition from (seconds, direction, frame) tuples
+
+    OUT frames become {'direction': 'OUT', 'data': ...} steps and IN frames
+    {'direction': 'IN', 'expected': ...} steps, in capture order.
+    """
+    sequence = []
+    # Whether the next virtual data frame in each direction continues a fragmented packet
+    continuing = {'OUT': False, 'IN': False}
+    for _, direction, frame in captured:
+        key = 'data' if direction == 'OUT' else 'expected'
+        sequence.append({'direction': direction, key: frame,
+                         'desc': describe_frame(frame, continuing[direction]), 'delay': 0})
+        if len(frame) > 4 and frame[4] in (frames.RAW_VIRT_DATA, frames.RAW_VIRT_DATA_LAST):
+            continuing[direction] = frame[4] == frames.RAW_VIRT_DATA
+    return sequence
+
+
+def format_sequence(name, sequence):
+    """Python source for a sequence, in the style of the PresetPackets definitions"""
+    lines = [f"self.{name} = ["]
+    for i, step in enumerate(sequence):
+        key = 'data' if step['direction'] == 'OUT' else 'expected'
+        frame = step[key]
+        if frame in FIXED_FRAMES:
+            value = f"frames.{FIXED_FRAMES[frame][0]}"
+        else:
+            value = f"bytes.fromhex('{frame.hex()}')"
+        comma = ',' if i < len(sequence) - 1 else ''
+        lines.append(f"    {{'direction': '{step['direction']}', '{key}': {value}, "
+                     f"'desc': {step['desc']!r}, 'delay': {step['delay']}}}{comma}")
+    lines.append("]")
+    return '\n'.join(lines)
+
+
+def sequence_name(path):
+    """Attribute name for the sequence of a capture file, e.g. 'replace_var_x_55'"""
+    stem = os.path.splitext(os.path.basename(path))[0].lower()
+    name = ''.join(c if c.isalnum() else '_' for c in stem)
+    name = '_'.join(part for part in name.split('_') if part)
+    return name if name[:1].isalpha() else f"capture_{name}"
+
+
+def capture_paths(paths):
+    """Expand directories into the .pcapng files they contain, sorted by name"""
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                if filename.endswith('.pcapng'):
+                    yield os.path.join(path, filename)
+        else:
+            yield path
+
+
+def main(argv=None):
+    args = list(sys.argv[1:] if argv is None else argv)
+    out_dir = None
+    if '--out' in args:
+        i = args.index('--out')
+        out_dir = args[i + 1]
+        del args[i:i + 2]
+        os.makedirs(out_dir, exist_ok=True)
+    if not args:
+        print(__doc__)
+        return
+
+    for path in capture_paths(args):
+        sequence = sequence_from_frames(iter_frames(path))
+        source = format_sequence(sequence_name(path), sequence)
+        if out_dir is None:
+            print(f"# {path}: {len(sequence)} steps")
+            print(source)
+            print()
+        else:
+            output_path = os.path.join(out_dir, sequence_name(path) + '.py')
+            with open(output_path, 'w') as out_file:
+                out_file.write(source + '\n')
+            print(f"Processed {path} -> {output_path} ({len(sequence)} steps)")
+
+
+if __name__ == "__main__":
+    main()
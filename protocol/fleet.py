@@ -0,0 +1,148 @@
+'''Drive every attached TI-84 Plus CE from one process'''
+import asyncio
+
+import usb.core
+
+from utils.logger import log, error
+from protocol.ti_comands import TI84PlusCE, VENDOR_ID, PRODUCT_ID
+from protocol.async_ti_comands import AsyncTI84PlusCE
+
+
+def attached_calculators():
+    """(bus, address) of every TI-84 Plus CE on the USB bus, in bus order"""
+    devices = usb.core.find(find_all=True, idVendor=VENDOR_ID, idProduct=PRODUCT_ID)
+    return sorted((device.bus, device.address) for device in devices)
+
+
+class FleetMember:
+    """
+    One calculator of a Fleet: its own session, USB I/O thread and load count.
+
+    Args:
+        acalc: AsyncTI84PlusCE bound to this calculator
+        key: (bus, address) the calculator is known by
+    """
+
+    def __init__(self, acalc, key):
+        self.acalc = acalc
+        self.key = key
+        # Requests queued or running on this calculator
+        self.load = 0
+        self.completed = 0
+        self.ready = False
+
+    @property
+    def calc(self):
+        return self.acalc.calc
+
+    def __repr__(self):
+        return f"FleetMember(bus={self.key[0]}, address={self.key[1]}, load={self.load}, ready={self.ready})"
+
+
+class Fleet:
+    """
+    Several calculators, each with an independent session.
+
+    Every member has its own AsyncTI84PlusCE, so its pyusb calls run on a
+    dedicated I/O thread and transfers to different calculators overlap;
+    requests to the same calculator still take turns on its link lock.
+    Requests go to a chosen calculator by (bus, address), or to the ready
+    calculator with the fewest requests in flight.
+
+    Args:
+        members: FleetMember objects; use Fleet.discover() to build them from the bus
+    """
+
+    def __init__(self, members):
+        self.members = {member.key: member for member in members}
+
+    @classmethod
+    def discover(cls, simulators=None, poll_interval=0.05):
+        """
+        Build a fleet from every attached calculator
+
+        Args:
+            simulators: Optional SimulatedTI84PlusCE list to use instead of the USB bus
+        """
+        members = []
+        if simulators is not None:
+            for simulator in simulators:
+                calc = TI84PlusCE(simulator=simulator)
+                members.append(FleetMember(AsyncTI84PlusCE(calc, poll_interval=poll_interval),
+                                           (simulator.bus, simulator.address)))
+        else:
+            for bus, address in attached_calculators():
+                calc = TI84PlusCE(bus=bus, address=address)
+                members.append(FleetMember(AsyncTI84PlusCE(calc, poll_interval=poll_interval), (bus, address)))
+        log(f"Fleet: {len(members)} calculator(s) found")
+        return cls(members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members.values())
+
+    async def connect_all(self, init_sequence):
+        """
+        Find, set up and handshake with every calculator at once
+
+        Returns:
+            Number of calculators that are ready
+        """
+        async def connect(member):
+            acalc = member.acalc
+            member.ready = (await acalc.find_device() and await acalc.setup_device()
+                            and await acalc.perform_sequence(init_sequence))
+            if not member.ready:
+                error(f"Fleet: calculator at bus {member.key[0]} address {member.key[1]} failed to connect")
+
+        await asyncio.gather(*(connect(member) for member in self))
+        return sum(member.ready for member in self)
+
+    def member(self, bus=None, address=None):
+        """
+        The calculator at (bus, address), or the least loaded ready one if both are None
+
+        Raises:
+            LookupError: no such calculator, or none is ready
+        """
+        if bus is not None or address is not None:
+            for member in self:
+                if (bus is None or member.key[0] == bus) and (address is None or member.key[1] == address):
+                    return member
+            raise LookupError(f"No calculator at bus {bus} address {address}")
+
+        ready = [member for member in self if member.ready]
+        if not ready:
+            raise LookupError("No calculator is ready")
+        return min(ready, key=lambda member: member.load)
+
+    async def run(self, operation, *args, bus=None, address=None):
+        """
+        Run `operation(acalc, *args)` on a chosen calculator, or on the least loaded one
+
+        `operation` is any coroutine function taking an AsyncTI84PlusCE, e.g.
+        AsyncTI84PlusCE.perform_sequence.
+
+        Returns:
+            Whatever the operation returns
+        """
+        member = self.member(bus, address)
+        member.load += 1
+        try:
+            return await operation(member.acalc, *args)
+        finally:
+            member.load -= 1
+            member.completed += 1
+
+    async def broadcast(self, operation, *args):
+        """Run `operation(acalc, *args)` on every ready calculator; returns {(bus, address): result}"""
+        ready = [member for member in self if member.ready]
+        results = await asyncio.gather(*(self.run(operation, *args, bus=member.key[0], address=member.key[1])
+                                         for member in ready))
+        return {member.key: result for member, result in zip(ready, results)}
+
+    def close(self):
+        for member in self:
+            member.acalc.close()
@@ -0,0 +1,291 @@
+'''Bytes-level frame layout for the TI-84 Plus CE USB protocol'''
+import struct
+
+# Every frame starts with a raw header: payload length (4 bytes) and raw packet type (1 byte).
+# Virtual packets (raw type 3/4) carry their own length (4 bytes) and opcode (2 bytes).
+RAW_HEADER = struct.Struct('>IB')
+VIRTUAL_HEADER = struct.Struct('>IBIH')
+RAW_HEADER_SIZE = RAW_HEADER.size
+VIRTUAL_HEADER_SIZE = VIRTUAL_HEADER.size
+# Length and opcode at the start of a virtual packet put back together from its raw payloads
+VIRTUAL_PACKET_HEADER = struct.Struct('>IH')
+
+# Raw packet types
+RAW_BUF_SIZE_REQ = 0x01
+RAW_BUF_SIZE_ALLOC = 0x02
+RAW_VIRT_DATA = 0x03
+RAW_VIRT_DATA_LAST = 0x04
+RAW_VIRT_DATA_ACK = 0x05
+
+# Virtual packet opcodes
+OP_MODE_SET = 0x0001
+OP_PARAM_REQUEST = 0x0007
+OP_PARAM_DATA = 0x0008
+OP_DIR_REQUEST = 0x0009
+OP_VAR_HEADER = 0x000A
+OP_RTS = 0x000B
+OP_VAR_REQUEST = 0x000C
+OP_VAR_CONTENT = 0x000D
+OP_MODE_ACK = 0x0012
+OP_DATA_ACK = 0xAA00
+OP_DELAY_ACK = 0xBB00
+OP_EOT = 0xDD00
+OP_ERROR = 0xEE00
+
+# Largest raw packet payload the calculator accepts (its answer to the buffer size request)
+MAX_RAW_SIZE = 0x3ff
+# Most token bytes a program holds: its variable data (2-byte length field plus tokens) is at most 0xFFFF bytes
+MAX_PROGRAM_TOKENS = 0xFFFF - 2
+
+# Var header attributes
+ATTR_SIZE = 0x0001
+ATTR_VAR_TYPE = 0x0002
+ATTR_ARCHIVED = 0x0003
+
+# Variable type ids
+TYPE_REAL = 0x00
+TYPE_REAL_LIST = 0x01
+TYPE_MATRIX = 0x02
+TYPE_PROGRAM = 0x05
+TYPE_COMPLEX = 0x0C
+TYPE_COMPLEX_LIST = 0x0D
+
+# First byte of the tokenized names of lists (L1-L6 and named lists) and matrices ([A]-[J])
+LIST_NAME_PREFIX = 0x5D
+MATRIX_NAME_PREFIX = 0x5C
+
+# Fixed frames
+ACK = bytes.fromhex('0000000205e000')
+EOT = bytes.fromhex('000000060400000000dd00')
+BUF_SIZE_REQ = bytes.fromhex('000000040100000400')
+BUF_SIZE_ALLOC = bytes.fromhex('0000000402000003ff')
+DELAY_ACK = bytes.fromhex('0000000a0400000004bb0000075300')
+DATA_ACK = bytes.fromhex('000000070400000001aa0001')
+ERROR_EXISTS = bytes.fromhex('000000080400000002ee000012')
+DIR_REQUEST = bytes.fromhex('00000023040000001d00090000000900010002000300050008004100800081000400010001000101')
+DIR_FINAL_REQUEST = bytes.fromhex('00000014040000000e0007000600060007000e000c0011000f')
+
+# Static tails of the dynamic frames
+# Attributes after the size in a request to send, split around the variable type byte
+_RTS_TYPE_ATTR = bytes.fromhex('00020004f00b00')
+_RTS_OTHER_ATTRS = bytes.fromhex('000300010000410001000008000400000000')
+# Variable request after the name, split around the variable type byte
+_READ_REQUEST_HEAD = bytes.fromhex('00017fffffff0006000100020003000500080041000100110004f00f00')
+_READ_REQUEST_TAIL = bytes.fromhex('0000')
+
+_NAME_LENGTH = struct.Struct('>H')
+_ATTR_HEADER = struct.Struct('>HB')
+_RTS_SIZE = struct.Struct('>BIB')
+_RTS_SIZE_ATTR = struct.Struct('>HHI')
+_BUF_SIZE = struct.Struct('>I')
+# TI's 2-byte length field: least significant byte first
+_LENGTH_FIELD = struct.Struct('<H')
+
+# Whole request-to-send and variable request frames by name length, so one pack builds a frame
+_RTS_LAYOUTS = {}
+_READ_REQUEST_LAYOUTS = {}
+
+# Byte offset of the token data inside a program content frame (headers plus length field)
+PROGRAM_CONTENT_OFFSET = VIRTUAL_HEADER_SIZE + _LENGTH_FIELD.size
+# Bytes a program directory entry carries after its title
+PROGRAM_ENTRY_TRAILER = 54
+
+
+def virtual_frame(opcode, payload, raw_type=RAW_VIRT_DATA_LAST):
+    """Build a single raw frame carrying a whole virtual packet."""
+    return VIRTUAL_HEADER.pack(len(payload) + 6, raw_type, len(payload), opcode) + payload
+
+
+def fragment_count(frame_size, max_raw_size=MAX_RAW_SIZE):
+    """Number of raw packets a virtual packet frame of `frame_size` bytes is sent in (see iter_fragments)."""
+    return max(1, -(-(frame_size - RAW_HEADER_SIZE) // max_raw_size))
+
+
+def iter_fragments(frame, buffer):
+    """
+    Yield the raw packets of a virtual packet frame, packing full-size fragments into `buffer`.
+
+    `buffer` holds RAW_HEADER_SIZE + the calculator's raw packet size and is
+    reused for every fragment, so a yielded fragment is only valid until the
+    next one is requested. Every piece but the last is a raw type 3 fragment
+    that the receiver acks before the next one is sent; the last, usually
+    shorter one is a new bytes object with raw type 4. A frame that already
+    fits is yielded as it is.
+    """
+    max_raw_size = len(buffer) - RAW_HEADER_SIZE
+    data = memoryview(frame)[RAW_HEADER_SIZE:]
+    if len(data) <= max_raw_size:
+        yield frame
+        return
+    view = memoryview(buffer)
+    last = (len(data) - 1) // max_raw_size * max_raw_size
+    for start in range(0, last, max_raw_size):
+        RAW_HEADER.pack_into(buffer, 0, max_raw_size, RAW_VIRT_DATA)
+        view[RAW_HEADER_SIZE:] = data[start:start + max_raw_size]
+        yield buffer
+    yield RAW_HEADER.pack(len(data) - last, RAW_VIRT_DATA_LAST) + data[last:]
+
+
+def join_fragments(pieces):
+    """One raw type 4 frame carrying the payloads of a virtual packet's fragments, in order."""
+    size = sum(len(piece) - RAW_HEADER_SIZE for piece in pieces)
+    frame = bytearray(RAW_HEADER_SIZE + size)
+    RAW_HEADER.pack_into(frame, 0, size, RAW_VIRT_DATA_LAST)
+    offset = RAW_HEADER_SIZE
+    for piece in pieces:
+        frame[offset:offset + len(piece) - RAW_HEADER_SIZE] = piece[RAW_HEADER_SIZE:]
+        offset += len(piece) - RAW_HEADER_SIZE
+    return bytes(frame)
+
+
+def virtual_payload(frame):
+    """Payload of a whole virtual packet frame, as long as its declared length."""
+    vlen = VIRTUAL_HEADER.unpack_from(frame)[2]
+    return frame[VIRTUAL_HEADER_SIZE:VIRTUAL_HEADER_SIZE + vlen]
+
+
+def buffer_size(frame):
+    """Return the raw packet size a buffer size alloc frame announces, or None for other frames."""
+    if len(frame) < RAW_HEADER_SIZE + _BUF_SIZE.size or frame[4] != RAW_BUF_SIZE_ALLOC:
+        return None
+    return _BUF_SIZE.unpack_from(frame, RAW_HEADER_SIZE)[0]
+
+
+def frame_opcode(frame):
+    """Return the opcode of a virtual packet frame, or None for other raw packets."""
+    if len(frame) < VIRTUAL_HEADER_SIZE or frame[4] not in (RAW_VIRT_DATA, RAW_VIRT_DATA_LAST):
+        return None
+    return VIRTUAL_HEADER.unpack_from(frame)[3]
+
+
+def parse_var_header(payload):
+    """
+    Split a var header payload (directory entry or read reply) into its parts.
+
+    Returns:
+        (name bytes, {attribute id: value bytes}); attributes the calculator
+        flags as unavailable map to None
+    """
+    name_len = _NAME_LENGTH.unpack_from(payload)[0]
+    offset = 2 + name_len
+    name = bytes(payload[2:offset])
+    # A zero byte, then the attribute count
+    count = _NAME_LENGTH.unpack_from(payload, offset + 1)[0]
+    offset += 3
+
+    attrs = {}
+    for _ in range(count):
+        attr_id, status = _ATTR_HEADER.unpack_from(payload, offset)
+        offset += _ATTR_HEADER.size
+        if status:
+            attrs[attr_id] = None
+            continue
+        attr_len = _NAME_LENGTH.unpack_from(payload, offset)[0]
+        offset += 2
+        attrs[attr_id] = bytes(payload[offset:offset + attr_len])
+        offset += attr_len
+    return name, attrs
+
+
+def var_type(attrs):
+    """Variable type id from parsed var header attributes, or None."""
+    value = attrs.get(ATTR_VAR_TYPE)
+    return value[-1] if value else None
+
+
+def var_size(attrs):
+    """Variable data size in bytes from parsed var header attributes, or None."""
+    value = attrs.get(ATTR_SIZE)
+    return _BUF_SIZE.unpack(value)[0] if value and len(value) == _BUF_SIZE.size else None
+
+
+def program_entry_size(frame):
+    """Variable data size of a program directory entry frame (length field included), or None."""
+    return var_size(parse_var_header(memoryview(frame)[VIRTUAL_HEADER_SIZE:])[1])
+
+
+def program_entry_title(frame):
+    """Title of a TI-BASIC program directory entry frame."""
+    name_len = _NAME_LENGTH.unpack_from(frame, VIRTUAL_HEADER_SIZE)[0]
+    name = frame[VIRTUAL_HEADER_SIZE + 2:VIRTUAL_HEADER_SIZE + 2 + name_len]
+    return bytes(name).decode('ascii', errors='replace')
+
+
+def program_header(title, data_len, replace):
+    """Request-to-send frame for a program with `data_len` bytes of variable data."""
+    return request_to_send(title.encode('ascii'), data_len, TYPE_PROGRAM, replace)
+
+
+def request_to_send(name, data_len, var_type, replace):
+    """Request-to-send frame for a variable named by its token bytes, with `data_len` bytes of variable data."""
+    layout = _RTS_LAYOUTS.get(len(name))
+    if layout is None:
+        # Name, size, attribute count and the size attribute, then the type attribute around its type byte
+        layout = _RTS_LAYOUTS[len(name)] = struct.Struct(
+            f"{VIRTUAL_HEADER.format}H{len(name)}s{_RTS_SIZE.format[1:]}H{_RTS_SIZE_ATTR.format[1:]}"
+            f"{len(_RTS_TYPE_ATTR)}sB{len(_RTS_OTHER_ATTRS)}s")
+    size = layout.size - VIRTUAL_HEADER_SIZE
+    return layout.pack(size + 6, RAW_VIRT_DATA_LAST, size, OP_RTS, len(name), name,
+                       0, data_len, 1 if replace else 0, 5, 0x0001, 4, data_len,
+                       _RTS_TYPE_ATTR, var_type, _RTS_OTHER_ATTRS)
+
+
+def program_content(tokens):
+    """Variable content frame for a program: length field followed by the tokens."""
+    if len(tokens) > MAX_PROGRAM_TOKENS:
+        raise ValueError(f"Program of {len(tokens)} token bytes exceeds the {MAX_PROGRAM_TOKENS} byte limit")
+    size = len(tokens) + _LENGTH_FIELD.size
+    return b''.join((VIRTUAL_HEADER.pack(size + 6, RAW_VIRT_DATA_LAST, size, OP_VAR_CONTENT),
+                     _LENGTH_FIELD.pack(len(tokens)), tokens))
+
+
+def read_request(title, var_type=TYPE_PROGRAM):
+    """Variable request frame asking for a variable (a program by default) by title or token bytes name."""
+    name = title.encode('ascii') if isinstance(title, str) else bytes(title)
+    layout = _READ_REQUEST_LAYOUTS.get(len(name))
+    if layout is None:
+        layout = _READ_REQUEST_LAYOUTS[len(name)] = struct.Struct(
+            f"{VIRTUAL_HEADER.format}H{len(name)}s{len(_READ_REQUEST_HEAD)}sB{len(_READ_REQUEST_TAIL)}s")
+    size = layout.size - VIRTUAL_HEADER_SIZE
+    return layout.pack(size + 6, RAW_VIRT_DATA_LAST, size, OP_VAR_REQUEST, len(name), name,
+                       _READ_REQUEST_HEAD, var_type, _READ_REQUEST_TAIL)
+
+
+def variable_header(name, data_len=9, var_type=TYPE_REAL):
+    """Request-to-send frame for a variable (a single-letter real by default), replacing any old one."""
+    if isinstance(name, str):
+        name = name.encode('ascii')
+    return request_to_send(name, data_len, var_type, True)
+
+
+def list_name(name):
+    """
+    Token bytes of a list name: L1-L6, or a named list of up to 5 letters and digits.
+
+    Raises:
+        ValueError: not a valid list name
+    """
+    name = name.strip().upper()
+    if len(name) == 2 and name[0] == 'L' and name[1] in '123456':
+        return bytes((LIST_NAME_PREFIX, int(name[1]) - 1))
+    if 1 <= len(name) <= 5 and name[0].isalpha() and name.isalnum() and name.isascii():
+        return bytes((LIST_NAME_PREFIX,)) + name.encode('ascii')
+    raise ValueError(f"Invalid list name {name!r}: use L1-L6 or up to 5 letters and digits")
+
+
+def matrix_name(name):
+    """
+    Token bytes of a matrix name, [A]-[J] (the brackets are optional).
+
+    Raises:
+        ValueError: not a valid matrix name
+    """
+    letter = name.strip().upper().strip('[]')
+    if len(letter) != 1 or not 'A' <= letter <= 'J':
+        raise ValueError(f"Invalid matrix name {name!r}: use [A]-[J]")
+    return bytes((MATRIX_NAME_PREFIX, ord(letter) - ord('A')))
+
+
+def variable_content(data):
+    """Variable content frame carrying raw variable data (e.g. a 9-byte real)."""
+    return virtual_frame(OP_VAR_CONTENT, data)
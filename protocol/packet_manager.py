@@ -1,5 +1,9 @@
-from utils.logger import log
-from utils.helpers import string_is_valid_number
+from utils.logger import error, warning
+from utils.helpers import parse_number
+from protocol import frames, ti_numbers
+from protocol.sequences import Step, compile_sequence, compile_step
+from protocol.token_decoder import TokenDecoder
+from protocol.tokens import Tokenizer, token_table
 
 
 class Packet_Manager:
@@ -9,192 +13,296 @@ class Packet_Manager:
         self.preset_packets = PresetPackets()
         self.base_packets = BasePackets()
         self.char_to_hex = CharToHex()
-        self._hex_to_char_map = self._build_hex_to_char_map()
-
-    def _build_hex_to_char_map(self):
-        """Build reverse mapping for parsing responses."""
-        return {tuple(codes): char for char, codes in self.char_to_hex.char_to_hex.items()}
+        self._char_to_bytes = {char: bytes.fromhex(''.join(codes)) for char, codes in self.char_to_hex.char_to_hex.items()}
+        # Full token table; the character mapping decides between tokens that look the same
+        tokens = token_table()
+        tokens.update({code: char for char, code in self._char_to_bytes.items()})
+        self._tokenizer = Tokenizer({**{text: code for code, text in tokens.items()}, **self._char_to_bytes})
+        self._token_decoder = TokenDecoder(tokens)
 
     def create_packet(self, packet_type, **data):
-        """Create packet based on type and parameters."""
+        """Create packet based on type and parameters, compiled and ready to run (False if invalid)."""
         creators = {
             'send_var': lambda: self._create_variable_packet(data['var_name'], data['var_value']),
+            'send_vars': lambda: self._create_variable_batch_packet(data['variables']),
+            'send_list': lambda: self._create_list_packet(data['name'], data['values']),
+            'send_matrix': lambda: self._create_matrix_packet(data['name'], data['values']),
             'send_prog': lambda: self._create_program_packet(data['title'], data['text'], data['replace']),
-            'read_prog': lambda: self._create_read_packet(data['title'])
+            'send_progs': lambda: self._create_program_batch_packet(data['programs'], data.get('existing', ())),
+            'read_prog': lambda: self._create_read_packet(data['title']),
+            'read_var': lambda: self._create_variable_read_batch_packet([data['name']]),
+            'read_vars': lambda: self._create_variable_read_batch_packet(data['names'])
         }
         
         creator = creators.get(packet_type)
         if not creator:
-            log(f"ERROR: Unknown packet type: {packet_type}")
+            error(f"Unknown packet type: {packet_type}")
             return False
             
-        return creator()
+        packet = creator()
+        return compile_sequence(packet, packet_type) if packet else packet
 
     def _create_variable_packet(self, var_name, var_value):
-        """Create packet for sending a variable."""
+        """Create packet for sending a real or complex variable (number or number string)."""
         # Validate variable name (single letter)
         var_name = var_name.strip().upper()
         if not (len(var_name) == 1 and var_name.isalpha()):
-            log("ERROR: Variable name must be a single letter")
+            error("Variable name must be a single letter")
             return False
 
         # Validate and convert value
-        if not string_is_valid_number(var_value):
-            log("ERROR: Invalid variable value")
+        value = parse_number(var_value)
+        if value is None:
+            error("Invalid variable value")
             return False
 
-        var_name_hex = f"{ord(var_name):02x}"
-        var_value_hex = self._encode_ti_number(var_value)
+        if isinstance(value, complex):
+            data = (ti_numbers.encode_real(value.real, ti_numbers.FLAG_COMPLEX)
+                    + ti_numbers.encode_real(value.imag, ti_numbers.FLAG_COMPLEX))
+            return self._create_typed_variable_packet(var_name, frames.TYPE_COMPLEX, data)
+        return self._create_typed_variable_packet(var_name, frames.TYPE_REAL, self._encode_ti_number(value))
 
+    def _create_typed_variable_packet(self, name, var_type, data):
+        """Create packet for sending any variable from its name (str or token bytes), type id and variable data."""
         packet = self.base_packets.send_var.copy()
-        packet[0]['data'] = (f'00000033040000002d000b0001{var_name_hex}'
-                           f'0000000009010005000100040000000900020004f00b0000000300010000410001000008000400000000')
-        packet[6]['data'] = f'0000000f0400000009000d00{var_value_hex}0000'
+        packet[0] = {**packet[0], 'data': frames.variable_header(name, len(data), var_type)}
+        packet[6] = {**packet[6], 'data': frames.variable_content(data)}
         
         return packet
 
+    def _create_list_packet(self, name, values):
+        """Create packet for sending a real or complex list (L1-L6 or a named list) from an array of numbers."""
+        try:
+            data, complex_list = ti_numbers.list_data(values)
+            return self._create_typed_variable_packet(
+                frames.list_name(name), frames.TYPE_COMPLEX_LIST if complex_list else frames.TYPE_REAL_LIST, data)
+        except ValueError as e:
+            error(f"Invalid list: {e}")
+            return False
+
+    def _create_matrix_packet(self, name, values):
+        """Create packet for sending a real matrix ([A]-[J]) from a 2-D array of numbers."""
+        try:
+            return self._create_typed_variable_packet(frames.matrix_name(name), frames.TYPE_MATRIX,
+                                                      ti_numbers.matrix_data(values))
+        except ValueError as e:
+            error(f"Invalid matrix: {e}")
+            return False
+
+    def _create_variable_batch_packet(self, variables):
+        """
+        Create one session that uploads several real variables.
+
+        Args:
+            variables: Mapping of single-letter name to value (number or number string)
+
+        Every step of a variable carries its name as 'part', so
+        SequenceResult.part_results() tells which ones were stored. Names that
+        are the same after normalisation ('a' and 'A') are sent once, with the
+        last value. Invalid variables are left out; False if none is valid.
+        """
+        merged = {}
+        for name, value in variables.items():
+            part = name.strip().upper()
+            if part in merged:
+                warning(f"Variable {part} is in the batch more than once, sending the last value {value!r}")
+            merged[part] = value
+
+        packet = []
+
+        for part, value in merged.items():
+            steps = self._create_variable_packet(part, value)
+            if not steps:
+                error(f"Leaving variable {part!r} = {value!r} out of the batch")
+                continue
+            # Everything but the end transmission and its ack
+            packet.extend(_with_part(step, part) for step in steps[:-2])
+
+        if not packet:
+            return False
+        packet.extend(self.base_packets.send_var[-2:])
+        return packet
+
     def _create_program_packet(self, title, program_text, replace):
-        """Create packet for sending a program."""
-        program_hex = self._text_to_hex(program_text)
-        program_len = len(program_hex) // 2
-        
-        # Calculate packet lengths
-        total_len = program_len + 8
-        data_len = program_len + 2
-        
-        # Convert title
-        title = title.upper()
-        title_hex = ''.join(f"{ord(c):02x}" for c in title)
-        title_len = len(title)
-        
-        # Format header components
-        total_hex = f"{total_len:08x}"
-        data_hex = f"{data_len:08x}"
-        length_hex = self._format_length_field(program_len)
+        """Create packet for sending a program, from its text or its already encoded tokens."""
+        if isinstance(program_text, (bytes, bytearray)):
+            program_bytes = program_text
+        else:
+            program_bytes = self._text_to_bytes(program_text)
+
+        # Variable data is the length field followed by the tokens
+        data_len = len(program_bytes) + 2
         
-        # Build packet
         packet = self.base_packets.send_ti_basic_program.copy()
+        packet[0] = {**packet[0], 'data': frames.program_header(title.upper(), data_len, replace)}
+        packet[6] = {**packet[6], 'data': frames.program_content(program_bytes)}
         
-        # Header packet
-        header_len = f"{50 + title_len:04x}"
-        header_total = f"{44 + title_len:08x}"
-        title_len_hex = f"{title_len:04x}"
-
-        if replace:
-            packet[0]['data'] = (f"0000{header_len}04{header_total}000b{title_len_hex}{title_hex}00{data_hex}"
-                            f"01000500010004{data_hex}00020004f00b0005000300010000410001000008000400000000")
-            packet[6]['data'] = f"{total_hex}04{data_hex}000d{length_hex}{program_hex}"
+        return packet
+
+    def _create_program_batch_packet(self, programs, existing):
+        """
+        Create one session that uploads several programs.
+
+        Args:
+            programs: List of (title, text or encoded tokens) pairs, sent in order
+            existing: Titles already on the calculator (these are sent as replacements)
+        """
+        existing = set(existing)
+        packet = []
         
-        if not replace:
-            packet[0]['data'] = (f"0000{header_len}04{header_total}000b{title_len_hex}{title_hex}00{data_hex}"
-                            f"00000500010004{data_hex}00020004f00b0005000300010000410001000008000400000000")
-            packet[6]['data'] = f"{total_hex}04{data_hex}000d{length_hex}{program_hex}"
+        for title, text in programs:
+            title = title.upper()
+            # Everything but the end transmission and its ack
+            packet.extend(self._create_program_packet(title, text, title in existing)[:-2])
+            existing.add(title)
         
+        packet.extend(self.base_packets.send_ti_basic_program[-2:])
         return packet
 
     def _create_read_packet(self, title):
         """Create packet for reading a program."""
-        title = title.strip().upper()
-        title_hex = ''.join(f"{ord(c):02x}" for c in title)
-        title_len = len(title)
-        
-        # Calculate header values
-        total_len = f"{40 + title_len:08x}"
-        data_len = f"{34 + title_len:08x}"
-        title_len_hex = f"{title_len:04x}"
-        
         packet = self.base_packets.read_ti_basic_program.copy()
-        packet[0]['data'] = (f"{total_len}04{data_len}000c{title_len_hex}{title_hex}"
-                           f"00017fffffff0006000100020003000500080041000100110004f00f00050000")
+        packet[0] = {**packet[0], 'data': frames.read_request(title.strip().upper())}
         
         return packet
 
-    def _encode_ti_number(self, num_str):
-        """Convert number string to TI calculator format."""
-        if num_str.startswith(("0.", "0,")):
-            # Decimal starting with 0 (e.g., 0.123)
-            decimal_part = num_str[2:]
-            return f"7f{decimal_part.ljust(10, '0')[:10]}"
-        
-        # Regular number
-        separator = '.' if '.' in num_str else ','
-        if separator in num_str:
-            integer_part, decimal_part = num_str.split(separator)
-            digits = integer_part + decimal_part
-            digit_count = len(integer_part)
-        else:
-            digits = num_str
-            digit_count = len(num_str)
-        
-        prefix = f"8{digit_count - 1}"
-        padded_digits = digits.ljust(10, '0')[:10]
-        return prefix + padded_digits
-
-    def _format_length_field(self, value):
-        """Format length value for packet headers."""
-        hex_str = f"{value:x}"
-        if len(hex_str) <= 2:
-            return f"{hex_str:0>2s}00"
-        elif len(hex_str) == 3:
-            return f"{hex_str[:2]}0{hex_str[2]}"
-        elif len(hex_str) == 4:
-            return hex_str
-        else:
-            raise ValueError(f"Length value too large: {value}")
-
-    def _text_to_hex(self, text):
-        """Convert text to hex using TI character mapping."""
-        text = text.replace("ENTER", "\n")
-        hex_codes = []
-        
-        for char in text:
-            if char in self.char_to_hex.char_to_hex:
-                hex_codes.extend(self.char_to_hex.char_to_hex[char])
+    def _variable_reference(self, name):
+        """
+        Token bytes name and type id of a variable name.
+
+        'A'-'Z' are reals, '[A]'-'[J]' matrices, and anything else a list
+        (L1-L6 or a named list). Raises ValueError for invalid names.
+        """
+        name = name.strip().upper()
+        if name.startswith('['):
+            return frames.matrix_name(name), frames.TYPE_MATRIX
+        if len(name) == 1 and name.isalpha():
+            return name.encode('ascii'), frames.TYPE_REAL
+        return frames.list_name(name), frames.TYPE_REAL_LIST
+
+    def _create_variable_read_batch_packet(self, names):
+        """
+        Create one session that reads several reals, lists or matrices.
+
+        Every step of a variable carries its name as 'part', and its data is
+        captured in the slot of the same name (see parse_variables). A name
+        given more than once is read once. Invalid names are left out; False if
+        none is valid.
+        """
+        packet = []
+        seen = set()
+
+        for name in names:
+            part = name.strip().upper()
+            if part in seen:
+                continue
+            seen.add(part)
+            try:
+                var_name, var_type = self._variable_reference(part)
+            except ValueError as e:
+                error(f"Leaving {name!r} out of the read: {e}")
+                continue
+            steps = self.base_packets.read_var.copy()
+            steps[0] = {**steps[0], 'data': frames.read_request(var_name, var_type)}
+            steps[4] = steps[4].replace(capture=part)
+            packet.extend(_with_part(step, part) for step in steps)
+
+        return packet or False
+
+    def parse_variables(self, result):
+        """
+        Decode the variables of a 'read_var' or 'read_vars' SequenceResult.
+
+        Reals become floats (complex numbers complex), lists 1-D NumPy arrays
+        and matrices 2-D ones. All reals of the session are decoded in one
+        vectorized call.
+
+        Returns:
+            {name: value}, with None for variables that could not be read
+        """
+        values = {}
+        reals = []
+        for name, ok in result.part_results().items():
+            content = result.captures.get(name)
+            if not ok or content is None or frames.frame_opcode(content) != frames.OP_VAR_CONTENT:
+                values[name] = None
+                continue
+            data = frames.virtual_payload(content)
+            var_type = self._variable_reference(name)[1]
+            if var_type in (frames.TYPE_MATRIX, frames.TYPE_REAL_LIST):
+                try:
+                    values[name] = (ti_numbers.parse_matrix_data(data) if var_type == frames.TYPE_MATRIX
+                                    else ti_numbers.parse_list_data(data))
+                except ValueError as e:
+                    error(f"Variable {name} could not be decoded: {e}")
+                    values[name] = None
+            elif len(data) == ti_numbers.COMPLEX_SIZE:
+                values[name] = complex(ti_numbers.decode_complex(data)[0])
+            elif len(data) == ti_numbers.REAL_SIZE:
+                # Decoded below, together with the other reals
+                values[name] = None
+                reals.append((name, data))
             else:
-                log(f"WARNING: Unknown character '{char}', skipping")
-        
-        return ''.join(hex_codes)
+                error(f"Variable {name} has {len(data)} bytes of data, not a real or complex number")
+                values[name] = None
+
+        if reals:
+            decoded = ti_numbers.decode_reals(b''.join(data for _, data in reals))
+            for (name, _), value in zip(reals, decoded.tolist()):
+                values[name] = value
+        return values
+
+    def _encode_ti_number(self, num):
+        """Convert a real number (or number string) to the 9 bytes of a TI real (see ti_numbers)."""
+        if isinstance(num, str):
+            num = parse_number(num)
+        return ti_numbers.encode_real(num)
+
+    def _text_to_bytes(self, text):
+        """Convert text to TI tokens, using the longest token that matches at each position."""
+        return self._tokenizer.encode(text.replace("ENTER", "\n"))
+
+    def encode_program(self, text):
+        """Token bytes a program's text is uploaded as (see ProgramContents)."""
+        return bytes(self._text_to_bytes(text))
+
+    def program_content_tokens(self, content):
+        """Token bytes of a program content frame, without headers and length field."""
+        return bytes(content[frames.PROGRAM_CONTENT_OFFSET:]) if content else b''
 
     def parse_program_content(self, content):
-        """Parse program content into readable text."""
+        """Parse program content frame into readable text."""
         if not content:
             return ""
         
-        # Skip 26-character header
-        hex_data = content[26:]
-        hex_bytes = [hex_data[i:i+2] for i in range(0, len(hex_data), 2)]
-        
-        result = []
-        i = 0
-        while i < len(hex_bytes):
-            # Try two-byte sequence first, then single byte
-            if i + 1 < len(hex_bytes):
-                two_byte = tuple(hex_bytes[i:i+2])
-                if two_byte in self._hex_to_char_map:
-                    result.append(self._hex_to_char_map[two_byte])
-                    i += 2
-                    continue
-            
-            one_byte = tuple([hex_bytes[i]])
-            if one_byte in self._hex_to_char_map:
-                result.append(self._hex_to_char_map[one_byte])
-            else:
-                result.append('?')  # Unknown character
-            i += 1
-        
-        return ''.join(result)
+        # Skip frame headers and the length field
+        return self._token_decoder.decode(bytes(content[frames.PROGRAM_CONTENT_OFFSET:]))
+
+    def program_text_decoder(self):
+        """Streaming decoder for program tokens that arrive in pieces (see TokenStreamDecoder)."""
+        return self._token_decoder.stream()
+
+    def iter_program_text(self, chunks):
+        """Decode token byte chunks (e.g. from TI84PlusCE.iter_program_content) into text as they come."""
+        decoder = self.program_text_decoder()
+        for chunk in chunks:
+            text = decoder.feed(chunk)
+            if text:
+                yield text
+        text = decoder.finish()
+        if text:
+            yield text
 
     def parse_program_titles(self, titles):
-        """Parse program titles into readable text."""
+        """Parse program directory entries into readable titles."""
         result = []
 
-        for hex_str in titles:
-            # Remove front and back characters
-            trimmed = hex_str[26:len(hex_str)-108]
+        for entry in titles:
+            # Remove frame header and name length in front, attributes at the back
+            trimmed = entry[frames.VIRTUAL_HEADER_SIZE + 2:len(entry) - frames.PROGRAM_ENTRY_TRAILER]
 
-            # Convert hex to string
             try:
-                ascii_str = bytes.fromhex(trimmed).decode('ascii')
+                ascii_str = bytes(trimmed).decode('ascii')
             except Exception as e:
                 ascii_str = f"<Error decoding: {e}>"
 
@@ -208,46 +316,54 @@ class PresetPackets:
     
     def __init__(self):
         self.init = [
-            {'direction': 'OUT', 'data': '000000040100000400', 'desc': 'Initialization', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000402000003ff', 'desc': 'Init response', 'delay': 0},
-            {'direction': 'OUT', 'data': '00000010040000000a0001000300010000000007d5', 'desc': 'Capability request', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000a04000000040012000007d5', 'desc': 'Capability data', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000a040000000400070001000a', 'desc': 'Request device info', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000e040000000800080001000a00000101', 'desc': 'Device info', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'OUT', 'data': '00000024040000001e0007000e000800190023002d003700380012000c0011000f001e001f001d0000', 'desc': 'Variable type request', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '00000075040000006f0008000e00080000020073001900000101002301002d0000010100370000010100380000010000120000080000000000310000000c000008000000000004000000110000080000000000132b47000f0000080000000000400000001e0000020140001f00000200f0001d00000110000001', 'desc': 'Variable info', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'OUT', 'data': '00000020040000001a0007000c00010004000600070009000b002d001b00480049004b005d', 'desc': 'Program type request', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000005c04000000560008000c00010000040000001300040000020007000600000109000700000101000900000400050601000b00000400050700002d00000101001b000001010048000002001100490000020006004b00000100005d00000101', 'desc': 'Program info', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Final ack', 'delay': 0}
+            {'direction': 'OUT', 'data': frames.BUF_SIZE_REQ, 'desc': 'Initialization', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.BUF_SIZE_ALLOC, 'desc': 'Init response', 'delay': 0},
+            {'direction': 'OUT', 'data': bytes.fromhex('00000010040000000a0001000300010000000007d5'), 'desc': 'Capability request', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': bytes.fromhex('0000000a04000000040012000007d5'), 'desc': 'Capability data', 'capture': 'capabilities', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'OUT', 'data': bytes.fromhex('0000000a040000000400070001000a'), 'desc': 'Request device info', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': bytes.fromhex('0000000e040000000800080001000a00000101'), 'desc': 'Device info', 'capture': 'device_info', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'OUT', 'data': bytes.fromhex('00000024040000001e0007000e000800190023002d003700380012000c0011000f001e001f001d0000'), 'desc': 'Variable type request', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': bytes.fromhex('00000075040000006f0008000e00080000020073001900000101002301002d0000010100370000010100380000010000120000080000000000310000000c000008000000000004000000110000080000000000132b47000f0000080000000000400000001e0000020140001f00000200f0001d00000110000001'), 'desc': 'Variable info', 'capture': 'variable_types', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'OUT', 'data': bytes.fromhex('00000020040000001a0007000c00010004000600070009000b002d001b00480049004b005d'), 'desc': 'Program type request', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': bytes.fromhex('0000005c04000000560008000c00010000040000001300040000020007000600000109000700000101000900000400050601000b00000400050700002d00000101001b000001010048000002001100490000020006004b00000100005d00000101'), 'desc': 'Program info', 'capture': 'program_types', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Final ack', 'delay': 0}
         ]
         
+        # Start of init, enough to confirm a reconnected calculator is the one whose
+        # variable and program type answers are already known
+        self.handshake_probe = self.init[:10]
+        
         self.quit_exam_mode = [
-            {'direction': 'OUT', 'data': '000000060400000000dd00', 'desc': 'Exit exam mode', 'delay': 0.1},
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Confirm exit', 'delay': 0.1}
+            {'direction': 'OUT', 'data': frames.EOT, 'desc': 'Exit exam mode', 'delay': 0.1},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Confirm exit', 'delay': 0.1}
         ]
 
         self.get_all_program_names_initial = [
-            {'direction': 'OUT', 'data': '00000023040000001d00090000000900010002000300050008004100800081000400010001000101', 'desc': 'Read request', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000a0400000004bb0000075300', 'desc': '?', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0}
+            {'direction': 'OUT', 'data': frames.DIR_REQUEST, 'desc': 'Read request', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.DELAY_ACK, 'desc': '?', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0}
         ]
 
         self.get_all_program_names_final = [
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'OUT', 'data': '00000014040000000e0007000600060007000e000c0011000f', 'desc': '?', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.DIR_FINAL_REQUEST, 'desc': '?', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
             {'direction': 'IN', 'expected': 'skip', 'desc': '?', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0}
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0}
         ]
 
+        # Compile every preset once; they are run as they are, many times over
+        for name, sequence in vars(self).items():
+            setattr(self, name, compile_sequence(sequence, name))
+
 
 class BasePackets:
     """Base packet templates for different operations."""
@@ -255,43 +371,62 @@ class BasePackets:
     def __init__(self):
         self.send_var = [
             {'direction': 'OUT', 'data': '', 'desc': 'Variable header', 'delay': 0},  # Modified by packet manager
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000a0400000004bb0000075300', 'desc': 'Ready to receive', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '000000070400000001aa0001', 'desc': 'Continue', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.DELAY_ACK, 'desc': 'Ready to receive', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.DATA_ACK, 'desc': 'Continue', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
             {'direction': 'OUT', 'data': '', 'desc': 'Variable data', 'delay': 0},  # Modified by packet manager
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '000000070400000001aa0001', 'desc': 'Complete', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'OUT', 'data': '000000060400000000dd00', 'desc': 'End transmission', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Final ack', 'delay': 0}
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.DATA_ACK, 'desc': 'Complete', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.EOT, 'desc': 'End transmission', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Final ack', 'delay': 0}
         ]
     
         self.send_ti_basic_program = [
             {'direction': 'OUT', 'data': '', 'desc': 'Program header', 'delay': 0},  # Modified by packet manager
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000a0400000004bb0000075300', 'desc': 'Ready to receive', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '000000070400000001aa0001', 'desc': 'Continue', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.DELAY_ACK, 'desc': 'Ready to receive', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.DATA_ACK, 'desc': 'Continue', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
             {'direction': 'OUT', 'data': '', 'desc': 'Program data', 'delay': 0},  # Modified by packet manager
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'IN', 'expected': '000000070400000001aa0001', 'desc': 'Complete', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
-            {'direction': 'OUT', 'data': '000000060400000000dd00', 'desc': 'End transmission', 'delay': 0},
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Final ack', 'delay': 0}
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.DATA_ACK, 'desc': 'Complete', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.EOT, 'desc': 'End transmission', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Final ack', 'delay': 0}
+        ]
+        
+        self.read_var = [
+            {'direction': 'OUT', 'data': '', 'desc': 'Variable request', 'delay': 0},  # Modified by packet manager
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': 'skip', 'desc': 'Variable header', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': 'skip', 'desc': 'Variable data', 'delay': 0},  # Captured by packet manager
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Final ack', 'delay': 0}
         ]
         
         self.read_ti_basic_program = [
             {'direction': 'OUT', 'data': '', 'desc': 'Read request', 'delay': 0},  # Modified by packet manager
-            {'direction': 'IN', 'expected': '0000000205e000', 'desc': 'Ack', 'delay': 0},
+            {'direction': 'IN', 'expected': frames.ACK, 'desc': 'Ack', 'delay': 0},
             {'direction': 'IN', 'expected': 'skip', 'desc': 'Program data', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Ack', 'delay': 0},
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Ack', 'delay': 0},
             {'direction': 'IN', 'expected': 'store_content', 'desc': 'Additional data', 'delay': 0},
-            {'direction': 'OUT', 'data': '0000000205e000', 'desc': 'Final ack', 'delay': 0}
+            {'direction': 'OUT', 'data': frames.ACK, 'desc': 'Final ack', 'delay': 0}
         ]
 
+        # Compile the fixed steps once; only the placeholders filled in per packet are compiled with it
+        for template in (self.send_var, self.send_ti_basic_program, self.read_var, self.read_ti_basic_program):
+            template[:] = [step if step.get('data') == '' else compile_step(step, number)
+                           for number, step in enumerate(template, 1)]
+
+
+def _with_part(step, part):
+    """Template step (a Step or a step dict) tagged with the batch item it belongs to"""
+    return step.replace(part=part) if isinstance(step, Step) else {**step, 'part': part}
+
 
 class CharToHex:
     """Character to hex code mapping for TI calculator text encoding."""
@@ -318,7 +453,7 @@ class CharToHex:
             '5': ['35'], '6': ['36'], '7': ['37'], '8': ['38'], '9': ['39'],
 
             # Common symbols
-            ' ': ['29'], '\n': ['3f'], '.': ['3a'], ',': ['2b'], ':': ['3e'], ';': ['bb'],
+            ' ': ['29'], '\n': ['3f'], '.': ['3a'], ',': ['2b'], ':': ['3e'], ';': ['bb', 'd6'],
             '!': ['2d'], '?': ['af'], "'": ['ae'], '"': ['2a'], '(': ['10'], ')': ['11'],
             '[': ['06'], ']': ['07'], '{': ['08'], '}': ['09'], '+': ['70'], '-': ['71'],
             '*': ['82'], '/': ['83'], '=': ['6a'], '<': ['6b'], '>': ['6c'], '^': ['f0'],
@@ -0,0 +1,75 @@
+import hashlib
+import time
+
+
+def content_digest(tokens):
+    """Digest of a program's token bytes"""
+    return hashlib.blake2b(tokens, digest_size=16).digest()
+
+
+class ProgramContents:
+    """
+    Digest and encoded length of the programs known to be on the calculator.
+
+    Entries are recorded after every successful upload or read, so an upload
+    of tokens the calculator already holds can be skipped. Programs can also
+    be edited on the calculator itself, so entries expire after `ttl` seconds,
+    all of them are dropped when the calculator reconnects
+    (TI84PlusCE.connection_id changes), and check_sizes() drops those a
+    directory listing shows a different size for.
+
+    Args:
+        calc: TI84PlusCE whose programs are tracked
+        ttl: Seconds an entry stays valid (None to never expire)
+    """
+
+    def __init__(self, calc, ttl=300):
+        self.calc = calc
+        self.ttl = ttl
+        # title -> (digest, token byte count, time recorded)
+        self._entries = {}
+        self._connection_id = None
+        # Uploads skipped because the content was already there, and uploads that went ahead
+        self.hits = 0
+        self.misses = 0
+
+    def _current(self):
+        if self._connection_id != self.calc.connection_id:
+            self._entries.clear()
+            self._connection_id = self.calc.connection_id
+        return self._entries
+
+    def record(self, title, tokens):
+        """Remember that `title` now holds `tokens`"""
+        self._current()[title] = (content_digest(tokens), len(tokens), time.monotonic())
+
+    def discard(self, title):
+        """Forget `title`, e.g. after a failed upload left it in an unknown state"""
+        self._current().pop(title, None)
+
+    def invalidate(self):
+        self._entries.clear()
+
+    def unchanged(self, title, tokens):
+        """True (and counted as a hit) if `title` is known to hold exactly `tokens`"""
+        entry = self._current().get(title)
+        if entry is not None and self.ttl is not None and time.monotonic() - entry[2] >= self.ttl:
+            del self._entries[title]
+            entry = None
+        if entry is not None and entry[1] == len(tokens) and entry[0] == content_digest(tokens):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def check_sizes(self, sizes):
+        """Drop entries whose size differs from a listing's {title: variable data size}"""
+        entries = self._current()
+        for title, size in sizes.items():
+            entry = entries.get(title)
+            # The variable data is the 2-byte length field followed by the tokens
+            if entry is not None and size is not None and entry[1] + 2 != size:
+                del entries[title]
+
+    def summary(self):
+        return f"Upload skip cache: {self.hits} hits, {self.misses} misses, {len(self._entries)} programs known"
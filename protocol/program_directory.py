@@ -0,0 +1,55 @@
+import time
+
+
+class ProgramDirectory:
+    """
+    Cached set of program titles stored on the calculator.
+
+    Filled from one directory listing and kept current by the controller after
+    every successful upload or read, so collision checks do not need a listing
+    of their own. The cache expires after `ttl` seconds, and whenever the
+    calculator reconnects (TI84PlusCE.connection_id changes).
+
+    Args:
+        calc: TI84PlusCE whose directory is cached
+        ttl: Seconds a listing stays valid (None to never expire)
+    """
+
+    def __init__(self, calc, ttl=300):
+        self.calc = calc
+        self.ttl = ttl
+        self._titles = None
+        self._filled_at = 0.0
+        self._connection_id = None
+
+    def is_valid(self):
+        """True while the cached listing can be trusted"""
+        if self._titles is None or self._connection_id != self.calc.connection_id:
+            return False
+        return self.ttl is None or time.monotonic() - self._filled_at < self.ttl
+
+    def fill(self, titles):
+        """Replace the cache with a fresh directory listing"""
+        self._titles = set(titles)
+        self._filled_at = time.monotonic()
+        self._connection_id = self.calc.connection_id
+
+    def add(self, title):
+        """Record a program that is now known to exist"""
+        if self.is_valid():
+            self._titles.add(title)
+
+    def discard(self, title):
+        """Record a program that is known to be gone"""
+        if self.is_valid():
+            self._titles.discard(title)
+
+    def invalidate(self):
+        """Forget the cached listing; the next lookup lists the directory again"""
+        self._titles = None
+
+    def __contains__(self, title):
+        return self._titles is not None and title in self._titles
+
+    def titles(self):
+        return sorted(self._titles) if self._titles is not None else []
@@ -0,0 +1,150 @@
+'''Re-attach to the calculator after the link drops, without the full handshake'''
+import time
+
+import usb.core
+
+from utils.logger import log, warning
+from protocol.ti_comands import VENDOR_ID, PRODUCT_ID
+
+try:
+    import usb1  # libusb1 bindings, only used for hotplug events
+except ImportError:
+    usb1 = None
+
+
+class ReconnectManager:
+    """
+    Brings a TI84PlusCE back after it was unplugged, turned off or reset.
+
+    The first handshake runs the whole PresetPackets.init and keeps what the
+    calculator answered (capabilities, device info, variable and program type
+    tables). A later handshake only runs PresetPackets.handshake_probe - the
+    buffer size, mode and device info exchange - and trusts the cached type
+    tables if the calculator answers it exactly as before; otherwise the full
+    init runs again and refreshes the cache.
+
+    The calculator's return is noticed through libusb hotplug events when the
+    usb1 package and the platform support them, and by polling usb.core.find
+    every `poll_interval` seconds otherwise.
+
+    Args:
+        calc: TI84PlusCE to keep connected
+        preset_packets: PresetPackets with the init and probe sequences
+        poll_interval: Seconds between presence checks while waiting
+        use_hotplug: Set to False to always poll
+    """
+
+    def __init__(self, calc, preset_packets, poll_interval=0.25, use_hotplug=True):
+        self.calc = calc
+        self.preset_packets = preset_packets
+        self.poll_interval = poll_interval
+        self.use_hotplug = use_hotplug
+        # Frames the calculator answered during the last full handshake
+        self.handshake = None
+        self.reconnects = 0
+        self._hotplug = None
+
+    def run_handshake(self):
+        """Run the probe if a handshake is cached and still matches, the full init otherwise"""
+        if self.handshake is not None:
+            start = time.perf_counter()
+            result = self.calc.run_sequence(self.preset_packets.handshake_probe)
+            if result.ok and not result.missing and all(
+                    result.captures.get(slot) == self.handshake.get(slot) for slot in result.captures):
+                log(f"Handshake probe matched the cached handshake in {(time.perf_counter() - start) * 1000:.1f} ms")
+                return True
+            log("Handshake probe did not match, running the full handshake")
+
+        result = self.calc.run_sequence(self.preset_packets.init)
+        if not result.ok or result.missing:
+            self.handshake = None
+            return False
+        self.handshake = dict(result.captures)
+        return True
+
+    def connect(self):
+        """Find, set up and handshake with the calculator once"""
+        if not self.calc.find_device():
+            return False
+        if not self.calc.setup_device():
+            return False
+        return self.run_handshake()
+
+    def device_present(self):
+        """Cheap check whether the calculator is on the bus (at calc.bus / calc.address, where set)"""
+        if self.calc.simulator is not None:
+            return getattr(self.calc.simulator, 'connected', True)
+        return self.calc.find_usb_device() is not None
+
+    def wait_for_device(self, timeout=None):
+        """Block until the calculator is on the bus; returns False after `timeout` seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        hotplug = self._start_hotplug()
+        while True:
+            if self.device_present():
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            if hotplug is not None:
+                # Returns as soon as libusb reports an arrival
+                hotplug.handleEventsTimeout(tv=self.poll_interval)
+            else:
+                time.sleep(self.poll_interval)
+
+    def reconnect(self, timeout=60):
+        """
+        Re-attach after the link dropped
+
+        Releases the old device, waits for the calculator to come back and
+        handshakes again, retrying until `timeout` seconds have passed.
+
+        Returns:
+            True once the calculator answers again
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        self.calc.release_device()
+        log("Waiting for the calculator to come back...")
+
+        while time.monotonic() < deadline:
+            if not self.wait_for_device(deadline - time.monotonic()):
+                break
+            try:
+                if self.connect():
+                    self.reconnects += 1
+                    log(f"Reconnected in {(time.monotonic() - start) * 1000:.0f} ms")
+                    return True
+            except usb.core.USBError as e:
+                warning(f"Reconnect attempt failed: {e}")
+            # Still enumerating, or gone again
+            self.calc.release_device()
+            time.sleep(self.poll_interval)
+
+        warning(f"Calculator did not come back within {timeout} s")
+        return False
+
+    def _start_hotplug(self):
+        """libusb context delivering arrival events for the calculator, or None to poll"""
+        if self._hotplug is not None or not self.use_hotplug or usb1 is None or self.calc.simulator is not None:
+            return self._hotplug
+        try:
+            context = usb1.USBContext()
+            if not context.hasCapability(usb1.CAP_HAS_HOTPLUG):
+                self.use_hotplug = False
+                return None
+            context.hotplugRegisterCallback(
+                self._on_hotplug,
+                events=usb1.HOTPLUG_EVENT_DEVICE_ARRIVED,
+                vendor_id=VENDOR_ID,
+                product_id=PRODUCT_ID,
+            )
+        except usb1.USBError as e:
+            warning(f"USB hotplug unavailable, polling instead: {e}")
+            self.use_hotplug = False
+            return None
+        self._hotplug = context
+        return context
+
+    def _on_hotplug(self, context, device, event):
+        # Waking handleEventsTimeout is all it takes; keep the callback registered
+        return False
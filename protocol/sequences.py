@@ -0,0 +1,213 @@
+'''Compiled transaction sequences and the results of running them'''
+
+# Step directions
+SEND = 'OUT'
+RECEIVE = 'IN'
+
+# How a SEND step goes over the bulk endpoint
+FRAMING_WHOLE = 'whole'      # one write for the whole frame
+FRAMING_CHUNKED = 'chunked'  # 64-byte writes
+
+# Capture slot the legacy "store_content" marker fills
+CONTENT = 'content'
+
+
+class Step:
+    """
+    One step of a compiled sequence. Treat as immutable.
+
+    A SEND step has `data` and `framing`; a RECEIVE step has `expected` (None
+    when any frame is accepted) and `capture`, the name of the slot its frame
+    is stored in (None to not keep it). In a batch sequence `part` names the
+    item (e.g. the variable) the step transfers.
+    """
+
+    __slots__ = ('direction', 'data', 'framing', 'expected', 'capture', 'description', 'delay', 'label', 'part')
+
+    def __init__(self, direction, data=None, framing=FRAMING_WHOLE, expected=None, capture=None, description='', delay=0,
+                 part=None):
+        self.direction = direction
+        self.data = data
+        self.framing = framing
+        self.expected = expected
+        self.capture = capture
+        self.description = description
+        self.delay = delay
+        # Name the step's latency is recorded under, e.g. "IN Ack"
+        self.label = f"{direction} {description}"
+        self.part = part
+
+    def replace(self, **changes):
+        """Copy of the step with some fields changed, e.g. step.replace(part='A')"""
+        fields = {name: getattr(self, name) for name in
+                  ('direction', 'data', 'framing', 'expected', 'capture', 'description', 'delay', 'part')}
+        return Step(**{**fields, **changes})
+
+    def __repr__(self):
+        if self.direction == SEND:
+            return f"Step(OUT {self.description!r}, {len(self.data)} bytes, {self.framing})"
+        return f"Step(IN {self.description!r}, expected={self.expected is not None}, capture={self.capture!r})"
+
+
+class CompiledSequence:
+    """
+    A transaction sequence checked and decoded once, ready to run many times.
+
+    Args:
+        steps: Step objects, in order
+        name: Label used in logs
+    """
+
+    __slots__ = ('steps', 'name')
+
+    def __init__(self, steps, name=None):
+        self.steps = tuple(steps)
+        self.name = name
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __repr__(self):
+        return f"CompiledSequence({self.name!r}, {len(self.steps)} steps)"
+
+
+class SequenceResult:
+    """
+    Outcome of running a CompiledSequence.
+
+    Attributes:
+        ok: False if a SEND step failed (the run stops there)
+        failed_step: Number (from 1) of the step that stopped the run, or None
+        captures: {slot name: frame bytes} for RECEIVE steps with a capture slot
+        mismatches: (step number, expected, received) for frames that differed from `expected`
+        missing: Numbers of RECEIVE steps that got no frame before the timeout
+        timings: Seconds spent on each step that ran, in order
+        seconds: Seconds for the whole run
+        bytes_sent, bytes_received: Frame bytes that went each way
+    """
+
+    def __init__(self, sequence):
+        self.sequence = sequence
+        self.ok = True
+        self.failed_step = None
+        self.captures = {}
+        self.mismatches = []
+        self.missing = []
+        self.timings = []
+        self.seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @property
+    def throughput(self):
+        """Bytes per second sent and received over the whole run"""
+        return (self.bytes_sent + self.bytes_received) / self.seconds if self.seconds else 0.0
+
+    def received(self, number, step, frame):
+        """Record the frame of a RECEIVE step; returns False if it was not the expected one"""
+        if frame is None:
+            self.missing.append(number)
+            return True
+        if step.capture is not None:
+            self.captures[step.capture] = frame
+        if step.expected is not None and frame != step.expected:
+            self.mismatches.append((number, step.expected, frame))
+            return False
+        return True
+
+    def part_results(self):
+        """
+        {part: True if all of its steps ran and got the expected frames}, for the parts of a batch sequence
+
+        Steps without a part (such as a shared end of transmission) count for none.
+        """
+        bad = {number for number, _, _ in self.mismatches}
+        bad.update(self.missing)
+        results = {}
+        for number, step in enumerate(self.sequence.steps, 1):
+            if step.part is None:
+                continue
+            ok = number not in bad and (self.failed_step is None or number < self.failed_step)
+            results[step.part] = results.get(step.part, True) and ok
+        return results
+
+    def fail(self, number):
+        self.ok = False
+        self.failed_step = number
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return (f"SequenceResult({self.sequence.name!r}, ok={self.ok}, captures={sorted(self.captures)}, "
+                f"mismatches={len(self.mismatches)}, missing={len(self.missing)}, {self.seconds * 1000:.1f} ms)")
+
+
+def _frame_bytes(value, what):
+    if isinstance(value, str):
+        return bytes.fromhex(value.replace(' ', ''))
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    raise ValueError(f"{what} must be bytes or a hex string, got {value!r}")
+
+
+def compile_sequence(sequence, name=None):
+    """
+    Turn a list-of-dicts sequence (the PresetPackets/BasePackets format) into a CompiledSequence
+
+    All string handling happens here: hex strings are decoded, "skip" becomes
+    a step without an expected frame, "store_content" a step with the
+    CONTENT capture slot, and a description containing "large" selects
+    chunked framing. A step may also name its capture slot directly with a
+    'capture' key, and the batch item it belongs to with a 'part' key.
+    Already compiled sequences are returned unchanged, and so are steps that
+    are already Step objects.
+
+    Raises:
+        ValueError: a step has no data to send, an unknown direction or a malformed frame
+    """
+    if isinstance(sequence, CompiledSequence):
+        return sequence
+    return CompiledSequence([compile_step(step, number) for number, step in enumerate(sequence, 1)], name)
+
+
+def compile_step(step, number=1):
+    """
+    Turn one list-of-dicts step into a Step (see compile_sequence); `number` is only used in error messages
+
+    Raises:
+        ValueError: the step has no data to send, an unknown direction or a malformed frame
+    """
+    if isinstance(step, Step):
+        return step
+
+    direction = step['direction']
+    description = step.get('desc', '')
+    delay = step.get('delay') or 0
+    part = step.get('part')
+
+    if direction == SEND:
+        data = step.get('data')
+        if data is None or len(data) == 0:
+            raise ValueError(f"Step {number} ({description}) has no data specified for OUT operation")
+        framing = FRAMING_CHUNKED if 'large' in description.lower() else FRAMING_WHOLE
+        return Step(SEND, data=_frame_bytes(data, f"Step {number} data"), framing=framing,
+                    description=description, delay=delay, part=part)
+
+    if direction == RECEIVE:
+        expected = step.get('expected')
+        capture = step.get('capture')
+        if expected == "store_content":
+            expected, capture = None, capture or CONTENT
+        elif expected == "skip":
+            expected = None
+        elif expected is not None:
+            expected = _frame_bytes(expected, f"Step {number} expected")
+        return Step(RECEIVE, expected=expected, capture=capture, description=description, delay=delay, part=part)
+
+    raise ValueError(f"Step {number} has unknown direction '{direction}'")
@@ -0,0 +1,360 @@
+import struct
+import threading
+import time
+from array import array
+from collections import deque
+
+import usb.core
+import usb.util
+
+from utils.logger import log
+from protocol.frames import (
+    ACK, BUF_SIZE_ALLOC, DATA_ACK, DELAY_ACK, EOT, ERROR_EXISTS,
+    OP_DIR_REQUEST, OP_EOT, OP_MODE_ACK, OP_MODE_SET, OP_PARAM_REQUEST,
+    OP_RTS, OP_VAR_CONTENT, OP_VAR_HEADER, OP_VAR_REQUEST,
+    MAX_RAW_SIZE, RAW_BUF_SIZE_REQ, RAW_VIRT_DATA, RAW_VIRT_DATA_ACK, RAW_VIRT_DATA_LAST,
+    TYPE_PROGRAM, virtual_frame,
+)
+
+
+# Parameter requests replayed from "data captures/Init" and "data captures/Get memory"
+PARAM_REPLIES = {
+    bytes.fromhex('0001000a'):
+        bytes.fromhex('0000000e040000000800080001000a00000101'),
+    bytes.fromhex('000e000800190023002d003700380012000c0011000f001e001f001d0000'):
+        bytes.fromhex('00000075040000006f0008000e00080000020073001900000101002301002d0000010100370000010100380000010000120000080000000000310000000c000008000000000004000000110000080000000000132b47000f0000080000000000400000001e0000020140001f00000200f0001d00000110000001'),
+    bytes.fromhex('000c00010004000600070009000b002d001b00480049004b005d'):
+        bytes.fromhex('0000005c04000000560008000c00010000040000001300040000020007000600000109000700000101000900000400050601000b00000400050700002d00000101001b000001010048000002001100490000020006004b00000100005d00000101'),
+    bytes.fromhex('00060007000e000c0011000f'):
+        bytes.fromhex('00000048040000004200080006000600000109000700000101000e000008000000000002544a000c000008000000000004000000110000080000000000132b47000f0000080000000000400000'),
+    bytes.fromhex('00010005'):
+        bytes.fromhex('00000017040000001100080001000500000a31333030424637344438'),
+    bytes.fromhex('00010003'):
+        bytes.fromhex('00000012040000000c0008000100030000051300bfd874'),
+}
+
+
+class SimulatedEndpoint:
+    """Bulk endpoint with the read/write surface of a pyusb endpoint, for any fake device (also trace replay)."""
+
+    def __init__(self, device, address):
+        self.device = device
+        self.bEndpointAddress = address
+        self.bmAttributes = usb.util.ENDPOINT_TYPE_BULK
+        self.wMaxPacketSize = 64
+
+    def write(self, data, timeout=None):
+        return self.device._host_write(bytes(data))
+
+    def read(self, size_or_buffer, timeout=None):
+        return self.device._host_read(size_or_buffer, timeout)
+
+
+class SimulatedTI84PlusCE:
+    """
+    Software TI-84 Plus CE that answers the USB protocol the way the captures show.
+
+    It quacks like a pyusb device, so TI84PlusCE.setup_device() finds its bulk
+    endpoints without any special casing. Variables are kept in memory as
+    {name bytes: (type id, raw variable data)}; programs store their 2-byte
+    length prefix followed by the token bytes, exactly as they travel on the wire.
+
+    Args:
+        programs: Optional {title: token bytes} to preload
+        latency: Seconds added to every bulk transfer
+        bandwidth: Bytes per second of the simulated link (None for unlimited)
+        bus, address: USB location reported for this device
+    """
+
+    idVendor = 0x0451
+    idProduct = 0xe008
+
+    def __init__(self, programs=None, latency=0.0, bandwidth=None, bus=0, address=1):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.bus = bus
+        self.address = address
+        self.max_raw_size = MAX_RAW_SIZE
+        self.variables = {}
+        for title, tokens in (programs or {}).items():
+            self.store_program(title, tokens)
+
+        self.endpoint_out = SimulatedEndpoint(self, 0x02)
+        self.endpoint_in = SimulatedEndpoint(self, 0x81)
+        self.transfers = 0
+        self.bytes_transferred = 0
+        # False while the simulated cable is pulled
+        self.connected = True
+
+        self._rx = bytearray()
+        self._partial = bytearray()
+        self._outgoing = deque()
+        self._on_ack = deque()
+        self._pending_rts = None
+        self._reading = None
+        self._lock = threading.Condition()
+
+    def __str__(self):
+        return (f"SIMULATED DEVICE ID {self.idVendor:04x}:{self.idProduct:04x} "
+                f"on Bus {self.bus:03d} Address {self.address:03d}")
+
+    # --- Stored variables ---
+
+    def store_program(self, title, tokens):
+        """Store a program from its token bytes."""
+        self.variables[title.upper().encode('ascii')] = (TYPE_PROGRAM, struct.pack('<H', len(tokens)) + bytes(tokens))
+
+    def program_tokens(self, title):
+        """Return the token bytes of a stored program, or None."""
+        entry = self.variables.get(title.upper().encode('ascii'))
+        if entry is None or entry[0] != TYPE_PROGRAM:
+            return None
+        return entry[1][2:]
+
+    def unplug(self):
+        """Pull the simulated cable: transfers fail until plug() is called"""
+        with self._lock:
+            self.connected = False
+            self._lock.notify_all()
+
+    def plug(self):
+        """Reconnect the simulated cable; the link starts over like a fresh USB connection"""
+        with self._lock:
+            self._rx.clear()
+            self._partial.clear()
+            self._outgoing.clear()
+            self._on_ack.clear()
+            self._pending_rts = None
+            self._reading = None
+            self.connected = True
+
+    # --- pyusb device surface used by TI84PlusCE.setup_device ---
+
+    def is_kernel_driver_active(self, interface):
+        return False
+
+    def set_configuration(self, configuration=None):
+        pass
+
+    def get_active_configuration(self):
+        return {(0, 0): [self.endpoint_in, self.endpoint_out]}
+
+    # --- Transfers ---
+
+    def _transfer_delay(self, size):
+        self.transfers += 1
+        self.bytes_transferred += size
+        delay = self.latency
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def _host_write(self, data):
+        if not self.connected:
+            raise usb.core.USBError('No such device', errno=19)
+        self._transfer_delay(len(data))
+        with self._lock:
+            self._rx += data
+            while len(self._rx) >= 5:
+                raw_len = struct.unpack_from('>I', self._rx)[0]
+                if len(self._rx) < raw_len + 5:
+                    break
+                frame = bytes(self._rx[:raw_len + 5])
+                del self._rx[:raw_len + 5]
+                self._handle_raw(frame)
+            self._lock.notify_all()
+        return len(data)
+
+    def _host_read(self, size_or_buffer, timeout):
+        into = not isinstance(size_or_buffer, int)
+        size = len(size_or_buffer) if into else size_or_buffer
+
+        with self._lock:
+            if self._reading is None and not self._outgoing and self.connected:
+                self._lock.wait_for(lambda: self._outgoing or not self.connected, (timeout or 1000) / 1000)
+            if not self.connected:
+                raise usb.core.USBError('No such device', errno=19)
+            if self._reading is None:
+                if not self._outgoing:
+                    raise usb.core.USBTimeoutError('Operation timed out', errno=110)
+                self._reading = memoryview(self._outgoing.popleft())
+            chunk = self._reading[:size]
+            self._reading = self._reading[size:] if len(self._reading) > size else None
+
+        self._transfer_delay(len(chunk))
+        if into:
+            memoryview(size_or_buffer)[:len(chunk)] = chunk
+            return len(chunk)
+        return array('B', chunk)
+
+    def _send(self, *frames):
+        self._outgoing.extend(frames)
+
+    def _after_ack(self, *frames):
+        """Queue frames that are only sent once the host acknowledges the previous one."""
+        self._on_ack.append(lambda: self._send(*frames))
+
+    def _send_virtual(self, opcode, payload):
+        """Queue a virtual packet, splitting it over several raw frames if needed."""
+        data = struct.pack('>IH', len(payload), opcode) + payload
+        chunks = [data[i:i + self.max_raw_size] for i in range(0, len(data), self.max_raw_size)]
+        frames = [struct.pack('>IB', len(chunk), RAW_VIRT_DATA) + chunk for chunk in chunks[:-1]]
+        frames.append(struct.pack('>IB', len(chunks[-1]), RAW_VIRT_DATA_LAST) + chunks[-1])
+        self._send(frames[0])
+        # Every further fragment waits for the host's ack of the previous one
+        for frame in reversed(frames[1:]):
+            self._on_ack.appendleft(lambda frame=frame: self._send(frame))
+
+    # --- Protocol ---
+
+    def _handle_raw(self, frame):
+        raw_type = frame[4]
+        payload = frame[5:]
+
+        if len(payload) > self.max_raw_size:
+            # More than the buffer it announced: the frame is lost and never acked
+            log(f"Simulator: dropping raw packet of {len(payload)} bytes (limit {self.max_raw_size})")
+            return
+        if raw_type == RAW_BUF_SIZE_REQ:
+            self._send(BUF_SIZE_ALLOC)
+        elif raw_type == RAW_VIRT_DATA_ACK:
+            if self._on_ack:
+                self._on_ack.popleft()()
+        elif raw_type == RAW_VIRT_DATA:
+            self._partial += payload
+            self._send(ACK)
+        elif raw_type == RAW_VIRT_DATA_LAST:
+            data = bytes(self._partial) + payload
+            self._partial.clear()
+            self._send(ACK)
+            vlen, opcode = struct.unpack_from('>IH', data)
+            self._handle_virtual(opcode, data[6:6 + vlen])
+        else:
+            log(f"Simulator: ignoring raw packet type {raw_type}")
+
+    def _handle_virtual(self, opcode, payload):
+        if opcode == OP_MODE_SET:
+            self._send(virtual_frame(OP_MODE_ACK, payload[-4:]))
+        elif opcode == OP_PARAM_REQUEST:
+            reply = PARAM_REPLIES.get(payload)
+            self._send(reply if reply is not None else ERROR_EXISTS)
+        elif opcode == OP_DIR_REQUEST:
+            self._send(DELAY_ACK)
+            for name in self.variables:
+                self._after_ack(self._var_header(name, listing=True))
+            self._after_ack(EOT)
+        elif opcode == OP_RTS:
+            self._handle_rts(payload)
+        elif opcode == OP_VAR_CONTENT:
+            if self._pending_rts is not None:
+                name, var_type = self._pending_rts
+                self.variables[name] = (var_type, bytes(payload))
+                self._pending_rts = None
+            self._send(DATA_ACK)
+        elif opcode == OP_VAR_REQUEST:
+            self._handle_var_request(payload)
+        elif opcode == OP_EOT:
+            pass
+        else:
+            log(f"Simulator: unknown opcode {opcode:04x}")
+            self._send(ERROR_EXISTS)
+
+    def _handle_rts(self, payload):
+        name_len = struct.unpack_from('>H', payload)[0]
+        name = bytes(payload[2:2 + name_len])
+        offset = 2 + name_len + 1 + 4
+        overwrite = payload[offset]
+        attr_count = struct.unpack_from('>H', payload, offset + 1)[0]
+        offset += 3
+
+        var_type = TYPE_PROGRAM
+        for _ in range(attr_count):
+            attr_id, attr_len = struct.unpack_from('>HH', payload, offset)
+            if attr_id == 0x0002:
+                var_type = payload[offset + 4 + attr_len - 1]
+            offset += 4 + attr_len
+
+        self._send(DELAY_ACK)
+        if name in self.variables and not overwrite:
+            self._pending_rts = None
+            self._after_ack(ERROR_EXISTS)
+        else:
+            self._pending_rts = (name, var_type)
+            self._after_ack(DATA_ACK)
+
+    def _handle_var_request(self, payload):
+        name_len = struct.unpack_from('>H', payload)[0]
+        name = bytes(payload[2:2 + name_len])
+        if name not in self.variables:
+            self._send(ERROR_EXISTS)
+            return
+        self._send(self._var_header(name))
+        # The variable content follows the host's ack of the header
+        var_data = self.variables[name][1]
+        self._on_ack.append(lambda: self._send_virtual(OP_VAR_CONTENT, var_data))
+
+    def _var_header(self, name, listing=False):
+        """Build the var header frame used in directory listings and read replies."""
+        var_type, data = self.variables[name]
+        attrs = (struct.pack('>HBHI', 0x0001, 0, 4, len(data))
+                 + struct.pack('>HBHBBBB', 0x0002, 0, 4, 0xF0, 0x07, 0x00, var_type)
+                 + struct.pack('>HBHB', 0x0003, 0, 1, 0)
+                 + struct.pack('>HB', 0x0005, 1)
+                 + struct.pack('>HBHI', 0x0008, 0, 4, 0)
+                 + struct.pack('>HB', 0x0041, 1))
+        count = 6
+        if listing:
+            attrs += struct.pack('>HB', 0x0080, 1) + struct.pack('>HB', 0x0081, 1) + struct.pack('>HBHB', 0x0004, 0, 1, 0)
+            count = 9
+        payload = struct.pack('>H', len(name)) + name + struct.pack('>BH', 0, count) + attrs
+        return virtual_frame(OP_VAR_HEADER, payload)
+
+
+
+def main():
+    """Time the main link operations end-to-end against a simulated calculator."""
+    from protocol.packet_manager import Packet_Manager
+    from protocol.ti_comands import TI84PlusCE
+
+    pm = Packet_Manager()
+    sim = SimulatedTI84PlusCE(latency=0.0005, bandwidth=1_000_000)
+    for i in range(20):
+        sim.store_program(f"PROG{i:02d}", bytes.fromhex('544849532949532954455354') * 10)
+    calc = TI84PlusCE(simulator=sim)
+    calc.find_device()
+    calc.setup_device()
+
+    def timed(name, func, *args):
+        start = time.perf_counter()
+        func(*args)
+        print(f"{name:<24} {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+    timed("init", calc.perform_sequence, pm.preset_packets.init)
+    timed("get_all_program_names", calc.get_all_program_names)
+    timed("send_prog", calc.perform_sequence, pm.create_packet('send_prog', title="HELLO", text="HELLO WORLD", replace=False))
+    timed("get_program_content", calc.get_program_content, pm.create_packet('read_prog', title="HELLO"))
+    big = "THIS IS A LARGE PROGRAM:" * 2700
+    timed("send_prog 64 KB", calc.perform_sequence, pm.create_packet('send_prog', title="BIG", text=big, replace=False))
+    upload = calc.last_upload
+    print(f"  {upload['bytes']} bytes in {upload['fragments']} fragments, "
+          f"{upload['bytes'] / upload['seconds'] / 1024:.0f} KB/s, stored intact: "
+          f"{sim.program_tokens('BIG') == bytes(pm._text_to_bytes(big))}")
+
+    start = time.perf_counter()
+    first = None
+    text = []
+    for chunk in pm.iter_program_text(calc.iter_program_content(pm.create_packet('read_prog', title="BIG"))):
+        first = first or time.perf_counter() - start
+        text.append(chunk)
+    print(f"{'stream read 64 KB':<24} {(time.perf_counter() - start) * 1000:8.2f} ms, first text after "
+          f"{first * 1000:.2f} ms, {calc.last_download['frames']} frames, intact: {''.join(text) == big}")
+    calc.perform_sequence(pm.create_packet('send_vars', variables={name: i * 1.5 for i, name in enumerate("ABCDEFGH")}))
+    calc.perform_sequence(pm.create_packet('send_list', name='L1', values=[i / 7 for i in range(999)]))
+    read = pm.create_packet('read_vars', names=list("ABCDEFGH") + ['L1'])
+    timed("read_vars 8 reals + L1", lambda: pm.parse_variables(calc.run_sequence(read)))
+    print(f"{sim.transfers} transfers, {sim.bytes_transferred} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,67 @@
+import contextlib
 import usb.core
 import usb.util
+import struct
 import time
-from utils.logger import log
+from array import array
+from utils.logger import log, debug, warning, error, Hex, record_frame, dump_recent_frames
+from utils.metrics import LinkMetrics
 from protocol.packet_manager import PresetPackets
+from protocol import frames
+from protocol.sequences import SEND, FRAMING_CHUNKED, CONTENT, CompiledSequence, SequenceResult, compile_sequence
+
+# USB ids of the TI-84 Plus CE
+VENDOR_ID = 0x0451   # Texas Instruments
+PRODUCT_ID = 0xe008  # TI-84 Plus CE
+
+# Room for a few full-size frames (5-byte header plus up to 0x3ff bytes of payload)
+RECEIVE_BUFFER_SIZE = 4096
 
 class TI84PlusCE:
-    def __init__(self):
+    def __init__(self, simulator=None, recorder=None, bus=None, address=None):
         self.device = None
+        # USB location to bind to when several calculators are attached (None for the first one found)
+        self.bus = bus
+        self.address = address
         self.endpoint_out = None
         self.endpoint_in = None
+        # Optional SimulatedTI84PlusCE (or ReplayedTI84PlusCE) used instead of the USB bus
+        self.simulator = simulator
+        # Optional TraceRecorder that keeps every frame sent and received
+        self.recorder = recorder
+        self.preset_packets = PresetPackets()
+        # Incremented on every successful setup, so cached device state can tell a reconnect apart
+        self.connection_id = 0
+        # Number of IN frames that did not match what the sequence expected
+        self.mismatch_count = 0
+        # Counts and timing of the most recent directory listing
+        self.last_listing = None
+        # Latency histograms and frame/byte counters for this link
+        self.metrics = LinkMetrics()
+        # Largest raw packet payload, as announced by the calculator during init
+        self.max_raw_size = frames.MAX_RAW_SIZE
+        # Size, fragment count and timing of the most recent fragmented send
+        self.last_upload = None
+        # Size, frame count and timing of the most recent program download
+        self.last_download = None
+        # Receive buffers, reused for every frame: data waiting to be parsed sits in _rx[_rx_start:_rx_end]
+        self._rx = array('B', bytes(RECEIVE_BUFFER_SIZE))
+        self._rx_view = memoryview(self._rx)
+        self._rx_spare = array('B', bytes(RECEIVE_BUFFER_SIZE // 2))
+        self._rx_spare_view = memoryview(self._rx_spare)
+        self._rx_start = 0
+        self._rx_end = 0
+        # Send buffer for full-size fragments (see send_virtual), sized to max_raw_size
+        self._tx = array('B', bytes(frames.RAW_HEADER_SIZE + self.max_raw_size))
         
     def find_device(self):
         """Find the TI-84 Plus CE calculator"""
-        # VID: 0x0451 (Texas Instruments)
-        # PID: 0xe008 (TI-84 Plus CE)
+        if self.simulator is not None:
+            self.device = self.simulator
+            log(f"Using simulated TI-84 Plus CE: {self.device}")
+            return True
 
-        self.device = usb.core.find(idVendor=0x0451, idProduct=0xe008)
+        self.device = self.find_usb_device()
         
         if self.device is None:
             log("TI-84 Plus CE not found. Please check:")
@@ -28,6 +74,16 @@ class TI84PlusCE:
         log(f"Found TI-84 Plus CE: {self.device}")
         return True
     
+    def find_usb_device(self):
+        """The TI-84 Plus CE on the USB bus at this link's bus and address (where set), or None"""
+        if self.bus is None and self.address is None:
+            return usb.core.find(idVendor=VENDOR_ID, idProduct=PRODUCT_ID)
+        return usb.core.find(
+            idVendor=VENDOR_ID, idProduct=PRODUCT_ID,
+            custom_match=lambda d: (self.bus is None or d.bus == self.bus)
+            and (self.address is None or d.address == self.address)
+        )
+    
     def setup_device(self):
         """Configure the USB device for communication"""
         try:
@@ -64,307 +120,553 @@ class TI84PlusCE:
                 
             log(f"OUT endpoint: 0x{self.endpoint_out.bEndpointAddress:02x}")
             log(f"IN endpoint: 0x{self.endpoint_in.bEndpointAddress:02x}")
+            # Anything buffered belonged to the previous connection
+            self._rx_start = self._rx_end = 0
+            self.connection_id += 1
             return True
             
         except usb.core.USBError as e:
             log(f"USB setup error: {e}")
             return False
     
-    def send_data(self, data_hex, description=None):
-        """Send data to the calculator, in chunks if 'large' is in the description"""
+    def release_device(self):
+        """Let go of a device that was unplugged, so a new one can be set up"""
+        if self.device is not None and self.simulator is None:
+            try:
+                usb.util.dispose_resources(self.device)
+            except usb.core.USBError:
+                pass
+        self.device = None
+        self.endpoint_out = None
+        self.endpoint_in = None
+    
+    def send_data(self, data, description=None, chunked=None):
+        """
+        Send a frame (bytes, or a legacy hex string) to the calculator
+        
+        It goes out in 64-byte chunks if `chunked` is set, or - when `chunked`
+        is None - if 'large' is in the description.
+        """
         try:
-            # Convert hex string to bytes
-            data = bytes.fromhex(data_hex.replace(' ', ''))
-            log(f"Preparing to send: {data.hex()} ({len(data)} bytes)")
+            if isinstance(data, str):
+                data = bytes.fromhex(data.replace(' ', ''))
+            debug("Preparing to send: %s (%d bytes)", Hex(data), len(data))
+            record_frame('OUT', data)
+            if self.recorder is not None:
+                self.recorder.record('OUT', data)
+            self.metrics.count('frames_out')
+            self.metrics.count('bytes_out', len(data))
             
-            chunk_size = 64
-            use_chunking = description and 'large' in description.lower()
+            chunk_size = getattr(self.endpoint_out, 'wMaxPacketSize', 64)
+            if chunked is None:
+                chunked = description and 'large' in description.lower()
             
-            if use_chunking:
-                log("Chunked sending enabled")
+            if chunked:
+                debug("Chunked sending enabled")
                 total_sent = 0
                 for i in range(0, len(data), chunk_size):
                     chunk = data[i:i + chunk_size]
                     bytes_written = self.endpoint_out.write(chunk)
-                    log(f"Sent chunk ({len(chunk)} bytes): {chunk.hex()}")
+                    debug("Sent chunk (%d bytes): %s", len(chunk), Hex(chunk))
                     total_sent += bytes_written
-                log(f"Total bytes sent: {total_sent}")
+                debug("Total bytes sent: %d", total_sent)
             else:
                 bytes_written = self.endpoint_out.write(data)
-                log(f"Sent {bytes_written} bytes")
+                debug("Sent %d bytes", bytes_written)
             
             return True
 
         except usb.core.USBError as e:
-            log(f"Send error: {e}")
+            error(f"Send error: {e}")
+            self.metrics.count('send_errors')
             return False
 
     
-    def receive_data(self, timeout=1000, max_packet_size=512):
-        """Receive data from the calculator"""
-        try:
-            # Try to read larger buffer first
-            data = self.endpoint_in.read(max_packet_size, timeout=timeout)
-            received_bytes = data.tobytes()
-            log(f"Received {len(received_bytes)} bytes: {received_bytes.hex()}")
-            return received_bytes
-            
-        except usb.core.USBTimeoutError:
-            log("Receive timeout - no data received")
-            return None
-        except usb.core.USBError as e:
-            log(f"Receive error: {e}")
-            # If large read fails, try smaller chunks
-            try:
-                log("Trying smaller read size...")
-                data = self.endpoint_in.read(64, timeout=timeout)
-                received_bytes = data.tobytes()
-                log(f"Received {len(received_bytes)} bytes: {received_bytes.hex()}")
-                return received_bytes
-            except:
-                return None
-    
-    def receive_data_chunked(self, timeout=1000):
-        """Receive data in chunks for larger packets"""
-        all_data = b''
-        chunk_size = 64
+    def send_virtual(self, frame, ack_timeout=1000):
+        """
+        Send a virtual packet frame of any size
         
-        while True:
-            try:
-                chunk = self.endpoint_in.read(chunk_size, timeout=timeout)
-                chunk_bytes = chunk.tobytes()
-                all_data += chunk_bytes
-                log(f"Chunk received: {len(chunk_bytes)} bytes")
-                
-                # If chunk is smaller than expected, we probably got all data
-                if len(chunk_bytes) < chunk_size:
-                    break
-                    
-            except usb.core.USBTimeoutError:
-                log("No more data - timeout reached")
-                break
-            except usb.core.USBError as e:
-                log(f"Chunk read error: {e}")
-                break
-        
-        if all_data:
-            log(f"Total received: {len(all_data)} bytes: {all_data.hex()}")
-            return all_data
-        return None
+        Frames with more payload than the calculator's raw packet size are split
+        into raw type 3 fragments and a final type 4 one (see frames.iter_fragments).
+        The full-size fragments are packed into one reused send buffer, an
+        array('B') that pyusb writes without copying. Each fragment goes out as
+        one bulk transfer, which the USB stack splits into wMaxPacketSize
+        packets, and every fragment but the last must be acked before the next
+        is sent. The ack of the last fragment is left to the caller, as for a
+        frame sent with send_data.
+        
+        Returns:
+            True if every fragment was sent and the intermediate ones acked
+        """
+        if len(self._tx) != frames.RAW_HEADER_SIZE + self.max_raw_size:
+            self._tx = array('B', bytes(frames.RAW_HEADER_SIZE + self.max_raw_size))
+        count = frames.fragment_count(len(frame), self.max_raw_size)
+        start = time.perf_counter()
+        
+        for number, piece in enumerate(frames.iter_fragments(frame, self._tx), 1):
+            if not self.send_data(piece):
+                return False
+            if number < count:
+                ack = self.receive_data(ack_timeout)
+                if ack != frames.ACK:
+                    error(f"Fragment {number} of {count} was not acknowledged")
+                    dump_recent_frames(f"unacknowledged fragment {number}")
+                    return False
+        
+        seconds = time.perf_counter() - start
+        self.last_upload = {'bytes': len(frame), 'fragments': count, 'seconds': seconds}
+        self.metrics.observe_operation("fragmented_send", seconds)
+        if count > 1:
+            log(f"Sent {len(frame)} bytes in {count} fragments in {seconds * 1000:.1f} ms "
+                f"({len(frame) / max(seconds, 1e-9) / 1024:.1f} KB/s)")
+        return True
     
-    def transaction_step(self, step_num, direction, data_hex=None, expected_response=None, description=""):
+    def receive_fragments(self, first, timeout=1000):
         """
-        Execute a single transaction step
+        Receive the rest of a virtual packet whose first raw fragment is `first`
         
-        Args:
-            step_num: Step number for logging
-            direction: 'OUT' (send to calc) or 'IN' (receive from calc)
-            data_hex: Hex string to send (for OUT operations)
-            expected_response: Expected hex response (for validation)
-            description: Human readable description of what this step does
+        Every type 3 fragment is acked and reading goes on until the type 4 one.
+        
+        Returns:
+            The whole virtual packet as one raw frame (see frames.join_fragments), or None on timeout
         """
-        log(f"--- Step {step_num}: {direction} {description} ---")
+        pieces = [first]
+        while pieces[-1][4] == frames.RAW_VIRT_DATA:
+            if not self.send_data(frames.ACK, "Fragment ack"):
+                return None
+            piece = self.receive_data(timeout)
+            if piece is None:
+                return None
+            pieces.append(piece)
+        return frames.join_fragments(pieces)
+    
+    def receive_data(self, timeout=1000):
+        """Receive one frame from the calculator as bytes, or None on timeout"""
+        try:
+            frame = self.read_frame(timeout)
+        except usb.core.USBError as e:
+            error(f"Receive error: {e}")
+            self.metrics.count('receive_errors')
+            return None
         
-        if direction == 'OUT':
-            if data_hex is None:
-                log("ERROR: No data specified for OUT operation")
-                return False
-            return self.send_data(data_hex, description)
+        if frame is None:
+            log("Receive timeout - no data received")
+            self.metrics.count('timeouts')
+            return None
+        debug("Received %d bytes, raw type %d", len(frame), frame[4])
+        return bytes(frame)
+    
+    def read_frame(self, timeout=1000):
+        """
+        Read one whole raw frame into the reused receive buffer
         
-        elif direction == 'IN' and expected_response == "skip":
-            # For large packets, try chunked reading
-            if "large" in description.lower():
-                response = self.receive_data_chunked()
-            else:
-                response = self.receive_data()
-                
-            if response is None:
-                log("No response received")
-                return False
-            return response
+        The raw header gives the frame length, so a frame that spans several
+        bulk reads is complete exactly when its last byte arrives; there is no
+        guessing from short reads or timeouts. Bytes of an unfinished frame are
+        kept for the next call, so a timeout in the middle of a frame loses nothing.
         
-        elif direction == 'IN':
-            # For large packets, try chunked reading
-            if "large" in description.lower():
-                response = self.receive_data_chunked()
-            else:
-                response = self.receive_data()
-                
-            if response is None:
-                log("No response received")
-                return False
-                
-            response_hex = response.hex()
-            if expected_response:
-                if response_hex == expected_response.replace(' ', ''):
-                    log(f"Got expected response: {response_hex}")
-                else:
-                    log(f"Response mismatch!")
-                    log(f"Expected: {expected_response}")
-                    log(f"Got:      {response_hex}")
-            else:
-                log(f"Response: {response_hex}")
+        Returns:
+            memoryview of the frame (valid until the next read), or None on timeout
+        
+        Raises:
+            usb.core.USBError: any USB error other than a timeout
+        """
+        while True:
+            available = self._rx_end - self._rx_start
+            needed = frames.RAW_HEADER_SIZE
+            if available >= needed:
+                needed += frames.RAW_HEADER.unpack_from(self._rx, self._rx_start)[0]
+                if available >= needed:
+                    start = self._rx_start
+                    self._rx_start += needed
+                    frame = self._rx_view[start:self._rx_start]
+                    record_frame('IN', frame)
+                    if self.recorder is not None:
+                        self.recorder.record('IN', frame)
+                    self.metrics.count('frames_in')
+                    self.metrics.count('bytes_in', needed)
+                    return frame
             
-            return response
+            if not self._fill_receive_buffer(needed - available, timeout):
+                return None
+    
+    def _fill_receive_buffer(self, needed, timeout):
+        """Read at least part of the `needed` bytes; returns the number of bytes read"""
+        if self._rx_start == self._rx_end:
+            self._rx_start = self._rx_end = 0
         
-        else:
-            log(f"ERROR: Unknown direction '{direction}'")
-            return False
+        if self._rx_end == 0:
+            # Nothing buffered: the bulk read lands directly in the receive buffer
+            count = self._read_into(self._rx, timeout)
+            self._rx_end = count
+            return count
+        
+        # Rest of a frame that spans several transfers. pyusb only reads to the
+        # start of an array, so it goes through the spare buffer.
+        if self._rx_end + len(self._rx_spare) > len(self._rx):
+            available = self._rx_end - self._rx_start
+            self._rx_view[:available] = self._rx_view[self._rx_start:self._rx_end]
+            self._rx_start, self._rx_end = 0, available
+            if needed > len(self._rx) - available:
+                raise usb.core.USBError(f"Frame of {needed + available} bytes exceeds the receive buffer")
         
+        room = len(self._rx) - self._rx_end
+        if room >= len(self._rx_spare):
+            spare, spare_view = self._rx_spare, self._rx_spare_view
+        else:
+            # A frame longer than the spare buffer is nearly filling the receive buffer
+            spare = array('B', bytes(room))
+            spare_view = memoryview(spare)
+        count = self._read_into(spare, timeout)
+        self._rx_view[self._rx_end:self._rx_end + count] = spare_view[:count]
+        self._rx_end += count
+        return count
+    
+    def _read_into(self, buffer, timeout):
+        try:
+            return self.endpoint_in.read(buffer, timeout=timeout)
+        except usb.core.USBTimeoutError:
+            return 0
     
     def perform_sequence(self, sequence):
         """
         Execute a custom transaction sequence
         
         Args:
-            steps: List of dictionaries, each containing:
-                   {'direction': 'OUT'/'IN', 'data': 'hex_string', 'expected': 'hex_string', 'desc': 'description', 'delay': seconds}
+            sequence: CompiledSequence, or a list of dictionaries, each containing:
+                   {'direction': 'OUT'/'IN', 'data': bytes, 'expected': bytes, 'desc': 'description', 'delay': seconds}
+        
+        Returns:
+            True unless a step failed to send
+        """
+        return self.run_sequence(sequence).ok
+    
+    def run_sequence(self, sequence):
         """
-        log("Starting custom transaction...")
+        Run a sequence step by step and report what happened
         
-        for i, step in enumerate(sequence, 1):
-            # Optional delay before step
-            if 'delay' in step and step['delay'] > 0:
-                time.sleep(step['delay'])
-            
-            direction = step['direction']
-            data_hex = step.get('data', None)
-            expected = step.get('expected', None)
-            description = step.get('desc', '')
+        List-of-dicts sequences are compiled first; pass a CompiledSequence to
+        skip that. Steps only compare bytes - every string was dealt with when
+        the sequence was compiled.
+        
+        Returns:
+            SequenceResult with the captured frames, mismatches and step timings
+        """
+        sequence = compile_sequence(sequence)
+        result = SequenceResult(sequence)
+        debug("Starting custom transaction...")
+        run_start = time.perf_counter()
+        
+        for number, step in enumerate(sequence.steps, 1):
+            if step.delay > 0:
+                time.sleep(step.delay)
+            debug("--- Step %d: %s %s ---", number, step.direction, step.description)
+            step_start = time.perf_counter()
             
-            result = self.transaction_step(i, direction, data_hex, expected, description)
+            if step.direction == SEND:
+                if len(step.data) > frames.RAW_HEADER_SIZE + self.max_raw_size:
+                    sent = self.send_virtual(step.data)
+                else:
+                    sent = self.send_data(step.data, chunked=step.framing == FRAMING_CHUNKED)
+                result.bytes_sent += len(step.data)
+                elapsed = time.perf_counter() - step_start
+                result.timings.append(elapsed)
+                self.metrics.observe_step(step.label, elapsed)
+                if not sent:
+                    result.fail(number)
+                    error(f"Transaction failed at step {number}")
+                    dump_recent_frames(f"failed step {number}")
+                    break
+                continue
             
-            # Stop if step failed (for OUT operations)
-            if direction == 'OUT' and not result:
-                log(f"Transaction failed at step {i}")
-                return False
+            response = self.receive_data()
+            if response is not None and response[4] == frames.RAW_VIRT_DATA:
+                # A virtual packet larger than one raw packet (e.g. a long list)
+                response = self.receive_fragments(response)
+            elapsed = time.perf_counter() - step_start
+            result.timings.append(elapsed)
+            self.metrics.observe_step(step.label, elapsed)
+            if response is not None:
+                result.bytes_received += len(response)
+                announced = frames.buffer_size(response)
+                if announced:
+                    self.max_raw_size = announced
+            if response is None:
+                log("No response received")
+            if not result.received(number, step, response):
+                self.mismatch_count += 1
+                self.metrics.count('mismatches')
+                warning("Response mismatch!")
+                warning("Expected: %s", Hex(step.expected))
+                warning("Got:      %s", Hex(response))
+        else:
+            debug("Transaction completed!")
         
-        log("Transaction completed!")
-        return True
+        result.seconds = time.perf_counter() - run_start
+        self.metrics.observe_operation(sequence.name or "sequence", result.seconds)
+        return result
     
     def get_all_program_names(self):
         """
         Get all program names from the TI-84 Plus CE calculator
         
-        Args:
-            initial_sequence: List of transaction steps to execute before the loop
-            final_sequence: List of transaction steps to execute after the loop
-            
         Returns:
-            List of hex responses that contained the target pattern
+            List of directory entry frames that contained the target pattern, or False on failure
         """
-        initial_sequence = PresetPackets().get_all_program_names_initial
-        final_sequence = PresetPackets().get_all_program_names_final
-        
         log("Starting get_all_program_names...")
+        start = time.perf_counter()
+        try:
+            program_responses = list(self.iter_directory())
+        except usb.core.USBError as e:
+            error(f"get_all_program_names failed: {e}")
+            return False
+        finally:
+            self.metrics.observe_operation("get_all_program_names", time.perf_counter() - start)
+        
+        log(f"get_all_program_names completed. Found {len(program_responses)} responses with target pattern.")
+        return program_responses
+    
+    def iter_program_names(self):
+        """
+        Yield the titles of TI-BASIC programs as the calculator lists them
         
-        # Pattern to look for in responses
-        target_pattern = "00050003000001000005010008000004000000"
-        termination_pattern = "000000060400000000dd00"
-        loop_send_data = "0000000205e000"
+        Stop iterating (or close the generator) as soon as you have what you need;
+        the rest of the listing is read and acknowledged without being decoded,
+        and the link is left ready for the next transaction. Raises
+        usb.core.USBError if the listing fails.
+        """
+        with contextlib.closing(self.iter_directory()) as entries:
+            for entry in entries:
+                yield frames.program_entry_title(entry)
+    
+    def iter_directory(self, idle_timeout=3000):
+        """
+        Yield the directory entry frames of TI-BASIC programs as they arrive
         
-        # List to store responses containing the target pattern
-        program_responses = []
+        Every frame is decoded by its length and type header: only complete
+        virtual packets are acknowledged, entries are picked by their variable
+        type attribute, and the listing ends on the end-of-transmission packet.
+        There is no limit on the number of entries; instead the listing fails
+        if the calculator stays silent for `idle_timeout` milliseconds.
+        If the consumer stops early, the rest of the listing is still read and
+        acknowledged (without being decoded), since the captures show no way to
+        cancel one. Counts and timing end up in self.last_listing.
         
-        # Execute initial preset sequence if provided
-        if initial_sequence:
-            log("Executing initial sequence...")
-            if not self.perform_sequence(initial_sequence):
-                log("Initial sequence failed!")
-                return False
+        Raises:
+            usb.core.USBError: the listing could not be started or completed
+        """
+        log("Executing initial sequence...")
+        if not self.perform_sequence(self.preset_packets.get_all_program_names_initial):
+            raise usb.core.USBError("Directory listing request failed")
         
-        # Main loop
-        log("Starting main loop...")
-        loop_count = 0
-        max_loops = 250  # Safety limit to prevent infinite loops
+        stats = {'frames': 0, 'entries': 0, 'programs': 0, 'seconds': 0.0, 'complete': False, 'stopped': False}
+        self.last_listing = stats
+        start = time.perf_counter()
+        entries = self._directory_entries(stats, idle_timeout)
         
-        while loop_count < max_loops:
-            loop_count += 1
-            log(f"--- Loop iteration {loop_count} ---")
-            
-            # Receive data from TI
-            response = self.receive_data()
-            if response is None:
-                log("No response received from TI, continuing...")
-            else:
-                response_hex = response.hex()
-                log(f"Received response: {response_hex}")
+        try:
+            for entry in entries:
+                yield entry
+        except GeneratorExit:
+            stats['stopped'] = True
+            for _ in entries:
+                pass
+            raise
+        finally:
+            stats['seconds'] = time.perf_counter() - start
+            self.metrics.observe_operation("directory_listing_stopped" if stats['stopped'] else "directory_listing",
+                                           stats['seconds'])
+            outcome = 'completed' if stats['complete'] else 'failed'
+            if stats['stopped']:
+                outcome += ' (stopped early)'
+            log(f"Listing {outcome}: {stats['entries']} entries, {stats['programs']} programs, "
+                f"{stats['frames']} frames in {stats['seconds'] * 1000:.1f} ms")
+    
+    def _directory_entries(self, stats, idle_timeout):
+        """Listing engine of iter_directory: yields program entries, then runs the final sequence"""
+        virtual_data = bytearray()
+        
+        try:
+            while True:
+                frame = self.read_frame(timeout=idle_timeout)
+                if frame is None:
+                    raise usb.core.USBTimeoutError(f"No directory entry within {idle_timeout} ms")
+                
+                raw_type = frame[4]
+                if raw_type not in (frames.RAW_VIRT_DATA, frames.RAW_VIRT_DATA_LAST):
+                    debug("Ignoring raw packet type %d during listing", raw_type)
+                    continue
+                
+                stats['frames'] += 1
+                if raw_type == frames.RAW_VIRT_DATA or virtual_data:
+                    virtual_data += frame[frames.RAW_HEADER_SIZE:]
+                    if raw_type == frames.RAW_VIRT_DATA:
+                        # More fragments of this virtual packet follow
+                        if not self.send_data(frames.ACK, "Fragment ack"):
+                            raise usb.core.USBError("Failed to acknowledge fragment")
+                        continue
+                    packet = virtual_data
+                else:
+                    packet = frame[frames.RAW_HEADER_SIZE:]
                 
-                # Check if response contains the target pattern
-                if target_pattern in response_hex:
-                    log("Found target pattern! Storing response...")
-                    program_responses.append(response_hex)
+                if len(packet) < frames.VIRTUAL_PACKET_HEADER.size:
+                    raise usb.core.USBError(f"Short virtual packet of {len(packet)} bytes during listing")
+                vlen, opcode = frames.VIRTUAL_PACKET_HEADER.unpack_from(packet)
+                payload = bytes(packet[frames.VIRTUAL_PACKET_HEADER.size:frames.VIRTUAL_PACKET_HEADER.size + vlen])
+                virtual_data.clear()
                 
-                # Check for termination condition
-                if response_hex == termination_pattern.replace(' ', ''):
-                    log("Termination pattern detected! Exiting loop...")
+                if opcode == frames.OP_EOT:
+                    # Acknowledged by the final sequence
+                    log("End of listing")
                     break
+                if opcode != frames.OP_VAR_HEADER:
+                    raise usb.core.USBError(f"Unexpected opcode {opcode:04x} during listing")
+                
+                if not self.send_data(frames.ACK, "Entry ack"):
+                    raise usb.core.USBError("Failed to acknowledge directory entry")
+                
+                stats['entries'] += 1
+                try:
+                    _, attrs = frames.parse_var_header(payload)
+                except struct.error:
+                    raise usb.core.USBError(f"Truncated directory entry of {len(payload)} bytes") from None
+                if frames.var_type(attrs) == frames.TYPE_PROGRAM:
+                    stats['programs'] += 1
+                    yield frames.virtual_frame(frames.OP_VAR_HEADER, payload)
             
-            # Send the loop data to TI
-            log(f"Sending loop data: {loop_send_data}")
-            if not self.send_data(loop_send_data, "Loop send"):
-                log("Failed to send loop data!")
-                return False
-        
-        if loop_count >= max_loops:
-            log(f"WARNING: Loop terminated after {max_loops} iterations (safety limit)")
-        
-        # Execute final preset sequence if provided
-        if final_sequence:
             log("Executing final sequence...")
-            if not self.perform_sequence(final_sequence):
-                log("Final sequence failed!")
-                return False
-        
-        log(f"get_all_program_names completed. Found {len(program_responses)} responses with target pattern.")
-        return program_responses
+            if not self.perform_sequence(self.preset_packets.get_all_program_names_final):
+                raise usb.core.USBError("Directory listing final sequence failed")
+            stats['complete'] = True
+        except usb.core.USBError:
+            dump_recent_frames("listing error")
+            raise
     
     def get_program_content(self, packet):
         """
-        Execute a transaction sequence and return the stored value from the "store_value" step
+        Execute a read sequence and return the program content as one frame
         
         Args:
-            packet: List of transaction steps, same format as perform_sequence
-                   One step should have 'desc' containing "store_value" to mark what to return
+            packet: Sequence in the same format as perform_sequence; one IN step
+                   should be marked "store_content" (or capture into the CONTENT slot)
         
         Returns:
-            The hex string from the step marked with "store_value", or None if not found
+            The content frame bytes, reassembled from every fragment the calculator
+            sent, or None if the transfer failed
         """
         log("Starting get_program_content...")
         
-        stored_value = None
+        start = time.perf_counter()
+        try:
+            tokens = b''.join(self.iter_program_content(packet))
+        except usb.core.USBError as e:
+            error(f"get_program_content failed: {e}")
+            return None
+        finally:
+            self.metrics.observe_operation("get_program_content", time.perf_counter() - start)
         
-        for i, step in enumerate(packet, 1):
-            # Optional delay before step
-            if 'delay' in step and step['delay'] > 0:
-                time.sleep(step['delay'])
-
-            
-            direction = step['direction']
-            data_hex = step.get('data', None)
-            expected = step.get('expected', None)
-            description = step.get('desc', '')
-
-            
-            # Execute the transaction step
-            result = self.transaction_step(i, direction, data_hex, expected, description)
-            
-            # Stop if OUT operation failed
-            if direction == 'OUT' and not result:
-                log(f"Transaction failed at step {i}")
-                return None
-            
-            # Check if this is the step we need to store
-            if direction == 'IN' and result and "store_content" in expected.lower():
-                if isinstance(result, bytes):
-                    stored_value = result.hex()
-                else:
-                    stored_value = str(result)
-                log(f"Stored value from step {i}: {stored_value}")
+        log(f"get_program_content completed! {len(tokens)} token bytes")
+        return frames.program_content(tokens)
+    
+    def iter_program_content(self, packet, idle_timeout=3000):
+        """
+        Yield the token bytes of a program as its content frames arrive
+        
+        The steps before the content step of `packet` run as a normal sequence.
+        The content itself is followed by its declared virtual packet length
+        across as many raw fragments as the calculator sends, acknowledging each
+        one before handing its tokens on, so the consumer can decode (see
+        Packet_Manager.iter_program_text) while the rest is still in transit.
+        The steps after the content step run once the last fragment is in.
+        Closing the generator early still reads and acknowledges the remaining
+        fragments, as iter_directory does. Counts and timing end up in
+        self.last_download.
+        
+        Raises:
+            usb.core.USBError: the read failed or the content was cut short
+            ValueError: `packet` has no content step
+        """
+        sequence = compile_sequence(packet)
+        content_step = next((i for i, step in enumerate(sequence.steps) if step.capture == CONTENT), None)
+        if content_step is None:
+            raise ValueError("Sequence has no step that captures the program content")
+        
+        if not self.run_sequence(CompiledSequence(sequence.steps[:content_step], sequence.name)).ok:
+            raise usb.core.USBError("Program read request failed")
         
-        log("get_program_content completed!")
+        stats = {'bytes': 0, 'frames': 0, 'seconds': 0.0, 'complete': False, 'stopped': False}
+        self.last_download = stats
+        start = time.perf_counter()
+        chunks = self._content_chunks(stats, idle_timeout,
+                                      CompiledSequence(sequence.steps[content_step + 1:], sequence.name))
         
-        if stored_value is None:
-            log("WARNING: No step with 'store_value' description found!")
+        try:
+            for chunk in chunks:
+                yield chunk
+        except GeneratorExit:
+            stats['stopped'] = True
+            for _ in chunks:
+                pass
+            raise
+        finally:
+            stats['seconds'] = time.perf_counter() - start
+            self.metrics.observe_operation("program_download_stopped" if stats['stopped'] else "program_download",
+                                           stats['seconds'])
+            outcome = 'completed' if stats['complete'] else 'failed'
+            if stats['stopped']:
+                outcome += ' (stopped early)'
+            log(f"Download {outcome}: {stats['bytes']} token bytes in {stats['frames']} frames "
+                f"in {stats['seconds'] * 1000:.1f} ms")
+    
+    def _content_chunks(self, stats, idle_timeout, final_sequence):
+        """Download engine of iter_program_content: yields token chunks, then runs `final_sequence`"""
+        declared = None
+        # Variable data bytes seen so far; the first 2 are the length field, not tokens
+        received = 0
         
-        return stored_value
\ No newline at end of file
+        try:
+            while True:
+                frame = self.read_frame(timeout=idle_timeout)
+                if frame is None:
+                    raise usb.core.USBTimeoutError(f"No program content within {idle_timeout} ms")
+                
+                raw_type = frame[4]
+                if raw_type not in (frames.RAW_VIRT_DATA, frames.RAW_VIRT_DATA_LAST):
+                    debug("Ignoring raw packet type %d during download", raw_type)
+                    continue
+                
+                stats['frames'] += 1
+                data = frame[frames.RAW_HEADER_SIZE:]
+                if declared is None:
+                    if len(data) < frames.VIRTUAL_PACKET_HEADER.size:
+                        raise usb.core.USBError(f"Short virtual packet of {len(data)} bytes during download")
+                    declared, opcode = frames.VIRTUAL_PACKET_HEADER.unpack_from(data)
+                    if opcode != frames.OP_VAR_CONTENT:
+                        raise usb.core.USBError(f"Unexpected opcode {opcode:04x} instead of program content")
+                    data = data[frames.VIRTUAL_PACKET_HEADER.size:]
+                
+                # Anything past the declared length is not part of the variable
+                data = data[:max(0, declared - received)]
+                tokens = bytes(data[max(0, 2 - received):])
+                received += len(data)
+                
+                if raw_type == frames.RAW_VIRT_DATA:
+                    # Let the calculator send the next fragment while this one is decoded
+                    if not self.send_data(frames.ACK, "Fragment ack"):
+                        raise usb.core.USBError("Failed to acknowledge content fragment")
+                elif received < declared:
+                    raise usb.core.USBError(f"Program content ended after {received} of {declared} bytes")
+                
+                stats['bytes'] += len(tokens)
+                if tokens:
+                    yield tokens
+                if raw_type == frames.RAW_VIRT_DATA_LAST:
+                    break
+            
+            # The final ack of the last fragment
+            if not self.perform_sequence(final_sequence):
+                raise usb.core.USBError("Program read final sequence failed")
+            stats['complete'] = True
+        except usb.core.USBError:
+            dump_recent_frames("download error")
+            raise
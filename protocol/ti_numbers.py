@@ -0,0 +1,224 @@
+'''TI 9-byte BCD reals and complex numbers, encoded and decoded a whole NumPy array at a time'''
+import math
+
+import numpy as np
+
+# Bytes of one real: flags, biased exponent, 14 BCD mantissa digits
+REAL_SIZE = 9
+COMPLEX_SIZE = 2 * REAL_SIZE
+MANTISSA_DIGITS = 14
+MANTISSA_BYTES = MANTISSA_DIGITS // 2
+
+# Flag byte bits
+FLAG_NEGATIVE = 0x80
+FLAG_COMPLEX = 0x0C
+
+EXPONENT_BIAS = 0x80
+# Decimal exponents a real can have; smaller magnitudes are stored as 0
+MIN_EXPONENT = -99
+MAX_EXPONENT = 99
+
+# Elements a list may hold, and rows or columns a matrix may have
+MAX_LIST_LENGTH = 999
+MAX_MATRIX_SIZE = 99
+
+# Divisors that split a 14-digit mantissa into its 7 digit pairs, most significant first
+_PAIR_DIVISORS = 10 ** np.arange(MANTISSA_DIGITS - 2, -1, -2, dtype=np.int64)
+# Bound on the relative error of _scale (half an ulp for the power of ten and for the product), doubled
+_SCALE_ERROR = 2 * np.finfo(np.float64).eps
+# Weights of the 14 mantissa digits
+_DIGIT_WEIGHTS = 10 ** np.arange(MANTISSA_DIGITS - 1, -1, -1, dtype=np.int64)
+
+
+def _scale(magnitude, shift):
+    """magnitude * 10**shift, multiplying or dividing by an exact power of ten where possible"""
+    return np.where(shift >= 0, magnitude * 10.0 ** np.clip(shift, 0, None),
+                    magnitude / 10.0 ** np.clip(-shift, 0, None))
+
+
+def encode_reals(values, flags=0):
+    """
+    Encode real numbers as TI BCD reals
+
+    The mantissa is rounded to 14 significant digits. Digits are taken apart
+    with integer array arithmetic; only values within a hair of a rounding
+    tie are formatted one by one, so the result matches decimal rounding.
+
+    Args:
+        values: Anything np.asarray turns into real numbers (scalar, list, array)
+        flags: Extra flag bits for every value, e.g. FLAG_COMPLEX for complex parts
+
+    Returns:
+        uint8 array of shape (n, REAL_SIZE)
+
+    Raises:
+        ValueError: a value is not finite or too large for the calculator
+    """
+    x = np.asarray(values, dtype=np.float64).ravel()
+    if not np.isfinite(x).all():
+        raise ValueError("TI reals must be finite")
+
+    magnitude = np.abs(x)
+    nonzero = magnitude > 0
+    exponent = np.zeros(x.shape, dtype=np.int64)
+    exponent[nonzero] = np.floor(np.log10(magnitude[nonzero]))
+
+    # log10 can land one off near powers of ten; the scaled value shows which way
+    scaled = _scale(magnitude, MANTISSA_DIGITS - 1 - exponent)
+    off = nonzero & ((scaled < 10 ** (MANTISSA_DIGITS - 1)) | (scaled >= 10 ** MANTISSA_DIGITS))
+    exponent[off] += np.where(scaled[off] < 10 ** (MANTISSA_DIGITS - 1), -1, 1)
+    scaled[off] = _scale(magnitude[off], MANTISSA_DIGITS - 1 - exponent[off])
+
+    mantissa = np.rint(scaled).astype(np.int64)
+    # Rounding 99999999999999.5 up carries into a 15th digit
+    carry = mantissa >= 10 ** MANTISSA_DIGITS
+    mantissa[carry] //= 10
+    exponent[carry] += 1
+
+    # Scaling is off by at most a few ulps, which only changes the rounding when the dropped
+    # digits are that close to a half; those few values are rounded from their decimal form
+    near_half = np.flatnonzero(nonzero & (np.abs(scaled - np.floor(scaled) - 0.5) < scaled * _SCALE_ERROR))
+    for i in near_half:
+        digits, exp = format(magnitude[i], f'.{MANTISSA_DIGITS - 1}e').split('e')
+        mantissa[i] = int(digits.replace('.', ''))
+        exponent[i] = int(exp)
+
+    if (exponent[nonzero] > MAX_EXPONENT).any():
+        raise ValueError(f"TI reals must be below 1e{MAX_EXPONENT + 1} in magnitude")
+    underflow = nonzero & (exponent < MIN_EXPONENT)
+    mantissa[underflow] = 0
+    exponent[~nonzero | underflow] = 0
+
+    pairs = (mantissa[:, None] // _PAIR_DIVISORS) % 100
+    out = np.empty((x.size, REAL_SIZE), dtype=np.uint8)
+    out[:, 0] = flags | np.where((x < 0) & (mantissa > 0), FLAG_NEGATIVE, 0)
+    out[:, 1] = exponent + EXPONENT_BIAS
+    out[:, 2:] = (pairs // 10) << 4 | pairs % 10
+    return out
+
+
+def encode_real(value, flags=0):
+    """
+    Encode one real number as a TI BCD real (bytes)
+
+    Same result as encode_reals for a single value, without the array
+    overhead that dominates for scalars.
+    """
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError("TI reals must be finite")
+    if value == 0:
+        return bytes((flags, EXPONENT_BIAS)) + bytes(MANTISSA_BYTES)
+    digits, exponent = format(abs(value), f'.{MANTISSA_DIGITS - 1}e').split('e')
+    exponent = int(exponent)
+    if exponent > MAX_EXPONENT:
+        raise ValueError(f"TI reals must be below 1e{MAX_EXPONENT + 1} in magnitude")
+    if exponent < MIN_EXPONENT:
+        return bytes((flags, EXPONENT_BIAS)) + bytes(MANTISSA_BYTES)
+    # Decimal digits read as hex are exactly their packed BCD bytes
+    return (bytes((flags | (FLAG_NEGATIVE if value < 0 else 0), exponent + EXPONENT_BIAS))
+            + bytes.fromhex(digits.replace('.', '')))
+
+
+def decode_reals(data):
+    """
+    Decode TI BCD reals (flag bits other than the sign are ignored)
+
+    Args:
+        data: Bytes-like of a multiple of REAL_SIZE bytes, or a (n, REAL_SIZE) uint8 array
+
+    Returns:
+        float64 array of n values
+    """
+    raw = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    raw = raw.reshape(-1, REAL_SIZE)
+
+    mantissa_bytes = raw[:, 2:].astype(np.int64)
+    digits = np.empty((raw.shape[0], MANTISSA_DIGITS), dtype=np.int64)
+    digits[:, 0::2] = mantissa_bytes >> 4
+    digits[:, 1::2] = mantissa_bytes & 0x0F
+    mantissa = (digits @ _DIGIT_WEIGHTS).astype(np.float64)
+
+    shift = MANTISSA_DIGITS - 1 - (raw[:, 1].astype(np.int64) - EXPONENT_BIAS)
+    values = np.where(shift >= 0, mantissa / 10.0 ** np.clip(shift, 0, None),
+                      mantissa * 10.0 ** np.clip(-shift, 0, None))
+    return np.where(raw[:, 0] & FLAG_NEGATIVE, -values, values)
+
+
+def encode_complex(values):
+    """
+    Encode complex numbers as pairs of TI reals flagged complex
+
+    Returns:
+        uint8 array of shape (n, COMPLEX_SIZE): real part, then imaginary part
+    """
+    z = np.asarray(values, dtype=np.complex128).ravel()
+    out = np.empty((z.size, COMPLEX_SIZE), dtype=np.uint8)
+    out[:, :REAL_SIZE] = encode_reals(z.real, FLAG_COMPLEX)
+    out[:, REAL_SIZE:] = encode_reals(z.imag, FLAG_COMPLEX)
+    return out
+
+
+def decode_complex(data):
+    """Decode pairs of TI reals into a complex128 array"""
+    parts = decode_reals(data)
+    return parts[0::2] + 1j * parts[1::2]
+
+
+def is_complex(values):
+    """True if `values` need complex numbers on the calculator"""
+    array = np.asarray(values)
+    return np.iscomplexobj(array) and bool(np.any(array.imag != 0))
+
+
+def list_data(values):
+    """
+    Variable data of a real or complex list: element count (least significant byte first), then the elements
+
+    Returns:
+        (data bytes, True if the list is complex)
+    """
+    array = np.asarray(values).ravel()
+    if not 1 <= array.size <= MAX_LIST_LENGTH:
+        raise ValueError(f"Lists hold 1 to {MAX_LIST_LENGTH} elements, got {array.size}")
+    complex_list = is_complex(array)
+    elements = encode_complex(array) if complex_list else encode_reals(array.real if np.iscomplexobj(array) else array)
+    return array.size.to_bytes(2, 'little') + elements.tobytes(), complex_list
+
+
+def parse_list_data(data):
+    """
+    Values of a list's variable data: float64 array, or complex128 for a complex list
+
+    Raises:
+        ValueError: the data is shorter than its element count says
+    """
+    count = int.from_bytes(data[:2], 'little')
+    elements = memoryview(data)[2:]
+    if len(elements) == count * COMPLEX_SIZE and count:
+        return decode_complex(elements)
+    if len(elements) < count * REAL_SIZE:
+        raise ValueError(f"List of {count} elements has only {len(elements)} bytes of data")
+    return decode_reals(elements[:count * REAL_SIZE])
+
+
+def matrix_data(values):
+    """Variable data of a real matrix: column count, row count, then the elements row by row"""
+    array = np.asarray(values, dtype=np.float64)
+    if array.ndim != 2 or not (1 <= array.shape[0] <= MAX_MATRIX_SIZE and 1 <= array.shape[1] <= MAX_MATRIX_SIZE):
+        raise ValueError(f"Matrices are 2-D with 1 to {MAX_MATRIX_SIZE} rows and columns, got shape {array.shape}")
+    rows, columns = array.shape
+    return bytes((columns, rows)) + encode_reals(array).tobytes()
+
+
+def parse_matrix_data(data):
+    """
+    Values of a matrix's variable data as a (rows, columns) float64 array
+
+    Raises:
+        ValueError: the data is shorter than its dimensions say
+    """
+    columns, rows = data[0], data[1]
+    if len(data) < 2 + rows * columns * REAL_SIZE:
+        raise ValueError(f"{rows}x{columns} matrix has only {len(data) - 2} bytes of data")
+    return decode_reals(memoryview(data)[2:2 + rows * columns * REAL_SIZE]).reshape(rows, columns)
@@ -0,0 +1,147 @@
+'''Table-driven decoding of TI-BASIC token bytes into text'''
+import re
+
+# Average run of one-byte tokens between prefixes above which runs are translated in bulk
+RUN_LENGTH_THRESHOLD = 8
+
+
+class TokenDecoder:
+    """
+    Decodes token bytes with two levels of 256-entry lookup tables.
+
+    The first table is indexed by the first byte of a token and holds either
+    the text of a one-byte token, or - for two-byte prefixes such as 0x5E, 0x62
+    and 0xBB - the second-level table for the following byte. Runs of one-byte
+    tokens between prefixes are translated in a single str.translate call when
+    prefixes are sparse; prefix-heavy text (lowercase letters) is walked token
+    by token instead.
+
+    A second byte the prefix table does not know falls back to the prefix's own
+    one-byte meaning, if it has one, just like the old dictionary lookup.
+
+    Args:
+        byte_map: {token bytes: text} with one- and two-byte tokens
+        unknown: Text emitted for bytes that are not a known token
+    """
+
+    def __init__(self, byte_map, unknown='?'):
+        self.unknown = unknown
+        singles = [unknown] * 256
+        seconds = {}
+        for code, text in byte_map.items():
+            if len(code) == 1:
+                singles[code[0]] = text
+            elif len(code) == 2:
+                seconds.setdefault(code[0], [None] * 256)[code[1]] = text
+            else:
+                raise ValueError(f"Tokens are one or two bytes long, got {code.hex()}")
+
+        # First-level table: text, or (second-level table, text when the prefix stands alone)
+        self.first = [(seconds[b], singles[b]) if b in seconds else singles[b] for b in range(256)]
+        self.prefixes = bytes(sorted(seconds))
+        self._single_table = {b: text for b, text in enumerate(singles)}
+        self._prefix_re = re.compile(b'[' + b''.join(re.escape(bytes((b,))) for b in self.prefixes) + b']')
+
+    def decode(self, data):
+        """Decode a complete buffer of token bytes."""
+        text, _ = self._decode(data, final=True)
+        return text
+
+    def stream(self):
+        """Return a TokenStreamDecoder that decodes buffers as they arrive."""
+        return TokenStreamDecoder(self)
+
+    def _decode(self, data, final):
+        """Decode `data`; returns (text, bytes consumed). Without `final` a trailing prefix byte is left over."""
+        prefix_count = sum(data.count(prefix) for prefix in self.prefixes)
+        if prefix_count * RUN_LENGTH_THRESHOLD > len(data):
+            return self._decode_tokens(data, final)
+        return self._decode_runs(data, final)
+
+    def _decode_tokens(self, data, final):
+        first = self.first
+        out = []
+        append = out.append
+        pos = 0
+        end = len(data)
+
+        while pos < end:
+            entry = first[data[pos]]
+            if entry.__class__ is str:
+                append(entry)
+                pos += 1
+                continue
+
+            second, alone = entry
+            if pos + 1 < end:
+                text = second[data[pos + 1]]
+                if text is not None:
+                    append(text)
+                    pos += 2
+                    continue
+            elif not final:
+                # The second byte is still on its way
+                break
+            append(alone)
+            pos += 1
+
+        return ''.join(out), pos
+
+    def _decode_runs(self, data, final):
+        first = self.first
+        single_table = self._single_table
+        search = self._prefix_re.search
+        out = []
+        pos = 0
+        end = len(data)
+
+        while pos < end:
+            match = search(data, pos)
+            stop = match.start() if match else end
+            if stop > pos:
+                out.append(data[pos:stop].decode('latin-1').translate(single_table))
+            if not match:
+                pos = end
+                break
+
+            second, alone = first[data[stop]]
+            if stop + 1 < end:
+                text = second[data[stop + 1]]
+                if text is not None:
+                    out.append(text)
+                    pos = stop + 2
+                    continue
+            elif not final:
+                # The second byte is still on its way
+                pos = stop
+                break
+            out.append(alone)
+            pos = stop + 1
+
+        return ''.join(out), pos
+
+
+class TokenStreamDecoder:
+    """
+    Incremental TokenDecoder for content that arrives in pieces.
+
+    feed() returns the text of every complete token so far and keeps a
+    trailing prefix byte until the next piece shows whether it starts a
+    two-byte token; finish() flushes it.
+    """
+
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self._pending = b''
+
+    def feed(self, data):
+        if self._pending:
+            data = self._pending + bytes(data)
+        text, consumed = self.decoder._decode(data, final=False)
+        self._pending = bytes(data[consumed:])
+        return text
+
+    def finish(self):
+        text, _ = self.decoder._decode(self._pending, final=True)
+        self._pending = b''
+        return text
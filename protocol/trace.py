@@ -0,0 +1,264 @@
+'''Binary session traces: record every frame on the link and replay them as a fake device'''
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import deque
+
+import usb.core
+
+from utils.logger import log, warning
+from protocol.simulated_device import SimulatedEndpoint
+
+TRACE_MAGIC = b'TITRACE1'
+
+# Record header: nanoseconds since the trace started, direction, frame length
+RECORD_HEADER = struct.Struct('<QBI')
+
+# Direction bytes; a zero byte marks the end of the written records
+TRACE_OUT = 1
+TRACE_IN = 2
+DIRECTIONS = {TRACE_OUT: 'OUT', TRACE_IN: 'IN'}
+
+
+class TraceRecorder:
+    """
+    Appends the frames of a session to a memory-mapped trace file.
+
+    Each record is a monotonic timestamp, the direction and the raw frame bytes,
+    so a short session takes a few kilobytes instead of hundreds of hex lines.
+    The file is pre-sized and grown by doubling; records go straight into the
+    mapping, and because unwritten space is zero a trace cut short by a crash
+    still reads back up to its last complete record. close() trims the file to
+    the bytes actually used.
+
+    Args:
+        path: Trace file to create (overwritten if it exists)
+        initial_size: Bytes reserved up front
+    """
+
+    def __init__(self, path, initial_size=1 << 20):
+        self.path = path
+        self.frames = 0
+        self._file = open(path, 'w+b')
+        self._file.truncate(max(initial_size, len(TRACE_MAGIC) + RECORD_HEADER.size))
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._map[:len(TRACE_MAGIC)] = TRACE_MAGIC
+        self._offset = len(TRACE_MAGIC)
+        self._start = time.monotonic_ns()
+        self._lock = threading.Lock()
+
+    def record(self, direction, data):
+        """Append one frame; `direction` is 'OUT' (to the calculator) or 'IN'"""
+        code = TRACE_OUT if direction == 'OUT' else TRACE_IN
+        size = len(data)
+        with self._lock:
+            if self._map is None:
+                return
+            end = self._offset + RECORD_HEADER.size + size
+            # Keep room for the zero direction byte that ends the trace
+            if end + 1 > len(self._map):
+                self._grow(end + 1)
+            RECORD_HEADER.pack_into(self._map, self._offset, time.monotonic_ns() - self._start, code, size)
+            self._map[self._offset + RECORD_HEADER.size:end] = data
+            self._offset = end
+            self.frames += 1
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.resize(size)
+
+    def close(self):
+        with self._lock:
+            if self._map is None:
+                return
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._file.truncate(self._offset)
+            self._file.close()
+        log(f"Trace {self.path}: {self.frames} frames, {self._offset} bytes")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_trace(path):
+    """
+    Yield (seconds since the trace started, 'OUT'/'IN', frame bytes) from a trace file
+
+    Raises:
+        ValueError: the file is not a trace
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < len(TRACE_MAGIC):
+            raise ValueError(f"{path} is not a trace file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+                raise ValueError(f"{path} is not a trace file")
+            offset = len(TRACE_MAGIC)
+            while offset + RECORD_HEADER.size <= len(data):
+                timestamp, code, size = RECORD_HEADER.unpack_from(data, offset)
+                start = offset + RECORD_HEADER.size
+                if code not in DIRECTIONS or start + size > len(data):
+                    # End of the trace, or a record cut short
+                    break
+                yield timestamp / 1e9, DIRECTIONS[code], data[start:start + size]
+                offset = start + size
+
+
+class ReplayedTI84PlusCE:
+    """
+    Fake calculator that plays a recorded trace back to TI84PlusCE.
+
+    Pass it as the `simulator` of a TI84PlusCE. Every write from the host is
+    checked against the next recorded OUT frame, and the IN frames that
+    followed it are handed out with their original spacing divided by `speed`
+    (None to send them as soon as they are read). Writes that differ from the
+    recording are counted in `mismatches` and logged, but the replay goes on.
+
+    Args:
+        trace: Path of a trace file, or a list of (seconds, direction, bytes) records
+        speed: Playback speed relative to the recording
+    """
+
+    idVendor = 0x0451
+    idProduct = 0xe008
+
+    def __init__(self, trace, speed=1.0, bus=0, address=1):
+        self.records = list(read_trace(trace)) if isinstance(trace, (str, os.PathLike)) else list(trace)
+        self.speed = speed
+        self.bus = bus
+        self.address = address
+        self.mismatches = 0
+        self.endpoint_out = SimulatedEndpoint(self, 0x02)
+        self.endpoint_in = SimulatedEndpoint(self, 0x81)
+
+        self._next = 0
+        self._reading = None
+        self._anchor_wall = time.monotonic()
+        self._anchor_trace = self.records[0][0] if self.records else 0.0
+        self._lock = threading.Condition()
+
+    def __str__(self):
+        return (f"REPLAYED DEVICE ID {self.idVendor:04x}:{self.idProduct:04x} "
+                f"on Bus {self.bus:03d} Address {self.address:03d}")
+
+    def finished(self):
+        """True once every recorded frame has been replayed"""
+        return self._next >= len(self.records)
+
+    # --- pyusb device surface used by TI84PlusCE.setup_device ---
+
+    def is_kernel_driver_active(self, interface):
+        return False
+
+    def set_configuration(self, configuration=None):
+        pass
+
+    def get_active_configuration(self):
+        return {(0, 0): [self.endpoint_in, self.endpoint_out]}
+
+    # --- Transfers ---
+
+    def _due(self, timestamp):
+        if not self.speed:
+            return 0.0
+        return self._anchor_wall + (timestamp - self._anchor_trace) / self.speed
+
+    def _host_write(self, data):
+        with self._lock:
+            # IN frames the host never read are dropped
+            while self._next < len(self.records) and self.records[self._next][1] != 'OUT':
+                self._next += 1
+            if self._next >= len(self.records):
+                warning(f"Replay: write after the end of the trace: {data.hex()}")
+                self.mismatches += 1
+                return len(data)
+
+            timestamp, _, expected = self.records[self._next]
+            self._next += 1
+            if data != expected:
+                self.mismatches += 1
+                warning(f"Replay: frame {self._next} differs from the recording")
+                warning(f"Expected: {expected.hex()}")
+                warning(f"Got:      {data.hex()}")
+            # Replies are timed from the moment the host sent this frame
+            self._anchor_wall = time.monotonic()
+            self._anchor_trace = timestamp
+            self._lock.notify_all()
+        return len(data)
+
+    def _host_read(self, size_or_buffer, timeout):
+        into = not isinstance(size_or_buffer, int)
+        size = len(size_or_buffer) if into else size_or_buffer
+        deadline = time.monotonic() + (timeout or 1000) / 1000
+
+        with self._lock:
+            while self._reading is None:
+                if self._next < len(self.records) and self.records[self._next][1] == 'IN':
+                    timestamp, _, frame = self.records[self._next]
+                    wait = self._due(timestamp) - time.monotonic()
+                    if wait <= 0:
+                        self._next += 1
+                        self._reading = memoryview(frame)
+                        break
+                else:
+                    # The recording waits for the host to send something
+                    wait = None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise usb.core.USBTimeoutError('Operation timed out', errno=110)
+                self._lock.wait(remaining if wait is None else min(wait, remaining))
+
+            chunk = self._reading[:size]
+            self._reading = self._reading[size:] if len(self._reading) > size else None
+
+        if into:
+            memoryview(size_or_buffer)[:len(chunk)] = chunk
+            return len(chunk)
+        return array('B', chunk)
+
+
+def main():
+    """Record a session against the simulator, then replay it at original and 10x speed."""
+    import tempfile
+    from protocol.packet_manager import Packet_Manager
+    from protocol.simulated_device import SimulatedTI84PlusCE
+    from protocol.ti_comands import TI84PlusCE
+
+    pm = Packet_Manager()
+    path = os.path.join(tempfile.gettempdir(), 'ti84-session.trace')
+
+    def session(calc):
+        start = time.perf_counter()
+        calc.find_device()
+        calc.setup_device()
+        calc.perform_sequence(pm.preset_packets.init)
+        calc.get_all_program_names()
+        calc.perform_sequence(pm.create_packet('send_prog', title="HELLO", text="HELLO WORLD", replace=False))
+        calc.get_program_content(pm.create_packet('read_prog', title="HELLO"))
+        return (time.perf_counter() - start) * 1000
+
+    sim = SimulatedTI84PlusCE(latency=0.0005, bandwidth=1_000_000)
+    for i in range(20):
+        sim.store_program(f"PROG{i:02d}", bytes.fromhex('544849532949532954455354') * 10)
+    with TraceRecorder(path) as recorder:
+        recorded = session(TI84PlusCE(simulator=sim, recorder=recorder))
+    print(f"{'recorded':<16} {recorded:8.2f} ms  {recorder.frames} frames, {os.path.getsize(path)} bytes")
+
+    for speed in (1.0, 10.0):
+        device = ReplayedTI84PlusCE(path, speed=speed)
+        elapsed = session(TI84PlusCE(simulator=device))
+        print(f"{f'replay at {speed:g}x':<16} {elapsed:8.2f} ms  {device.mismatches} mismatches")
+
+
+if __name__ == "__main__":
+    main()
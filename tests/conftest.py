@@ -0,0 +1,78 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import utils.logger as logger
+from protocol.packet_manager import Packet_Manager
+from protocol.simulated_device import SimulatedTI84PlusCE
+from protocol.ti_comands import TI84PlusCE
+
+
+class FrameLog:
+    """Recorder (same surface as TraceRecorder) that keeps every frame on the link in memory."""
+
+    def __init__(self):
+        self.frames = []
+
+    def record(self, direction, data):
+        self.frames.append((direction, bytes(data)))
+
+    def sent(self):
+        return [data for direction, data in self.frames if direction == 'OUT']
+
+    def received(self):
+        return [data for direction, data in self.frames if direction == 'IN']
+
+    def clear(self):
+        self.frames.clear()
+
+
+@pytest.fixture(autouse=True)
+def log_to_tmp(tmp_path, monkeypatch):
+    """Keep test runs out of the logs directory"""
+    monkeypatch.setattr(logger, '_log_path', str(tmp_path / 'test-log.txt'))
+
+
+@pytest.fixture(scope='session')
+def pm():
+    return Packet_Manager()
+
+
+@pytest.fixture
+def sim():
+    return SimulatedTI84PlusCE(programs={'HELLO': b'HI', 'PROG01': b'\xde' * 40})
+
+
+@pytest.fixture
+def frame_log():
+    return FrameLog()
+
+
+@pytest.fixture
+def calc(sim, pm, frame_log):
+    """TI84PlusCE connected to the simulator, past the init handshake, recording its frames"""
+    calc = TI84PlusCE(simulator=sim, recorder=frame_log)
+    assert calc.find_device() and calc.setup_device()
+    assert calc.run_sequence(pm.preset_packets.init).ok
+    frame_log.clear()
+    return calc
+
+
+@pytest.fixture
+def controller(calc, monkeypatch):
+    """main_controller wired to the simulated calculator, with empty caches"""
+    import main_controller
+    from protocol.async_ti_comands import AsyncTI84PlusCE
+    from protocol.program_contents import ProgramContents
+    from protocol.program_directory import ProgramDirectory
+
+    acalc = AsyncTI84PlusCE(calc)
+    monkeypatch.setattr(main_controller, 'calc', calc)
+    monkeypatch.setattr(main_controller, 'acalc', acalc)
+    monkeypatch.setattr(main_controller, 'directory', ProgramDirectory(calc, ttl=300))
+    monkeypatch.setattr(main_controller, 'contents', ProgramContents(calc, ttl=300))
+    yield main_controller
+    acalc.close()
@@ -0,0 +1,44 @@
+import asyncio
+
+from protocol import frames
+
+
+def test_upload_retried_after_stale_directory(controller, sim, frame_log):
+    controller.list_programs()
+    # Created on the calculator after the directory was cached
+    sim.store_program('NEW', b'OLD')
+
+    controller.send_programs([('NEW', 'X'), ('OTHER', 'Y')])
+
+    assert frames.ERROR_EXISTS in frame_log.received()
+    assert sim.program_tokens('NEW') == b'X' and sim.program_tokens('OTHER') == b'Y'
+
+
+def test_async_upload_retried_after_stale_directory(controller, sim):
+    controller.list_programs()
+    sim.store_program('NEW', b'OLD')
+
+    asyncio.run(controller.send_programs_async([('NEW', 'Z')]))
+
+    assert sim.program_tokens('NEW') == b'Z'
+    assert controller.contents.unchanged('NEW', b'Z')
+
+
+def test_question_poll_notices_programs_edited_on_the_calculator(controller, sim):
+    controller.send_programs([('SEND', 'SEND')])
+    sim.store_program('QUESTION', b'?')
+    for i in range(10):
+        sim.store_program(f'P{i}', b'x')
+    sim.store_program('SEND', b'EDITED ON CALC')
+
+    found = asyncio.run(controller.find_programs_async(('HELLO', 'SEND')))
+
+    assert found == {'HELLO', 'SEND'}
+    assert controller.calc.last_listing['complete'] and not controller.calc.last_listing['stopped']
+    assert not controller.contents.unchanged('SEND', controller.pm.encode_program('SEND'))
+    # The poll read the whole listing, so the next upload needs no listing of its own
+    assert controller.directory.is_valid() and 'P9' in controller.directory
+    listing = controller.calc.last_listing
+    asyncio.run(controller.send_programs_async([('SEND', '')]))
+    assert controller.calc.last_listing is listing
+    assert sim.program_tokens('SEND') == b''
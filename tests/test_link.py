@@ -0,0 +1,94 @@
+import asyncio
+import contextlib
+from array import array
+from types import SimpleNamespace
+
+import usb.core
+
+from protocol import frames
+from protocol.async_ti_comands import AsyncTI84PlusCE
+from protocol.reconnect import ReconnectManager
+from protocol.ti_comands import TI84PlusCE
+
+
+def test_reconnect_uses_the_cached_handshake(sim, pm, frame_log):
+    calc = TI84PlusCE(simulator=sim, recorder=frame_log)
+    manager = ReconnectManager(calc, pm.preset_packets, poll_interval=0.01)
+    assert manager.connect()
+    first_connection = calc.connection_id
+
+    sim.unplug()
+    assert not calc.run_sequence(pm.create_packet('read_prog', title='HELLO')).ok
+    sim.plug()
+    frame_log.clear()
+    assert manager.reconnect(timeout=5)
+
+    assert manager.reconnects == 1
+    assert calc.connection_id == first_connection + 1
+    # Only the short probe ran, not the whole init
+    assert len(frame_log.sent()) < len(pm.preset_packets.init) // 2
+    content = calc.get_program_content(pm.create_packet('read_prog', title='HELLO'))
+    assert pm.parse_program_content(content) == 'HI'
+
+
+def test_async_front_end(calc, sim, pm):
+    for i in range(20):
+        sim.store_program(f'P{i:02d}', b'x')
+    acalc = AsyncTI84PlusCE(calc)
+
+    async def session():
+        result = await acalc.run_sequence(pm.create_packet('send_vars', variables={'A': 1, 'B': 2}))
+        async with contextlib.aclosing(acalc.iter_program_names()) as names:
+            first = await names.__anext__()
+        chunks = [chunk async for chunk in acalc.iter_program_content(pm.create_packet('read_prog', title='PROG01'))]
+        read = pm.parse_variables(await acalc.run_sequence(pm.create_packet('read_vars', names=['A', 'B'])))
+        return result, first, chunks, read
+
+    try:
+        result, first, chunks, read = asyncio.run(session())
+    finally:
+        acalc.close()
+
+    assert result.part_results() == {'A': True, 'B': True}
+    assert first == 'HELLO' and calc.last_listing['stopped']
+    assert b''.join(chunks) == b'\xde' * 40
+    assert read == {'A': 1.0, 'B': 2.0}
+    assert calc.mismatch_count == 0
+
+
+def test_presence_is_checked_at_the_calculators_own_address(pm, monkeypatch):
+    attached = [SimpleNamespace(bus=1, address=5)]
+    monkeypatch.setattr(usb.core, 'find', lambda idVendor, idProduct, custom_match=None: next(
+        (device for device in attached if custom_match is None or custom_match(device)), None))
+    manager = ReconnectManager(TI84PlusCE(bus=1, address=7), pm.preset_packets)
+
+    # Another calculator on the bus does not count
+    assert not manager.device_present()
+    attached.append(SimpleNamespace(bus=1, address=7))
+    assert manager.device_present()
+
+
+class ChunkedEndpoint:
+    """IN endpoint that hands out the given chunks, each cut to the buffer it is read into"""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def read(self, buffer, timeout=None):
+        chunk = self.chunks.pop(0)
+        if len(chunk) > len(buffer):
+            self.chunks.insert(0, chunk[len(buffer):])
+            chunk = chunk[:len(buffer)]
+        buffer[:len(chunk)] = array('B', chunk)
+        return len(chunk)
+
+
+def test_long_frame_that_nearly_fills_the_receive_buffer():
+    calc = TI84PlusCE()
+    small = frames.RAW_HEADER.pack(95, frames.RAW_VIRT_DATA_LAST) + b'\x01' * 95
+    long = frames.RAW_HEADER.pack(3795, frames.RAW_VIRT_DATA_LAST) + b'\x02' * 3795
+    # The long frame arrives in two transfers, the second larger than the room left after compaction
+    calc.endpoint_in = ChunkedEndpoint([small + long[:2400], long[2400:] + b'\x00' * 1000])
+
+    assert bytes(calc.read_frame()) == small
+    assert bytes(calc.read_frame()) == long
@@ -0,0 +1,104 @@
+import contextlib
+
+from protocol import frames
+
+
+BIG_TEXT = "THIS IS A LARGE PROGRAM:" * 2700
+
+
+def is_error(frame):
+    return len(frame) >= frames.VIRTUAL_HEADER_SIZE and frames.frame_opcode(frame) == frames.OP_ERROR
+
+
+def test_small_program_round_trip(calc, sim, pm):
+    assert calc.run_sequence(pm.create_packet('send_prog', title='MSG', text='HELLO WORLD', replace=False)).ok
+    assert sim.program_tokens('MSG') == bytes(pm._text_to_bytes('HELLO WORLD'))
+
+    content = calc.get_program_content(pm.create_packet('read_prog', title='MSG'))
+    assert pm.parse_program_content(content) == 'HELLO WORLD'
+    assert calc.mismatch_count == 0
+
+
+def test_large_upload_is_sent_in_acked_fragments(calc, sim, pm, frame_log):
+    tokens = bytes(pm._text_to_bytes(BIG_TEXT))
+    assert len(tokens) > 60000
+
+    result = calc.run_sequence(pm.create_packet('send_prog', title='BIG', text=BIG_TEXT, replace=False))
+
+    assert result.ok and calc.mismatch_count == 0
+    assert sim.program_tokens('BIG') == tokens
+    assert calc.last_upload['fragments'] > 1
+    sent = frame_log.sent()
+    assert all(len(frame) <= frames.RAW_HEADER_SIZE + calc.max_raw_size for frame in sent)
+    assert sum(frame[4] == frames.RAW_VIRT_DATA for frame in sent) == calc.last_upload['fragments'] - 1
+
+
+def test_large_download_streams_every_fragment(calc, sim, pm):
+    sim.store_program('BIG', pm._text_to_bytes(BIG_TEXT))
+
+    chunks = list(calc.iter_program_content(pm.create_packet('read_prog', title='BIG')))
+
+    assert b''.join(chunks) == sim.program_tokens('BIG')
+    assert len(chunks) == calc.last_download['frames'] > 1
+    assert calc.last_download['complete'] and not calc.last_download['stopped']
+    text = ''.join(pm.iter_program_text(iter(chunks)))
+    assert text == BIG_TEXT
+
+
+def test_download_stopped_early_is_drained(calc, sim, pm, frame_log):
+    sim.store_program('BIG', b'\xde' * 20000)
+
+    with contextlib.closing(calc.iter_program_content(pm.create_packet('read_prog', title='BIG'))) as chunks:
+        next(chunks)
+
+    assert calc.last_download['stopped'] and calc.last_download['complete']
+    assert not any(is_error(frame) for frame in frame_log.sent())
+    # The link is ready for the next transfer
+    content = calc.get_program_content(pm.create_packet('read_prog', title='HELLO'))
+    assert pm.parse_program_content(content) == 'HI'
+    assert calc.mismatch_count == 0
+
+
+def test_listing_yields_program_titles(calc, sim):
+    sim.store_program('THIRD', b'3')
+
+    assert list(calc.iter_program_names()) == ['HELLO', 'PROG01', 'THIRD']
+    assert calc.last_listing['complete'] and calc.last_listing['programs'] == 3
+
+
+def test_listing_stopped_early_is_drained(calc, sim, pm, frame_log):
+    for i in range(20):
+        sim.store_program(f'P{i:02d}', b'x')
+
+    with contextlib.closing(calc.iter_program_names()) as names:
+        assert next(names) == 'HELLO'
+
+    listing = calc.last_listing
+    assert listing['stopped'] and listing['complete']
+    assert listing['entries'] == 22
+    assert not any(is_error(frame) for frame in frame_log.sent())
+    assert len(calc.get_all_program_names()) == 22
+    assert calc.mismatch_count == 0
+
+
+def test_existing_program_without_replace_is_refused(calc, sim, pm, frame_log):
+    result = calc.run_sequence(pm.create_packet('send_prog', title='HELLO', text='AGAIN', replace=False))
+
+    assert frames.ERROR_EXISTS in frame_log.received()
+    assert result.mismatches
+    assert sim.program_tokens('HELLO') == b'HI'
+
+
+def test_short_directory_entry_fails_the_listing(calc, sim, monkeypatch):
+    short = frames.RAW_HEADER.pack(3, frames.RAW_VIRT_DATA_LAST) + b'\x00\x00\x01'
+    monkeypatch.setattr(sim, '_var_header', lambda name, listing=False: short)
+
+    assert calc.get_all_program_names() is False
+    assert not calc.last_listing['complete']
+
+
+def test_short_content_frame_fails_the_download(calc, sim, pm, monkeypatch):
+    short = frames.RAW_HEADER.pack(4, frames.RAW_VIRT_DATA_LAST) + b'\x00\x00\x00\x02'
+    monkeypatch.setattr(sim, '_send_virtual', lambda opcode, payload: sim._send(short))
+
+    assert calc.get_program_content(pm.create_packet('read_prog', title='HELLO')) is None
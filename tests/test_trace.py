@@ -0,0 +1,23 @@
+from protocol.trace import ReplayedTI84PlusCE, TraceRecorder
+from protocol.ti_comands import TI84PlusCE
+
+
+def session(calc, pm):
+    assert calc.find_device() and calc.setup_device()
+    assert calc.run_sequence(pm.preset_packets.init).ok
+    titles = pm.parse_program_titles(calc.get_all_program_names())
+    assert calc.run_sequence(pm.create_packet('send_prog', title='MSG', text='HELLO WORLD', replace=False)).ok
+    content = calc.get_program_content(pm.create_packet('read_prog', title='MSG'))
+    return titles, pm.parse_program_content(content)
+
+
+def test_recorded_session_replays_without_mismatches(sim, pm, tmp_path):
+    path = tmp_path / 'session.trace'
+    with TraceRecorder(str(path)) as recorder:
+        recorded = session(TI84PlusCE(simulator=sim, recorder=recorder), pm)
+
+    device = ReplayedTI84PlusCE(str(path), speed=None)
+    replayed = session(TI84PlusCE(simulator=device), pm)
+
+    assert replayed == recorded == (['HELLO', 'PROG01'], 'HELLO WORLD')
+    assert device.mismatches == 0 and device.finished()
@@ -0,0 +1,75 @@
+import numpy as np
+
+from protocol import frames, ti_numbers
+
+
+def stored(sim, name):
+    return sim.variables.get(name.encode('ascii'))
+
+
+def test_batch_upload_reports_every_variable(calc, sim, pm):
+    packet = pm.create_packet('send_vars', variables={'A': 1.5, 'b': '-2,25', 'C': 'nope', 'D': 3 - 4j})
+
+    result = calc.run_sequence(packet)
+
+    assert result.part_results() == {'A': True, 'B': True, 'D': True}
+    assert stored(sim, 'A') == (frames.TYPE_REAL, ti_numbers.encode_real(1.5))
+    assert stored(sim, 'B') == (frames.TYPE_REAL, ti_numbers.encode_real(-2.25))
+    assert stored(sim, 'D')[0] == frames.TYPE_COMPLEX
+    assert stored(sim, 'C') is None
+    assert calc.mismatch_count == 0
+
+
+def test_batch_upload_merges_names_that_differ_in_case(calc, sim, pm):
+    result = calc.run_sequence(pm.create_packet('send_vars', variables={'a': 1, 'A': 2}))
+
+    assert result.part_results() == {'A': True}
+    assert stored(sim, 'A') == (frames.TYPE_REAL, ti_numbers.encode_real(2))
+
+
+def test_read_back_reals_lists_and_matrices(calc, pm):
+    values = np.linspace(-5, 5, 999)
+    matrix = np.arange(12.0).reshape(3, 4)
+    assert calc.run_sequence(pm.create_packet('send_vars', variables={'X': 1781000, 'Y': -0.5, 'Z': 2 - 3j})).ok
+    assert calc.run_sequence(pm.create_packet('send_list', name='L1', values=values)).ok
+    assert calc.run_sequence(pm.create_packet('send_matrix', name='[B]', values=matrix)).ok
+
+    result = calc.run_sequence(pm.create_packet('read_vars', names=['X', 'Y', 'Z', 'L1', '[B]', 'Q']))
+    read = pm.parse_variables(result)
+
+    assert read['X'] == 1781000.0 and read['Y'] == -0.5 and read['Z'] == 2 - 3j
+    np.testing.assert_allclose(read['L1'], values, rtol=1e-13)
+    np.testing.assert_array_equal(read['[B]'], matrix)
+    assert read['Q'] is None
+    assert calc.mismatch_count == 0
+
+
+def test_short_real_does_not_shift_the_others(calc, sim, pm):
+    assert calc.run_sequence(pm.create_packet('send_vars', variables={'A': 1.5, 'B': 2, 'C': 3})).ok
+    var_type, data = sim.variables[b'A']
+    sim.variables[b'A'] = (var_type, data[:5])
+
+    read = pm.parse_variables(calc.run_sequence(pm.create_packet('read_vars', names=['A', 'B', 'C'])))
+
+    assert read == {'A': None, 'B': 2.0, 'C': 3.0}
+
+
+def test_codec_round_trip(pm):
+    values = np.array([0.0, 1.0, -1.0, 3.14159, 1e-99, -9.9999999999999e99, 123456789012345.0])
+
+    decoded = ti_numbers.decode_reals(ti_numbers.encode_reals(values))
+
+    np.testing.assert_allclose(decoded, values, rtol=1e-13)
+    assert pm._encode_ti_number("0,25") == ti_numbers.encode_real(0.25)
+    assert pm._encode_ti_number("-12.5") == ti_numbers.encode_reals([-12.5]).tobytes()
+
+
+def test_packets_share_the_fixed_template_steps(pm):
+    first = pm.create_packet('send_var', var_name='A', var_value=1)
+    second = pm.create_packet('send_var', var_name='B', var_value=2)
+
+    # Only the header and the data step are built per packet
+    shared = [number for number, (a, b) in enumerate(zip(first, second)) if a is b]
+    assert shared == [1, 2, 3, 4, 5, 7, 8, 9, 10, 11]
+    assert type(first.steps[0].data) is bytes and type(first.steps[6].data) is bytes
+    assert first.steps[6].data == frames.variable_content(ti_numbers.encode_real(1.0))
@@ -1,31 +1,51 @@
 '''Contains all helper functions to reduce clutter'''
+import math
 
-def string_is_valid_number(s):
-        if not isinstance(s, str):
-            return False
-
-        # Check for a valid float with optional decimal point
-        try:
-            float(s)
-        except ValueError:
-            return False  # not a valid float
+# Magnitude a TI real has to stay below
+TI_REAL_LIMIT = 1e100
 
-        # Split into parts to count digits
-        parts = s.split(".")
 
-        # Allow at most one dot
-        if len(parts) > 2:
-            return False
+def parse_number(value):
+    """
+    Turn a number or number string into a float or complex the calculator can store.
 
-        # Count digits, ignore dot and optional leading minus sign
-        digits = ''.join(parts)
-        if digits.startswith('-'):
-            return False
+    Strings may use ',' as the decimal separator and 'i' for the imaginary
+    unit (e.g. "-1,5", "2.5e-3", "3+2i").
 
-        if not digits.isdigit():
-            return False
+    Returns:
+        float, complex, or None if the value is not a finite number below 1e100
+    """
+    if isinstance(value, str):
+        text = value.strip().replace(',', '.')
+        try:
+            value = float(text)
+            # NaN fails both comparisons
+            return value if -TI_REAL_LIMIT < value < TI_REAL_LIMIT else None
+        except ValueError:
+            if 'i' not in text and 'j' not in text:
+                return None
+            try:
+                value = complex(text.replace(' ', '').replace('i', 'j'))
+            except ValueError:
+                return None
+    elif not isinstance(value, (int, float)):
+        try:
+            value = complex(value)
+        except (TypeError, ValueError):
+            return None
+
+    if isinstance(value, complex):
+        if value.imag:
+            in_range = all(math.isfinite(part) and abs(part) < TI_REAL_LIMIT for part in (value.real, value.imag))
+            return value if in_range else None
+        value = value.real
+    try:
+        value = float(value)
+    except OverflowError:
+        return None
+    return value if math.isfinite(value) and abs(value) < TI_REAL_LIMIT else None
 
-        if len(digits) > 10:
-            return False
 
-        return True
\ No newline at end of file
+def string_is_valid_number(s):
+    """True if `s` is a string holding a real or complex number the calculator can store."""
+    return isinstance(s, str) and parse_number(s) is not None
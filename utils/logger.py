@@ -1,5 +1,10 @@
 # logger.py
+import atexit
 import os
+import queue
+import threading
+import time
+from collections import deque
 from datetime import datetime
 
 # Get the absolute path to the directory one level up from this file
@@ -9,20 +14,118 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 log_dir = os.path.join(project_root, 'logs')
 os.makedirs(log_dir, exist_ok=True)
 
+# Severity levels, lowest first
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+# Messages below this level are dropped before they are formatted
+_level = INFO
+
+# Written in front of messages at these levels
+_LEVEL_PREFIXES = {WARNING: "WARNING: ", ERROR: "ERROR: "}
+
 # Default log path (can be updated by create_new_log)
 _log_path = None
 
-def create_new_log(name: str = None):
+# Log files this process knows about, oldest first (filled from the directory once)
+_log_files = None
+
+# Most recent frames on the link, for post-mortems
+recent_frames = deque(maxlen=256)
+
+
+class Hex:
+    """Log argument that hex-encodes its data only if the message is actually written."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return bytes(self.data).hex()
+
+
+class _Writer(threading.Thread):
+    """Background thread that appends queued lines to the log file in batches."""
+
+    def __init__(self, batch_size=256):
+        super().__init__(name="log-writer", daemon=True)
+        self.lines = queue.Queue()
+        self.batch_size = batch_size
+        self._file = None
+        self._path = None
+
+    def run(self):
+        while True:
+            batch = [self.lines.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.lines.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except OSError as e:
+                print(f"Failed to write log file {self._path}: {e}")
+            finally:
+                for _ in batch:
+                    self.lines.task_done()
+
+    def _write(self, batch):
+        # Lines are (path, text); consecutive lines for the same file go out in one write
+        start = 0
+        for i in range(1, len(batch) + 1):
+            if i == len(batch) or batch[i][0] != batch[start][0]:
+                path = batch[start][0]
+                if path != self._path:
+                    if self._file is not None:
+                        self._file.close()
+                    self._file = open(path, "a")
+                    self._path = path
+                self._file.write(''.join(text for _, text in batch[start:i]))
+                start = i
+        self._file.flush()
+
+    def close_file(self, path):
+        """Drop the open handle if it belongs to `path` (called once the queue is drained)."""
+        if self._path == path and self._file is not None:
+            self._file.close()
+            self._file = None
+            self._path = None
+
+
+_writer = _Writer()
+_writer.start()
+
+
+def set_level(level):
+    """Only write messages at `level` or above (DEBUG, INFO, WARNING, ERROR)."""
+    global _level
+    _level = level
+
+
+def is_enabled(level):
+    return level >= _level
+
+
+def create_new_log(name: str = None, level: int = None):
     """
     Creates a new log file with the current date and time.
-    Optionally takes a name to make the log more identifiable.
+    Optionally takes a name to make the log more identifiable, and a level
+    to change which messages are written.
     Also deletes oldest logs if there are more than 5.
     """
     global _log_path
 
+    if level is not None:
+        set_level(level)
+
     # Generate timestamped filename
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    
+
     if name:
         safe_name = name.replace(" ", "_").replace("/", "_")
         log_filename = f"{timestamp}-{safe_name}-log.txt"
@@ -30,18 +133,23 @@ def create_new_log(name: str = None):
         log_filename = f"{timestamp}-log.txt"
 
     _log_path = os.path.join(log_dir, log_filename)
-
-    # Create an empty file immediately (optional, but helpful)
-    with open(_log_path, "w") as f:
-        f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Log created.\n")
+    _writer.lines.put((_log_path, f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Log created.\n"))
 
     # Clean up old log files
-    _enforce_log_limit(max_logs=5)
+    _enforce_log_limit(_log_path, max_logs=5)
 
-def log(message: str):
+
+def log(message: str, *args, level: int = INFO):
     """
-    Writes a timestamped log message to the current log file.
+    Queues a timestamped log message for the current log file.
+
+    With `args`, the message is a %-format string that is only formatted if
+    `level` is enabled, so expensive arguments (e.g. Hex(frame)) cost nothing
+    when their level is switched off.
     """
+    if level < _level:
+        return
+
     global _log_path
 
     # Fallback to daily file if no log has been created
@@ -49,28 +157,74 @@ def log(message: str):
         date_filename = datetime.now().strftime("%Y-%m-%d") + "-log.txt"
         _log_path = os.path.join(log_dir, date_filename)
 
+    if args:
+        message = message % args
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    formatted = f"[{timestamp}] {message}"
+    _writer.lines.put((_log_path, f"[{timestamp}] {_LEVEL_PREFIXES.get(level, '')}{message}\n"))
+
+
+def debug(message: str, *args):
+    log(message, *args, level=DEBUG)
+
+
+def warning(message: str, *args):
+    log(message, *args, level=WARNING)
 
-    with open(_log_path, "a") as log_file:
-        log_file.write(formatted + "\n")
 
+def error(message: str, *args):
+    log(message, *args, level=ERROR)
 
-def _enforce_log_limit(max_logs=5):
+
+def flush():
+    """Block until every queued message has been written."""
+    _writer.lines.join()
+
+
+def record_frame(direction: str, data):
+    """Remember a frame sent ('OUT') or received ('IN') in the recent_frames ring buffer."""
+    recent_frames.append((time.time(), direction, bytes(data)))
+
+
+def dump_recent_frames(reason: str = None):
+    """Write the recent frames to the log regardless of level, oldest first."""
+    frames = list(recent_frames)
+    lines = [f"Last {len(frames)} frames{f' before {reason}' if reason else ''}:"]
+    for timestamp, direction, data in frames:
+        moment = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S.%f")[:-3]
+        lines.append(f"  {moment} {direction:<3} {data.hex()}")
+    log('\n'.join(lines), level=ERROR)
+
+
+def _enforce_log_limit(new_path, max_logs=5):
     """
     Deletes the oldest log files if there are more than `max_logs` in the directory.
+
+    The directory is only listed the first time; after that the new log is
+    appended to the list kept in memory.
     """
-    log_files = [f for f in os.listdir(log_dir) if f.endswith(".txt")]
-    if len(log_files) <= max_logs:
-        return
+    global _log_files
 
-    # Sort by creation time (oldest first)
-    full_paths = [os.path.join(log_dir, f) for f in log_files]
-    full_paths.sort(key=os.path.getctime)
+    if _log_files is None:
+        log_files = [os.path.join(log_dir, f) for f in os.listdir(log_dir) if f.endswith(".txt")]
+        # Sort by creation time (oldest first)
+        log_files.sort(key=os.path.getctime)
+        _log_files = deque(log_files)
+    if new_path not in _log_files:
+        _log_files.append(new_path)
 
     # Delete oldest files to maintain the limit
-    for path in full_paths[:-max_logs]:
+    while len(_log_files) > max_logs:
+        path = _log_files.popleft()
+        if path == new_path:
+            continue
+        _writer.lines.join()
+        _writer.close_file(path)
         try:
             os.remove(path)
+        except FileNotFoundError:
+            pass
         except Exception as e:
             print(f"Failed to delete log file {path}: {e}")
+
+
+atexit.register(flush)
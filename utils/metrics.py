@@ -0,0 +1,153 @@
+'''Latency histograms and counters for the USB link, with Prometheus text and JSON export'''
+import bisect
+import json
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds, roughly 1-2-5 steps from 0.1 ms to 30 s
+BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+           0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout, plus min/max."""
+
+    __slots__ = ('counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self):
+        # One slot per bound, and a last one for everything above
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (max for the overflow bucket)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': {str(bound): count for bound, count in zip(BUCKETS + ('+Inf',), self.counts)},
+        }
+
+
+class LinkMetrics:
+    """
+    Timings and counters for one calculator link.
+
+    Operations (a whole handshake, directory listing, upload or read) and
+    individual steps (e.g. "IN Ack") each get a latency Histogram; counters
+    track frames, bytes, timeouts, mismatches and errors. Updates come from
+    the USB I/O thread and snapshots from anywhere, so access is locked.
+    """
+
+    COUNTERS = ('frames_out', 'frames_in', 'bytes_out', 'bytes_in',
+                'timeouts', 'mismatches', 'send_errors', 'receive_errors')
+
+    def __init__(self):
+        self.started = time.time()
+        self.operations = {}
+        self.steps = {}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def observe_operation(self, name, seconds):
+        with self._lock:
+            histogram = self.operations.get(name)
+            if histogram is None:
+                histogram = self.operations[name] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_step(self, name, seconds):
+        with self._lock:
+            histogram = self.steps.get(name)
+            if histogram is None:
+                histogram = self.steps[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        """Everything as plain data (see to_json/to_prometheus)"""
+        with self._lock:
+            return {
+                'started': self.started,
+                'taken': time.time(),
+                'counters': dict(self.counters),
+                'operations': {name: h.to_dict() for name, h in sorted(self.operations.items())},
+                'steps': {name: h.to_dict() for name, h in sorted(self.steps.items())},
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix='ti84'):
+        """Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot['counters'].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        for kind in ('operations', 'steps'):
+            metric = f"{prefix}_{kind[:-1]}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in snapshot[kind].items():
+                label = name.replace('\\', '\\\\').replace('"', '\\"')
+                cumulative = 0
+                for bound, count in histogram['buckets'].items():
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{name="{label}"}} {histogram["sum"]:.6f}')
+                lines.append(f'{metric}_count{{name="{label}"}} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_snapshot(self, path):
+        """Write a snapshot file: Prometheus text for .prom/.txt paths, JSON otherwise"""
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(text)
+        # Readers never see a half-written file
+        os.replace(temporary, path)
+
+    def summary(self):
+        """Short human readable report, e.g. for the Discord /stats command"""
+        snapshot = self.snapshot()
+        counters = snapshot['counters']
+        uptime = snapshot['taken'] - snapshot['started']
+        lines = [f"Link stats over {uptime / 60:.0f} min: "
+                 f"{counters['frames_out']} frames out ({counters['bytes_out']} B), "
+                 f"{counters['frames_in']} in ({counters['bytes_in']} B), "
+                 f"{counters['timeouts']} timeouts, {counters['mismatches']} mismatches, "
+                 f"{counters['send_errors'] + counters['receive_errors']} errors"]
+        for kind in ('operations', 'steps'):
+            if snapshot[kind]:
+                lines.append(f"{kind.capitalize()} (count, p50 / p95 / max ms):")
+            for name, h in snapshot[kind].items():
+                lines.append(f"  {name}: {h['count']}, {h['p50'] * 1000:.1f} / {h['p95'] * 1000:.1f} / {h['max'] * 1000:.1f}")
+        return '\n'.join(lines)